@@ -1,7 +1,13 @@
 import os
 import json
+import threading
+import time
+from functools import lru_cache
+import requests
 import google.generativeai as genai
 from dotenv import load_dotenv
+from Gemenai_workflow.spec_cache import SpecCache, cache_key, normalize_text
+from Gemenai_workflow.json_stream import JsonFieldStream
 
 load_dotenv()
 
@@ -37,8 +43,28 @@ if __name__ == "__main__":
     product_paragraph = create_product_paragraph(product_json)
     print(product_paragraph)
 
-# Initialize Gemini
-genai.configure(api_key=os.getenv("GENAI_API_KEY"))
+# Initialize Gemini, GENAI_API_ENDPOINT points to a stand-in server (e.g. testing/fake_llm_server.py)
+if os.getenv("GENAI_API_ENDPOINT"):
+    genai.configure(
+        api_key=os.getenv("GENAI_API_KEY", "local"),
+        transport="rest",
+        client_options={"api_endpoint": os.getenv("GENAI_API_ENDPOINT")},
+    )
+else:
+    genai.configure(api_key=os.getenv("GENAI_API_KEY"))
+
+MODEL_NAME = "gemini-2.0-pro-exp-02-05"
+
+# "two_step" runs the extraction and the content creation calls, "single" does both in one streamed call
+CONTENT_MODE = os.getenv("CONTENT_MODE", "two_step")
+
+# Cache of the LLM results, shared by every request of the process
+spec_cache = SpecCache(
+    cache_dir=os.getenv("SPEC_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")),
+    ttl=float(os.getenv("SPEC_CACHE_TTL", "86400")),
+    max_memory_entries=int(os.getenv("SPEC_CACHE_MEMORY_ENTRIES", "256")),
+    max_disk_bytes=int(os.getenv("SPEC_CACHE_DISK_MB", "50")) * 1024 * 1024,
+)
 
 # System Prompts
 PRODUCT_EXTRACTION_PROMPT = """You are a marketing assistant. Extract product details from the input and return a JSON with:
@@ -54,38 +80,226 @@ CONTENT_CREATION_PROMPT = """You are a viral content creator. Generate content f
 4. image_prompt: A paragraph describing a static image for the product post.
 5. caption: A single paragraph combining the caption and hashtags (125 chars max)."""
 
+# Single round trip: image_prompt comes first so the image can be generated while the rest streams in
+COMBINED_CONTENT_PROMPT = """You are a marketing assistant and viral content creator. From the product description and the trend context, generate content for a 10-second TikTok/X post. Return a JSON with the fields in this exact order:
+1. image_prompt: A paragraph describing a static image for the product post.
+2. video_prompt: A paragraph describing a single-scene video (10s) with product focus and visual style.
+3. audio_prompt: A paragraph describing the voiceover and the speaker's tone for the post that will be combined with the video.
+4. script: A paragraph with the 10-second narration (120-150 words)
+5. caption: A single paragraph combining the caption and hashtags (125 chars max).
+6. product_info: An object with product_name (5 words max), key_features (3-5 main selling points in one flowing sentence), target_audience (the primary demographic) and call_to_action (a short, actionable phrase)."""
+
+CONTENT_FIELDS = ["image_prompt", "video_prompt", "audio_prompt", "script", "caption"]
+PRODUCT_FIELDS = ["product_name", "key_features", "target_audience", "call_to_action"]
+
+COMBINED_CONTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **{field: {"type": "string"} for field in CONTENT_FIELDS},
+        "product_info": {
+            "type": "object",
+            "properties": {field: {"type": "string"} for field in PRODUCT_FIELDS},
+            "required": PRODUCT_FIELDS,
+        },
+    },
+    "required": CONTENT_FIELDS + ["product_info"],
+}
+
 TEST_TRENDS = """On February 14, 2025, Valentine's Day celebrations showcased evolving trends. Notably, consumers shifted from traditional gifts toward experiential presents, with interest in massages, event tickets, and travel surging by 104%, 238%, and 59%\ respectively, while candy and cookie interest declined by 13%. 
  Social media platforms, especially TikTok, influenced gift choices and planning, with users seeking unique and personalized experiences. 
  Additionally, sales of tinned fish, such as anchovies and sardines, increased by over 30%\ at Selfridges, driven by social media influencers and celebrity chefs. 
  These trends reflect a broader move toward meaningful, diverse, and unconventional expressions of affection.
 """
 
+# Trend analyser serving the trend digest at /trend-context (Trend_analyser/TrendAnalyser.py), TEST_TRENDS without it
+TREND_SERVER = os.getenv("TREND_SERVER")
+TREND_TOPIC = os.getenv("TREND_TOPIC")
+# The digest is refreshed as videos are analyzed, a context this recent is reused without asking again
+TREND_CONTEXT_TTL = float(os.getenv("TREND_CONTEXT_TTL", "60"))
+
+_trend_contexts = {}  # topic -> (fetch time, context)
+_trend_contexts_lock = threading.Lock()
+
+
+def current_trends(topic: str = TREND_TOPIC) -> str:
+    """
+    Returns the latest trend context of the trend analyser, falling back to `TEST_TRENDS` when it is not configured,
+    not reachable or has no analysis yet.
+    """
+    if not TREND_SERVER:
+        return TEST_TRENDS
+    with _trend_contexts_lock:
+        cached = _trend_contexts.get(topic)
+    if cached and time.monotonic() - cached[0] < TREND_CONTEXT_TTL:
+        return cached[1]
+    try:
+        response = requests.get(f"{TREND_SERVER.rstrip('/')}/trend-context", params={"topic": topic} if topic else None, timeout=5)
+        response.raise_for_status()
+        context = response.json()["context"]
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Could not fetch the trend context, using the cached or test trends: {e}")
+        return cached[1] if cached else TEST_TRENDS
+    with _trend_contexts_lock:
+        _trend_contexts[topic] = (time.monotonic(), context)
+    return context
+
 
-def process_user_input(user_input: str, trends_analysis: str = TEST_TRENDS) -> dict:    
-    # First LLM Call - Product Extraction
-    extraction_model = genai.GenerativeModel(
-        model_name="gemini-2.0-pro-exp-02-05",
+@lru_cache(maxsize=8)
+def get_json_model(model_name: str, system_instruction: str) -> genai.GenerativeModel:
+    """Returns a Gemini model answering in JSON, built once per (model, system prompt)."""
+    return genai.GenerativeModel(
+        model_name=model_name,
         generation_config={"response_mime_type": "application/json"},
-        system_instruction=PRODUCT_EXTRACTION_PROMPT
+        system_instruction=system_instruction
     )
-    
-    extraction_chat = extraction_model.start_chat()
-    product_info_response =  extraction_chat.send_message(user_input)
-    product_info = json.loads(product_info_response.text)
 
-    # Second LLM Call - Content Creation
-    creation_model = genai.GenerativeModel(
-        model_name="gemini-2.0-pro-exp-02-05",
-        generation_config={"response_mime_type": "application/json"},
-        system_instruction=CONTENT_CREATION_PROMPT.format(trends=trends_analysis)
+
+@lru_cache(maxsize=2)
+def get_combined_model(model_name: str) -> genai.GenerativeModel:
+    """Returns the Gemini model of the single round trip, constrained to `COMBINED_CONTENT_SCHEMA`, built once."""
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config={"response_mime_type": "application/json", "response_schema": COMBINED_CONTENT_SCHEMA},
+        system_instruction=COMBINED_CONTENT_PROMPT
     )
 
-    creation_chat = creation_model.start_chat()
-    final_content_response =  creation_chat.send_message(
-        f"Product details: {json.dumps(product_info)}\nTrend context: {trends_analysis}"
+
+def extract_product_info(user_input: str) -> dict:
+    """
+    First LLM call: extracts the product details from the user input, cached by normalized input.
+    """
+    key = cache_key("extraction", MODEL_NAME, PRODUCT_EXTRACTION_PROMPT, normalize_text(user_input))
+    product_info = spec_cache.get(key)
+    if product_info is None:
+        extraction_chat = get_json_model(MODEL_NAME, PRODUCT_EXTRACTION_PROMPT).start_chat()
+        product_info_response = extraction_chat.send_message(user_input)
+        product_info = json.loads(product_info_response.text)
+        spec_cache.set(key, product_info)
+    return product_info
+
+
+def create_content(product_info: dict, trends_analysis: str) -> dict:
+    """
+    Second LLM call: creates the content specs from the product details and the trends, cached by both.
+    """
+    system_instruction = CONTENT_CREATION_PROMPT.format(trends=trends_analysis)
+    key = cache_key("creation", MODEL_NAME, system_instruction, product_info, normalize_text(trends_analysis))
+    final_content = spec_cache.get(key)
+    if final_content is None:
+        creation_chat = get_json_model(MODEL_NAME, system_instruction).start_chat()
+        final_content_response = creation_chat.send_message(
+            f"Product details: {json.dumps(product_info)}\nTrend context: {trends_analysis}"
+        )
+        final_content = json.loads(final_content_response.text)
+        spec_cache.set(key, final_content)
+    return final_content
+
+
+def process_user_input(user_input: str, trends_analysis: str = None) -> dict:
+    trends_analysis = trends_analysis or current_trends()
+    # The extraction is cached on its own, so new trends only re-run the second call
+    product_info = extract_product_info(user_input)
+    return create_content(product_info, trends_analysis)
+
+
+def validate_content_specs(specs) -> list:
+    """
+    Checks the output of the single round trip against `COMBINED_CONTENT_SCHEMA`.
+
+    Returns:
+        list[str]: The problems found, empty if the specs are valid.
+    """
+    if not isinstance(specs, dict):
+        return ["content specs are not a JSON object"]
+    errors = [f"{field} must be a non-empty string" for field in CONTENT_FIELDS
+              if not isinstance(specs.get(field), str) or not specs[field].strip()]
+    product_info = specs.get("product_info")
+    if not isinstance(product_info, dict):
+        errors.append("product_info must be an object")
+    else:
+        errors += [f"product_info.{field} must be a string" for field in PRODUCT_FIELDS
+                   if not isinstance(product_info.get(field), str)]
+    return errors
+
+
+def process_user_input_single(user_input: str, trends_analysis: str = None, on_field=None) -> dict:
+    """
+    Generates the product info and the content specs in a single streamed LLM call.
+
+    Falls back to the two-step `process_user_input` when the output does not match the schema.
+
+    Args:
+        user_input (str): The user's product description.
+        trends_analysis (str): The trend context, the latest one of the trend analyser if None.
+        on_field (callable): Called as `on_field(name, value)` for each content field as soon as it has streamed in
+            (e.g. to start the image from "image_prompt" before the rest is generated), once per field. Fields
+            published before the answer is rejected are kept in the fallback's specs, so the stages started on them
+            match the returned specs.
+
+    Returns:
+        dict: The content specs, with the product details under "product_info".
+    """
+    trends_analysis = trends_analysis or current_trends()
+    key = cache_key("combined", MODEL_NAME, COMBINED_CONTENT_PROMPT, normalize_text(user_input), normalize_text(trends_analysis))
+    final_content = spec_cache.get(key)
+    if final_content is not None:
+        if on_field is not None:
+            for field in CONTENT_FIELDS:
+                on_field(field, final_content[field])
+        return final_content
+
+    response = get_combined_model(MODEL_NAME).generate_content(
+        f"Product description: {user_input}\nTrend context: {trends_analysis}",
+        stream=True,
     )
-    final_content = json.loads(final_content_response.text)
 
+    published = {}
+
+    def publish(field: str, value):
+        if field not in published:
+            published[field] = value
+            if on_field is not None:
+                on_field(field, value)
+
+    field_stream = JsonFieldStream(CONTENT_FIELDS)
+    for chunk in response:
+        for field, value in field_stream.feed(chunk.text).items():
+            # An empty field would be rejected by the validation, it is left to the fallback
+            if value.strip():
+                publish(field, value)
+
+    try:
+        final_content = json.loads(field_stream.text)
+        errors = validate_content_specs(final_content)
+    except ValueError as e:
+        errors = [f"invalid JSON: {e}"]
+    if errors:
+        print(f"Single round trip output rejected ({'; '.join(errors)}), falling back to two steps")
+        # The fields already published may have started stages, they replace the fallback's
+        final_content = {**process_user_input(user_input, trends_analysis), **published}
+    else:
+        spec_cache.set(key, final_content)
+    for field in CONTENT_FIELDS:
+        publish(field, final_content[field])
+    return final_content
+
+
+def generate_content_specs(user_input: str, trends_analysis: str = None, on_field=None) -> dict:
+    """
+    Generates the content specs with the configured `CONTENT_MODE`, from the latest trends unless `trends_analysis`
+    is given.
+
+    `on_field(name, value)` is called once for every content field: as soon as it has streamed in with the
+    "single" mode, once the specs are final otherwise.
+    """
+    if CONTENT_MODE == "single":
+        return process_user_input_single(user_input, trends_analysis, on_field=on_field)
+
+    trends_analysis = trends_analysis or current_trends()
+    final_content = process_user_input(user_input, trends_analysis)
+    if on_field is not None:
+        for field in CONTENT_FIELDS:
+            on_field(field, final_content[field])
     return final_content
 
 # Example Usage
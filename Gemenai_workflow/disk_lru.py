@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+
+class DiskLRUStore:
+    """
+    Directory of files keyed by name, bounded in size by evicting the least recently used files first.
+
+    Writes are atomic (temporary file then rename) and reads refresh the modification time that orders the
+    eviction. With a `ttl`, files not read or written for that long are dropped as well. Each service runs from its
+    own directory and keeps its own copy of this module, keep it the same as Models_workflow/disk_lru.py.
+    """
+
+    def __init__(self, directory: str, suffix: str, max_bytes: int, ttl: float = None):
+        """
+        Args:
+            directory (str): Where the files are stored, created if missing.
+            suffix (str): The extension of the files, e.g. ".json".
+            max_bytes (int): The maximum total size of the files.
+            ttl (float): Seconds after which an unused file is dropped, never if None.
+        """
+        self.directory = directory
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def read(self, key: str) -> bytes:
+        """Returns the content stored under `key`, None if there is none."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except OSError:
+            return None
+        return data
+
+    def write(self, key: str, data: bytes) -> bool:
+        """Stores `data` under `key`, then evicts past `max_bytes`. Returns False if it could not be written."""
+        path = self.path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Failed to write {path}: {e}")
+            self._remove(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def remove(self, key: str):
+        self._remove(self.path(key))
+
+    def usage(self) -> tuple:
+        """Returns the number of files and their total size in bytes."""
+        files = self._files()
+        return len(files), sum(size for _, size, _ in files)
+
+    def evict(self):
+        """Drops the expired files, then the least recently used ones until the store fits in `max_bytes`."""
+        files = self._files()
+        if self.ttl is not None:
+            now = time.time()
+            for mtime, _, path in files:
+                if now - mtime > self.ttl:
+                    self._remove(path)
+            files = [file for file in files if now - file[0] <= self.ttl]
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _files(self) -> list:
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,42 @@
+import json
+import re
+
+
+class JsonFieldStream:
+    """
+    Picks string fields out of a JSON object while it is still being streamed.
+
+    Feed the text chunks as they arrive; every watched field is returned once, as soon as its value
+    (a complete JSON string) has been received, without waiting for the rest of the document.
+    """
+
+    def __init__(self, fields):
+        """
+        Args:
+            fields (list[str]): The names of the string fields to watch for.
+        """
+        self.text = ""
+        self._pending = {field: re.compile(r'"%s"\s*:\s*"' % re.escape(field)) for field in fields}
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk: str) -> dict:
+        """
+        Adds a chunk of the streamed document.
+
+        Returns:
+            dict: The watched fields whose value completed with this chunk.
+        """
+        self.text += chunk
+        completed = {}
+        for field, pattern in list(self._pending.items()):
+            match = pattern.search(self.text)
+            if match is None:
+                continue
+            try:
+                value, _ = self._decoder.raw_decode(self.text, match.end() - 1)
+            except ValueError:
+                # The string value has not been fully received yet
+                continue
+            completed[field] = value
+            del self._pending[field]
+        return completed
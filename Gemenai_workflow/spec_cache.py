@@ -0,0 +1,104 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from Gemenai_workflow.disk_lru import DiskLRUStore
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes free text so near-identical inputs (case, spacing) share cache entries."""
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(*parts) -> str:
+    """
+    Builds a content-addressed cache key from JSON-serializable parts.
+
+    Returns:
+        str: The SHA-256 hex digest of the parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SpecCache:
+    """
+    Two-tier cache for LLM results: an in-memory LRU in front of an on-disk store.
+
+    Entries expire after `ttl` seconds in both tiers. The memory tier keeps at most `max_memory_entries`
+    entries and the disk tier at most `max_disk_bytes`, evicting the least recently used files first.
+    """
+
+    def __init__(self, cache_dir: str, ttl: float = 86400, max_memory_entries: int = 256, max_disk_bytes: int = 50 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): The directory of the on-disk store.
+            ttl (float): Time to live of an entry in seconds.
+            max_memory_entries (int): The maximum number of entries kept in memory.
+            max_disk_bytes (int): The maximum size of the on-disk store in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = DiskLRUStore(cache_dir, ".json", max_disk_bytes, ttl=ttl)
+
+    def get(self, key: str):
+        """Returns the cached value for `key`, or None if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry[1]
+
+    def set(self, key: str, value):
+        """Stores a JSON-serializable value in both tiers."""
+        entry = (time.time(), value)
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key, now):
+        data = self._disk.read(key)
+        if data is None:
+            return None
+        try:
+            record = json.loads(data)
+        except ValueError:
+            return None
+        if now - record["created_at"] > self.ttl:
+            self._disk.remove(key)
+            return None
+        return record["created_at"], record["value"]
+
+    def _write_disk(self, key, entry):
+        self._disk.write(key, json.dumps({"created_at": entry[0], "value": entry[1]}).encode("utf-8"))
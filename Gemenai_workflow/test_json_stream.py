@@ -0,0 +1,35 @@
+import json
+
+from json_stream import JsonFieldStream
+
+
+def feed_in_chunks(stream, text, size):
+    completed = []
+    for i in range(0, len(text), size):
+        completed.append(stream.feed(text[i:i + size]))
+    return completed
+
+
+def test_fields_complete_once_their_value_is_received():
+    stream = JsonFieldStream(["image_prompt", "caption"])
+    assert stream.feed('{"image_prompt": "A red ') == {}
+    assert stream.feed('bike", "cap') == {"image_prompt": "A red bike"}
+    assert stream.feed('tion": "Ride"}') == {"caption": "Ride"}
+    assert stream.feed("") == {}
+
+
+def test_every_chunking_gives_the_same_fields():
+    document = json.dumps({"image_prompt": 'A "quoted" word, a \\ and é', "script": "Line\nbreak", "other": 3})
+    for size in (1, 2, 7, len(document)):
+        stream = JsonFieldStream(["image_prompt", "script"])
+        fields = {}
+        for completed in feed_in_chunks(stream, document, size):
+            assert not set(completed) & set(fields), "a field was returned twice"
+            fields.update(completed)
+        assert fields == {"image_prompt": 'A "quoted" word, a \\ and é', "script": "Line\nbreak"}
+        assert stream.text == document
+
+
+def test_non_string_and_missing_fields_are_not_returned():
+    stream = JsonFieldStream(["count", "caption"])
+    assert stream.feed('{"count": 3, "other": "x"}') == {}
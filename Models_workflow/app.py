@@ -1,16 +1,150 @@
 from image_gen import Text_Image2ImageGen
+from image_gen.lora_registry import LoraJobScheduler, parse_lora_selection
 from video_gen import VideoGen
+from video_gen import placement as video_placement
+from video_gen import quality_tiers
+from video_gen.task_control import TaskRegistry, GenerationCancelled
 from speech_recognition import Speech2Text
+from speech_recognition.micro_batcher import MicroBatcher
+from model_registry import ModelRegistry, ModelKey
+from model_loading import startup_report
+from artifact_cache import ArtifactCache, artifact_key, content_hash
 
 from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 import json
+import os
+import threading
+import uuid
 from PIL import Image
 import io
+import torch
 import torchaudio
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  
+CORS(app, resources={r"/*": {"origins": "*"}})
+
+# Model configuration
+VIDEO_MODEL_PATH = "../AI Models/Text-Image2Video/cogvideox-2b-img2vid"
+IMAGE_MODEL_PATH = "../AI Models/Text2Image/flux-dev-fp8"
+SPEECH_MODEL_PATH = "../AI Models/Speech2Text/seamless-m4t-v2-large"
+VIDEO_DTYPE = torch.bfloat16
+
+# Memory budget shared by all resident models, the least recently used ones are evicted past it
+MODEL_MEMORY_BUDGET_GB = float(os.getenv("MODEL_MEMORY_BUDGET_GB", "40"))
+# Approximate resident sizes, used to make room before a model is loaded
+VIDEO_MODEL_SIZE_GB = 14
+IMAGE_MODEL_SIZE_GB = 24
+SPEECH_MODEL_SIZE_GB = 9
+
+registry = ModelRegistry(memory_budget=int(MODEL_MEMORY_BUDGET_GB * 1e9))
+
+# Speech recognition requests are batched over a short window
+SPEECH_BATCH_SIZE = int(os.getenv("SPEECH_BATCH_SIZE", "8"))
+SPEECH_BATCH_WINDOW_MS = float(os.getenv("SPEECH_BATCH_WINDOW_MS", "50"))
+
+# Seeded generations are deterministic, so their outputs are cached on disk by model, prompt, input image and parameters
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "./.artifact_cache")
+ARTIFACT_CACHE_MAX_GB = float(os.getenv("ARTIFACT_CACHE_MAX_GB", "5"))
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, max_bytes=int(ARTIFACT_CACHE_MAX_GB * 1024**3))
+
+# What identifies each model in the cache keys, the device is left out since it does not change the outputs
+VIDEO_MODEL_ID = ("cogvideox-img2vid", VIDEO_MODEL_PATH, str(VIDEO_DTYPE))
+IMAGE_MODEL_ID = ("flux-dev-fp8", IMAGE_MODEL_PATH, "fp8")
+# Settings of the image generations
+IMAGE_GENERATION_PARAMS = {"guidance": 4, "width": 1024, "height": 1024, "num_steps": 25, "seed": 123456789}
+
+# LoRAs read when Flux is loaded, and the selection used when a request names none
+IMAGE_PRELOAD_LORAS = os.getenv("IMAGE_PRELOAD_LORAS", "realism,anime,art,scenery")
+IMAGE_DEFAULT_LORA = os.getenv("IMAGE_DEFAULT_LORA", "realism:0.9")
+# Image requests sharing a LoRA run back to back, up to this many in a row or until another one waited this long
+IMAGE_LORA_GROUP_SIZE = int(os.getenv("IMAGE_LORA_GROUP_SIZE", "8"))
+IMAGE_LORA_MAX_WAIT = float(os.getenv("IMAGE_LORA_MAX_WAIT", "30"))
+
+# Cancellation tokens and denoising progress of the running video generations, keyed by the client's task id
+video_tasks = TaskRegistry()
+
+
+def video_pipeline():
+    """Returns a context manager yielding the resident CogVideoX pipeline."""
+    placement = video_placement.requested_placement()
+    key = ModelKey("cogvideox-img2vid", VIDEO_MODEL_PATH, str(VIDEO_DTYPE), video_placement.placement_device(placement))
+    return registry.use(
+        key,
+        lambda: VideoGen.load_pipeline(VIDEO_MODEL_PATH, VIDEO_DTYPE, placement=placement),
+        size_hint=int(VIDEO_MODEL_SIZE_GB * 1e9),
+    )
+
+
+def image_pipeline():
+    """Returns a context manager yielding the resident Flux pipeline."""
+    device, offload = Text_Image2ImageGen.select_device()
+    key = ModelKey("flux-dev-fp8", IMAGE_MODEL_PATH, "fp8", device)
+    return registry.use(
+        key,
+        lambda: Text_Image2ImageGen.load_pipeline(
+            IMAGE_MODEL_PATH, IMAGE_MODEL_PATH, device=device, offload=offload,
+            preload_loras=[name for name, _ in parse_lora_selection(IMAGE_PRELOAD_LORAS)],
+        ),
+        size_hint=int(IMAGE_MODEL_SIZE_GB * 1e9),
+    )
+
+
+def speech_model():
+    """Returns a context manager yielding the resident (processor, model) SeamlessM4Tv2 pair."""
+    key = ModelKey("seamless-m4t-v2-large", SPEECH_MODEL_PATH, str(torch.float32), "cpu")
+    return registry.use(
+        key,
+        lambda: Speech2Text.load_model(SPEECH_MODEL_PATH),
+        size_hint=int(SPEECH_MODEL_SIZE_GB * 1e9),
+    )
+
+
+# Models loaded in the background when the server starts (e.g. "video,image"), others load on their first request
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PRELOAD_MODELS", "").split(",") if name.strip()]
+
+
+def preload_models():
+    """Loads the models of PRELOAD_MODELS into the registry, one after another."""
+    pipelines = {"video": video_pipeline, "image": image_pipeline, "speech": speech_model}
+    for name in PRELOAD_MODELS:
+        try:
+            with pipelines[name]():
+                pass
+        except Exception as e:
+            print(f"Failed to preload {name}: {e}")
+
+
+def generate_image_job(loras, prompt, image):
+    """Generates an image with the given LoRA selection, run by `image_scheduler`."""
+    with image_pipeline() as xflux_pipeline:
+        return Text_Image2ImageGen.generate_image(
+            prompt, image, xflux_pipeline=xflux_pipeline, loras=loras, **IMAGE_GENERATION_PARAMS
+        )
+
+
+image_scheduler = LoraJobScheduler(generate_image_job, max_group=IMAGE_LORA_GROUP_SIZE, max_wait=IMAGE_LORA_MAX_WAIT)
+
+
+def recognize_speech_batch(recordings):
+    """Transcribes a batch of (waveform, sample_rate) recordings with one forward pass."""
+    waveforms, sample_rates = zip(*recordings)
+    with speech_model() as (processor, model):
+        return Speech2Text.speech_to_text_batch(list(waveforms), list(sample_rates), processor=processor, model=model)
+
+
+speech_batcher = MicroBatcher(
+    recognize_speech_batch,
+    max_batch_size=SPEECH_BATCH_SIZE,
+    max_wait=SPEECH_BATCH_WINDOW_MS / 1000,
+)
+
+
+def get_request_data():
+    """Returns the request parameters, sent either as form fields (with files) or as JSON."""
+    if request.form:
+        return request.form
+    return request.get_json(silent=True) or {}
 
 
 @app.route('/generate_video', methods=['POST'])
@@ -18,61 +152,149 @@ def generate_video_route():
     print("Request received")
     if 'image' not in request.files:
         return {"error": "Missing image"}, 400
-    
+
     image_file = request.files['image']
-    data = request.get_json()
+    data = get_request_data()
     if not data or 'prompt' not in data:
         return {"error": "Missing prompt"}, 400
-    
+
     prompt = data['prompt']
-    
+
+    # A quality tier (draft, standard, final) and a seed, so a draft can be upgraded with the same seed
+    tier = data.get('tier') or None
+    if tier is not None and tier not in quality_tiers.TIERS:
+        return {"error": f"Unknown tier {tier}, expected one of {list(quality_tiers.TIERS)}"}, 400
+    seed = int(data['seed']) if data.get('seed') not in (None, "") else 42
+
+    image_bytes = image_file.read()
+    tier = tier or quality_tiers.DEFAULT_TIER
+    cache_key = artifact_key(VIDEO_MODEL_ID, prompt, content_hash(image_bytes), {
+        **quality_tiers.get_tier(tier)._asdict(),
+        "seed": seed,
+        # Settings that change the output bytes: how the latents are decoded and encoded, the conditioning and
+        # where the pipeline runs (CPU and GPU kernels differ numerically)
+        "spatial_tiling": VideoGen.DECODE_SPATIAL_TILING,
+        "stream_decode": VideoGen.STREAM_DECODE,
+        "start_frame_mode": VideoGen.START_FRAME_MODE,
+        "device": video_placement.placement_device(video_placement.requested_placement()),
+    })
+    cached = artifact_cache.get(cache_key)
+    if cached is not None:
+        return Response(cached, mimetype='video/mp4', headers={"X-Cache": "HIT"})
+
     # Convert the image file to a PIL Image
-    image = Image.open(io.BytesIO(image_file.read())).convert("RGB")
-    
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+    # Track the task under the client's id so it can follow the progress and cancel it,
+    # the generation also stops by itself once the client's timeout has passed
+    task_id = data.get('task_id') or uuid.uuid4().hex
+    timeout = float(data['timeout']) if data.get('timeout') else None
+    cancel_token, progress = video_tasks.create(task_id, timeout)
+
     # Generate the video directly in memory
-    video_stream = VideoGen.generate_video(prompt, image)
-    
+    try:
+        with video_pipeline() as pipe:
+            cancel_token.raise_if_cancelled()
+            video_stream = VideoGen.generate_video(
+                prompt, image, pipe=pipe, cancel_token=cancel_token, progress=progress,
+                tier=tier, seed=seed,
+            )
+    except GenerationCancelled as e:
+        return {"error": str(e), "status": "cancelled"}, 409
+    finally:
+        video_tasks.remove(task_id)
+
+    video_bytes = video_stream.getvalue()
+    artifact_cache.set(cache_key, video_bytes)
+
     # Send the video file as a response without saving it locally
-    return Response(video_stream.getvalue(), mimetype='video/mp4')
+    return Response(video_bytes, mimetype='video/mp4', headers={"X-Cache": "MISS"})
 
 @app.route('/generate_image', methods=['POST'])
 def generate_image_route():
     print("Request received")
-    data = request.get_json()
+    data = get_request_data()
     print(data)
-    if 'image' not in request.files:
-        image = None
-    else:
-        image_file = request.files['image']
-        image = Image.open(io.BytesIO(image_file.read())).convert("RGB")
-        output_image = Text_Image2ImageGen.generate_image(data['prompt'], image)
-    
+    if 'prompt' not in data:
+        return {"error": "Missing prompt"}, 400
+    image_bytes = request.files['image'].read() if 'image' in request.files else None
+    try:
+        loras = parse_lora_selection(data.get('lora') or IMAGE_DEFAULT_LORA)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    cache_key = artifact_key(IMAGE_MODEL_ID, data['prompt'], image_bytes and content_hash(image_bytes),
+                             {**IMAGE_GENERATION_PARAMS, "loras": [list(lora) for lora in loras]})
+    cached = artifact_cache.get(cache_key)
+    if cached is not None:
+        response = send_file(io.BytesIO(cached), mimetype='image/jpeg')
+        response.headers["X-Cache"] = "HIT"
+        return response
+
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB") if image_bytes is not None else None
+    output_image = image_scheduler.submit(loras, data['prompt'], image).result()
+
     # Save the output image to a BytesIO object
     img_io = io.BytesIO()
     output_image.save(img_io, 'JPEG')
+    artifact_cache.set(cache_key, img_io.getvalue())
     img_io.seek(0)
-    
+
     # Send the image file as a response
-    return send_file(img_io, mimetype='image/jpeg')
-    
+    response = send_file(img_io, mimetype='image/jpeg')
+    response.headers["X-Cache"] = "MISS"
+    return response
+
 @app.route('/recognize_speech', methods=['POST'])
 def recognize_speech_route():
     if 'audio' not in request.files:
         return {"error": "Missing audio file"}, 400
-    
+
     audio_file = request.files['audio']  # Get the uploaded audio file
     audio_bytes = audio_file.read()  # Read audio content as bytes
-    
+
     audio_stream = io.BytesIO(audio_bytes)
 
     # Load into torchaudio (directly from the stream)
     waveform, sample_rate = torchaudio.load(audio_stream)
-    
-    user_text = Speech2Text.speech_to_text(waveform, sample_rate)
+
+    # Transcribed together with the other recordings that arrive in the same window
+    user_text = speech_batcher.submit((waveform, sample_rate)).result()
     return jsonify({
         "message": "Audio received successfully",
         "user_text": user_text,
-    })  
+    })
+
+@app.route('/progress/<task_id>', methods=['GET'])
+def progress_route(task_id):
+    task = video_tasks.get(task_id)
+    if task is None:
+        return {"error": "Unknown or finished task"}, 404
+    return jsonify(task[1].snapshot())
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_route(task_id):
+    if not video_tasks.cancel(task_id):
+        return {"error": "Unknown or finished task"}, 404
+    return jsonify({"message": "Cancellation requested", "task_id": task_id})
+
+@app.route('/models', methods=['GET'])
+def models_route():
+    return jsonify(registry.stats())
+
+@app.route('/startup_report', methods=['GET'])
+def startup_report_route():
+    return jsonify(startup_report.as_dict())
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify(artifact_cache.stats())
+
+@app.route('/tiers', methods=['GET'])
+def tiers_route():
+    return jsonify({"default": quality_tiers.DEFAULT_TIER,
+                    "tiers": {name: tier._asdict() for name, tier in quality_tiers.TIERS.items()}})
 
 if __name__ == '__main__':
+    threading.Thread(target=preload_models, name="preload", daemon=True).start()
     app.run(host='0.0.0.0', port=5002)
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import threading
+
+from disk_lru import DiskLRUStore
+
+
+def content_hash(data: bytes) -> str:
+    """Returns the SHA-256 hex digest of raw bytes, e.g. an uploaded input image."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def artifact_key(model_id, prompt: str, input_hash: str = None, params: dict = None) -> str:
+    """
+    Builds the content-addressed key of a generated artifact.
+
+    Args:
+        model_id: What identifies the model and how it is materialized, e.g. a `ModelKey`.
+        prompt (str): The prompt, used as is since generations are sensitive to any change.
+        input_hash (str): The `content_hash` of the input image, None without input image.
+        params (dict): Every other generation parameter (seed, steps, resolution...), JSON-serializable.
+
+    Returns:
+        str: The SHA-256 hex digest of all the parts.
+    """
+    payload = json.dumps([list(model_id), prompt, input_hash, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    """
+    On-disk cache of generated artifacts (images, videos) keyed by `artifact_key`.
+
+    Seeded generations are deterministic, so an artifact never goes stale. The store keeps at most `max_bytes`,
+    evicting the least recently used files first, and counts hits and misses.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 5 * 1024**3):
+        """
+        Args:
+            cache_dir (str): The directory of the store.
+            max_bytes (int): The maximum size of the store in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._disk = DiskLRUStore(cache_dir, ".bin", max_bytes)
+
+    def get(self, key: str) -> bytes:
+        """Returns the artifact stored under `key`, or None."""
+        data = self._disk.read(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes):
+        """Stores an artifact, then evicts the least recently used ones past `max_bytes`."""
+        self._disk.write(key, data)
+
+    def stats(self) -> dict:
+        entries, total = self._disk.usage()
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+            }
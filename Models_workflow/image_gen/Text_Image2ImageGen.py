@@ -3,6 +3,9 @@ import torch
 from PIL import Image
 from huggingface_hub import hf_hub_download
 from xflux.src.flux.xflux_pipeline import XFluxPipeline
+from .lora_registry import LoraRegistry, LORA_COLLECTION, DEFAULT_LORA_WEIGHT
+from model_loading import startup_report, instantiation_lock
+import time
 
 def download_model_and_lora(model_dir, lora_dir, lora_repo_id, lora_name):
     os.makedirs(model_dir, exist_ok=True)
@@ -17,19 +20,54 @@ def download_model_and_lora(model_dir, lora_dir, lora_repo_id, lora_name):
     
     return lora_path
 
-def generate_image(prompt, image : Image.Image, model_dir="../AI Models/Text2Image/flux-dev-fp8", lora_dir="../AI Models/Text2Image/flux-dev-fp8", lora_repo_id="XLabs-AI/flux-lora-collection", lora_name="realism_lora.safetensors", guidance=4, width=1024, height=1024, num_steps=25, seed=123456789, save_path="results"):
+def select_device():
+    """Returns the device to run Flux on and whether the model needs to be offloaded."""
     device = "cuda" if torch.cuda.is_available() and torch.cuda.get_device_properties(0).total_memory >= 6e9 else "cpu"
     offload = device == "cuda" and torch.cuda.get_device_properties(0).total_memory < 8e9
-    
+    return device, offload
+
+def load_pipeline(model_dir="../AI Models/Text2Image/flux-dev-fp8", lora_dir="../AI Models/Text2Image/flux-dev-fp8", lora_repo_id="XLabs-AI/flux-lora-collection", lora_name="realism_lora.safetensors", device=None, offload=None, preload_loras=()):
+    """
+    Loads the Flux pipeline so it can be kept resident and reused across requests.
+
+    The LoRAs are handled by a `LoraRegistry` kept on `xflux_pipeline.loras`: `lora_name` is activated right away
+    with a weight of 0.9, the LoRAs named in `preload_loras` (keys of `LORA_COLLECTION`) are read ahead of time.
+    """
+    if device is None:
+        device, offload = select_device()
     print(f"Using device: {device} (Offload: {offload})")
+
+    default_lora = next((name for name, filename in LORA_COLLECTION.items() if filename == lora_name), None)
+    if default_lora is None:
+        raise ValueError(f"Unknown LoRA file {lora_name}, expected one of {sorted(LORA_COLLECTION.values())}")
+
+    # Load the model pipeline, XFluxPipeline loads its components itself so it is timed as a whole, and builds
+    # modules so it waits for any model being instantiated with empty weights
+    start = time.perf_counter()
+    with startup_report.time("flux-dev-fp8", "base_model"), instantiation_lock:
+        xflux_pipeline = XFluxPipeline("flux-dev-fp8", device, offload)
+
+    # Download the LoRAs if needed, once, and switch between them without touching the base model
+    with startup_report.time("flux-dev-fp8", "loras"):
+        xflux_pipeline.loras = LoraRegistry(
+            xflux_pipeline, lambda filename: download_model_and_lora(model_dir, lora_dir, lora_repo_id, filename)
+        )
+        xflux_pipeline.loras.preload([default_lora, *preload_loras])
+        xflux_pipeline.loras.activate(((default_lora, DEFAULT_LORA_WEIGHT),))
+    startup_report.record_wall("flux-dev-fp8", time.perf_counter() - start)
+    startup_report.print_model("flux-dev-fp8")
+    return xflux_pipeline
+
+def generate_image(prompt, image : Image.Image, model_dir="../AI Models/Text2Image/flux-dev-fp8", lora_dir="../AI Models/Text2Image/flux-dev-fp8", lora_repo_id="XLabs-AI/flux-lora-collection", lora_name="realism_lora.safetensors", guidance=4, width=1024, height=1024, num_steps=25, seed=123456789, save_path="results", xflux_pipeline=None, loras=None):
     os.makedirs(save_path, exist_ok=True)
     
-    # Download LoRA if needed
-    lora_path = download_model_and_lora(model_dir, lora_dir, lora_repo_id, lora_name)
-    
-    # Load the model pipeline
-    xflux_pipeline = XFluxPipeline("flux-dev-fp8", device, offload)
-    xflux_pipeline.set_lora(lora_path, lora_repo_id, lora_name, lora_weight=0.9)
+    # Load the model pipeline unless a resident one is given
+    if xflux_pipeline is None:
+        xflux_pipeline = load_pipeline(model_dir, lora_dir, lora_repo_id, lora_name)
+
+    # Switch to the requested LoRA selection (see `lora_registry.parse_lora_selection`), if any
+    if loras is not None:
+        xflux_pipeline.loras.activate(loras)
         
     # Generate image
     result = xflux_pipeline(prompt=prompt, controlnet_image=image, width=width, height=height, guidance=guidance, num_steps=num_steps, seed=seed)
@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import torch
+from safetensors.torch import load_file
+from model_loading import instantiation_lock
+from xflux.src.flux.modules.layers import (
+    DoubleStreamBlockLoraProcessor,
+    DoubleStreamBlockProcessor,
+    SingleStreamBlockLoraProcessor,
+    SingleStreamBlockProcessor,
+)
+
+# LoRAs of XLabs-AI/flux-lora-collection, by short name
+LORA_COLLECTION = {
+    "realism": "realism_lora.safetensors",
+    "anime": "anime_lora.safetensors",
+    "art": "art_lora.safetensors",
+    "disney": "disney_lora.safetensors",
+    "furry": "furry_lora.safetensors",
+    "mjv6": "mjv6_lora.safetensors",
+    "scenery": "scenery_lora.safetensors",
+}
+DEFAULT_LORA_WEIGHT = 0.9
+
+
+def parse_lora_selection(text: str, default_weight: float = DEFAULT_LORA_WEIGHT) -> tuple:
+    """
+    Parses a LoRA selection like "realism" or "realism:0.9,anime:0.5".
+
+    Returns:
+        tuple: ((name, weight), ...) sorted by name, so equal selections compare equal. Empty for "none".
+    """
+    selection = {}
+    for part in (text or "").split(","):
+        name, _, weight = part.strip().partition(":")
+        if not name or name == "none":
+            continue
+        if name not in LORA_COLLECTION:
+            raise ValueError(f"Unknown LoRA {name}, expected one of {list(LORA_COLLECTION)}")
+        selection[name] = float(weight) if weight else default_weight
+    return tuple(sorted(selection.items()))
+
+
+def merge_checkpoints(checkpoints) -> dict:
+    """
+    Merges weighted LoRA checkpoints into one by concatenating their ranks.
+
+    The update of a layer is up @ down, so stacking the `down` matrices and placing the `up` matrices side by side
+    gives the sum of the updates. Like `XFluxPipeline.update_model_with_lora`, the weight scales every matrix.
+    A LoRA missing a layer the others have contributes zeros there, so every layer has the same rank.
+
+    Args:
+        checkpoints (list): (state_dict, weight) pairs.
+
+    Returns:
+        dict: The merged state dict, already weighted.
+    """
+    layers = sorted({key[:-len(".down.weight")] for checkpoint, _ in checkpoints for key in checkpoint if key.endswith(".down.weight")})
+    ranks = [next(v.shape[0] for k, v in checkpoint.items() if k.endswith(".down.weight")) for checkpoint, _ in checkpoints]
+    merged = {}
+    for layer in layers:
+        present = next(checkpoint for checkpoint, _ in checkpoints if f"{layer}.down.weight" in checkpoint)
+        in_features = present[f"{layer}.down.weight"].shape[1]
+        out_features = present[f"{layer}.up.weight"].shape[0]
+        downs, ups = [], []
+        for (checkpoint, weight), rank in zip(checkpoints, ranks):
+            down, up = checkpoint.get(f"{layer}.down.weight"), checkpoint.get(f"{layer}.up.weight")
+            if down is None:
+                down, up = torch.zeros(rank, in_features), torch.zeros(out_features, rank)
+            downs.append(down.float() * weight)
+            ups.append(up.float() * weight)
+        merged[f"{layer}.down.weight"] = torch.cat(downs, dim=0)
+        merged[f"{layer}.up.weight"] = torch.cat(ups, dim=1)
+    return merged
+
+
+class LoraRegistry:
+    """
+    LoRA adapters of a resident Flux pipeline.
+
+    Checkpoints are read once from disk. The attention processors of each selection (one LoRA or a merge of several)
+    are built once and kept for the last `max_cached_selections` selections, so switching LoRA only swaps processors
+    on the base model instead of reloading it.
+    """
+
+    def __init__(self, xflux_pipeline, resolve_path, max_cached_selections: int = 8):
+        """
+        Args:
+            xflux_pipeline (XFluxPipeline): The pipeline with the resident base model.
+            resolve_path (callable): Returns the local path of a LoRA file of the collection, downloading it if needed.
+            max_cached_selections (int): The number of selections whose processors are kept built.
+        """
+        self.pipeline = xflux_pipeline
+        self.resolve_path = resolve_path
+        self.max_cached_selections = max_cached_selections
+        self.active = None
+        self.switches = 0
+        self._checkpoints = {}
+        self._processors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def preload(self, names):
+        """Downloads if needed and loads the checkpoints of the given LoRAs to the CPU."""
+        for name in names:
+            if name not in self._checkpoints:
+                self._checkpoints[name] = load_file(self.resolve_path(LORA_COLLECTION[name]), device="cpu")
+                print(f"Preloaded LoRA {name}")
+
+    def activate(self, selection: tuple):
+        """Sets the attention processors of a selection (see `parse_lora_selection`) on the base model."""
+        with self._lock:
+            if selection == self.active:
+                return
+            processors = self._processors.get(selection)
+            if processors is None:
+                processors = self._build_processors(selection)
+                self._processors[selection] = processors
+                while len(self._processors) > self.max_cached_selections:
+                    self._processors.popitem(last=False)
+            self._processors.move_to_end(selection)
+            start = time.perf_counter()
+            self.pipeline.model.set_attn_processor(dict(processors))
+            self.active = selection
+            self.switches += 1
+            print(f"Switched to LoRA {selection or 'none'} in {time.perf_counter() - start:.3f}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": sorted(self._checkpoints),
+                "active": [list(item) for item in self.active or ()],
+                "cached_selections": len(self._processors),
+                "switches": self.switches,
+            }
+
+    def _build_processors(self, selection: tuple) -> dict:
+        # Mirrors `XFluxPipeline.update_model_with_lora`, on a checkpoint where the weights are already applied
+        self.preload([name for name, _ in selection])
+        checkpoint = merge_checkpoints([(self._checkpoints[name], weight) for name, weight in selection]) if selection else {}
+        rank = next((v.shape[0] for k, v in checkpoint.items() if k.endswith(".down.weight")), None)
+        device = self.pipeline.device
+
+        processors = {}
+        # The LoRA processors are modules, they must not be built while a model loads with empty weights
+        with instantiation_lock:
+            for name in self.pipeline.model.attn_processors:
+                state_dict = {k[len(name) + 1:]: v for k, v in checkpoint.items() if k.startswith(name + ".")}
+                single = name.startswith("single_blocks")
+                if state_dict:
+                    processor = (SingleStreamBlockLoraProcessor if single else DoubleStreamBlockLoraProcessor)(dim=3072, rank=rank)
+                    processor.load_state_dict(state_dict)
+                    processors[name] = processor.to(device)
+                else:
+                    processors[name] = SingleStreamBlockProcessor() if single else DoubleStreamBlockProcessor()
+        return processors
+
+
+class LoraJobScheduler:
+    """
+    Runs image jobs one at a time, grouping the jobs that use the same LoRA selection so fewer switches happen.
+
+    The next job is the oldest one using the active selection, until `max_group` of them ran in a row or another
+    job has waited more than `max_wait` seconds. The oldest job runs then, switching LoRA.
+    """
+
+    def __init__(self, run, max_group: int = 8, max_wait: float = 30):
+        """
+        Args:
+            run (callable): Called as `run(selection, *args)` in the scheduler thread, returns the job result.
+            max_group (int): The maximum number of jobs run in a row without switching LoRA.
+            max_wait (float): Jobs waiting longer than this in seconds run next, even if they need a switch.
+        """
+        self._run = run
+        self.max_group = max_group
+        self.max_wait = max_wait
+        self._jobs = []
+        self._condition = threading.Condition()
+        self._active = None
+        self._group_size = 0
+        self._thread = threading.Thread(target=self._loop, name="lora-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, selection: tuple, *args) -> Future:
+        """Queues a job and returns a future resolving to its result."""
+        future = Future()
+        with self._condition:
+            self._jobs.append((time.monotonic(), selection, args, future))
+            self._condition.notify()
+        return future
+
+    def _next_job(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._jobs)
+            oldest = self._jobs[0]
+            job = oldest
+            if time.monotonic() - oldest[0] <= self.max_wait and self._group_size < self.max_group:
+                job = next((job for job in self._jobs if job[1] == self._active), oldest)
+            self._jobs.remove(job)
+            if job[1] == self._active:
+                self._group_size += 1
+            else:
+                self._active, self._group_size = job[1], 1
+            return job
+
+    def _loop(self):
+        while True:
+            _, selection, args, future = self._next_job()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(selection, *args))
+            except Exception as e:
+                future.set_exception(e)
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from model_registry import estimate_model_bytes
+
+# Threads loading the components of one model at once, loading is mostly disk reads and copies that release the GIL
+MODEL_LOAD_WORKERS = int(os.getenv("MODEL_LOAD_WORKERS", "4"))
+
+# Keyword arguments for `from_pretrained`: the weights are read from the memory-mapped safetensors files straight
+# into empty modules, instead of initializing random weights first and copying the checkpoint over them.
+# Pass `torch_dtype` as well so the weights are converted while they are read, not in a second pass.
+PRETRAINED_KWARGS = {"low_cpu_mem_usage": True}
+
+# Held while a model is instantiated. With `low_cpu_mem_usage`, accelerate's `init_empty_weights` patches
+# `nn.Module.register_parameter` for the whole process and restores it on exit: two overlapping loads can restore
+# the patched version, after which every new module of the process silently gets meta weights. Modules built
+# elsewhere while a load holds it (e.g. by XFluxPipeline) would get meta weights as well, so they take it too.
+instantiation_lock = threading.Lock()
+
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin")
+
+
+def from_pretrained(model_class, *args, **kwargs):
+    """Calls `model_class.from_pretrained` with `PRETRAINED_KWARGS`, one model of the process at a time."""
+    with instantiation_lock:
+        return model_class.from_pretrained(*args, **PRETRAINED_KWARGS, **kwargs)
+
+
+def weight_files(directory: str) -> list:
+    """The checkpoint files under a model directory, largest first."""
+    files = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names
+             if name.endswith(WEIGHT_FILE_SUFFIXES)]
+    return sorted(files, key=os.path.getsize, reverse=True)
+
+
+def read_file(path: str, chunk_size: int = 64 << 20) -> int:
+    """Reads a file through to bring it into the page cache, returns its size."""
+    size = 0
+    with open(path, "rb", buffering=0) as f:
+        while chunk := f.read(chunk_size):
+            size += len(chunk)
+    return size
+
+
+class StartupReport:
+    """Time spent loading each component of each model of the process, served at /startup_report."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, model: str, step: str):
+        """Times a loading step of a model (a component or e.g. its placement) and records it."""
+        start = time.perf_counter()
+        result = {}
+        try:
+            yield result
+        finally:
+            self.record(model, step, time.perf_counter() - start, result.get("bytes"))
+
+    def record(self, model: str, step: str, seconds: float, size_bytes: int = None):
+        with self._lock:
+            steps = self._models.setdefault(model, {"steps": {}, "wall_seconds": None})["steps"]
+            steps[step] = {"seconds": round(seconds, 3), "bytes": size_bytes, "thread": threading.current_thread().name}
+
+    def record_wall(self, model: str, seconds: float):
+        """Records the total time a model took to load, shorter than the sum of its steps when they overlap."""
+        with self._lock:
+            self._models.setdefault(model, {"steps": {}, "wall_seconds": None})["wall_seconds"] = round(seconds, 3)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started_at, 3),
+                "models": {model: {"wall_seconds": entry["wall_seconds"], "steps": dict(entry["steps"])}
+                           for model, entry in self._models.items()},
+            }
+
+    def print_model(self, model: str):
+        with self._lock:
+            entry = self._models.get(model)
+            if entry is None:
+                return
+            print(f"Loaded {model} in {entry['wall_seconds']}s")
+            for step, timing in sorted(entry["steps"].items(), key=lambda item: -item[1]["seconds"]):
+                size = f", {timing['bytes'] / 1e9:.2f} GB" if timing["bytes"] else ""
+                print(f"  {step:<16} {timing['seconds']:8.2f}s{size}")
+
+
+startup_report = StartupReport()
+
+
+def load_components(model: str, loaders: dict, prefetch: list = (), max_workers: int = MODEL_LOAD_WORKERS) -> dict:
+    """
+    Loads the components of a model, timing each of them in `startup_report`.
+
+    The disk reads run concurrently: the files of `prefetch` are read into the page cache by the pool while the
+    loaders run, so the loaders waiting on `instantiation_lock` (see `from_pretrained`) find their weights in memory.
+    Loaders that do not build modules (tokenizers, processors, schedulers) run concurrently as well.
+
+    Args:
+        model (str): The name of the model in the report.
+        loaders (dict): Zero-argument callables returning each component, by component name.
+        prefetch (list): The files to read ahead, e.g. the `weight_files` of the model directory.
+        max_workers (int): The maximum number of loaders and reads running at once.
+
+    Returns:
+        dict: The loaded components, by component name.
+    """
+    def load(name, loader):
+        with startup_report.time(model, name) as timing:
+            component = loader()
+            timing["bytes"] = estimate_model_bytes(component) or None
+        return component
+
+    def read(path):
+        try:
+            size = read_file(path)
+        except OSError as e:
+            print(f"Could not read ahead {path}: {e}")
+            size = 0
+        return size, time.perf_counter()
+
+    start = time.perf_counter()
+    jobs = len(loaders) + len(prefetch)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, jobs)), thread_name_prefix=f"load-{model}") as executor:
+        # The reads are queued first so they are under way before the loaders start waiting on each other
+        reads = [executor.submit(read, path) for path in prefetch]
+        futures = {name: executor.submit(load, name, loader) for name, loader in loaders.items()}
+        components = {name: future.result() for name, future in futures.items()}
+        if reads:
+            sizes, ends = zip(*(read.result() for read in reads))
+            startup_report.record(model, "prefetch", max(ends) - start, sum(sizes))
+    startup_report.record_wall(model, time.perf_counter() - start)
+    return components
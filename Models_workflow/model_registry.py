@@ -0,0 +1,201 @@
+import gc
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import torch
+
+# A model is identified by what it is, where its weights live and how they are materialized.
+ModelKey = namedtuple("ModelKey", ["name", "model_path", "dtype", "device"])
+
+
+def estimate_model_bytes(obj, _seen=None) -> int:
+    """
+    Estimates the memory held by a model object by summing the size of its parameters and buffers.
+
+    Works on plain `torch.nn.Module`s as well as on pipeline-like containers (diffusers pipelines,
+    XFluxPipeline, tuples of processor/model...) by walking their attributes.
+
+    Args:
+        obj: The loaded model, pipeline or container of models.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_model_bytes(item, seen) for item in obj)
+    if isinstance(obj, dict):
+        return sum(estimate_model_bytes(item, seen) for item in obj.values())
+    if hasattr(obj, "__dict__"):
+        return sum(
+            estimate_model_bytes(value, seen)
+            for value in vars(obj).values()
+            if isinstance(value, (torch.nn.Module, list, tuple, dict))
+        )
+    return 0
+
+
+class _Entry:
+    def __init__(self, key):
+        self.key = key
+        self.model = None
+        self.size = 0
+        self.users = 0
+        self.error = None
+        self.ready = threading.Event()
+        # Serializes inference on a single resident model instance.
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Process-wide registry that loads each model once and keeps it resident.
+
+    Models are keyed by `ModelKey` (name, model path, dtype, device). When the total estimated size of the
+    resident models goes over `memory_budget`, the least recently used models that are not in use are evicted.
+    """
+
+    def __init__(self, memory_budget: int):
+        """
+        Args:
+            memory_budget (int): The maximum number of bytes the resident models may occupy.
+        """
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def used_memory(self) -> int:
+        with self._lock:
+            return sum(entry.size for entry in self._entries.values())
+
+    def stats(self) -> dict:
+        """Returns a summary of the resident models and the memory budget."""
+        with self._lock:
+            return {
+                "memory_budget": self.memory_budget,
+                "used_memory": sum(entry.size for entry in self._entries.values()),
+                "models": [
+                    {"key": entry.key._asdict(), "size": entry.size, "users": entry.users}
+                    for entry in self._entries.values()
+                    if entry.ready.is_set() and entry.error is None
+                ],
+            }
+
+    @contextmanager
+    def use(self, key: ModelKey, loader, size_hint: int = None):
+        """
+        Yields the resident model for `key`, loading it with `loader()` on first use.
+
+        The model is pinned (cannot be evicted) and locked for the duration of the `with` block, so concurrent
+        requests on the same model run one after the other while different models can be used in parallel.
+
+        Args:
+            key (ModelKey): The identity of the model.
+            loader (callable): A zero-argument function returning the loaded model.
+            size_hint (int): Expected size in bytes, used to make room before loading.
+        """
+        entry = self._acquire(key, loader, size_hint)
+        try:
+            with entry.lock:
+                yield entry.model
+        finally:
+            with self._lock:
+                entry.users -= 1
+                evicted = self._evict_to_fit(0)
+            if evicted:
+                self._release_memory()
+
+    def evict(self, key: ModelKey) -> bool:
+        """Drops the model for `key` if it is resident and not in use. Returns True if it was evicted."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.users > 0 or not entry.ready.is_set():
+                return False
+            self._drop(entry)
+        self._release_memory()
+        return True
+
+    def _acquire(self, key, loader, size_hint):
+        evicted = False
+        with self._lock:
+            entry = self._entries.get(key)
+            is_new = entry is None
+            if is_new:
+                entry = _Entry(key)
+                self._entries[key] = entry
+                if size_hint:
+                    evicted = self._evict_to_fit(size_hint)
+            self._entries.move_to_end(key)
+            entry.users += 1
+        if evicted:
+            self._release_memory()
+
+        if is_new:
+            self._load(entry, loader)
+        else:
+            entry.ready.wait()
+
+        if entry.error is not None:
+            with self._lock:
+                entry.users -= 1
+            raise RuntimeError(f"Failed to load model {key.name}: {entry.error}")
+        return entry
+
+    def _load(self, entry, loader):
+        print(f"Loading model {entry.key.name} from {entry.key.model_path} ({entry.key.dtype}, {entry.key.device})")
+        try:
+            entry.model = loader()
+            entry.size = estimate_model_bytes(entry.model)
+        except Exception as e:
+            entry.error = e
+            with self._lock:
+                self._entries.pop(entry.key, None)
+        else:
+            with self._lock:
+                evicted = self._evict_to_fit(0)
+            if evicted:
+                self._release_memory()
+            print(f"Model {entry.key.name} resident ({entry.size / 1e9:.2f} GB)")
+        finally:
+            entry.ready.set()
+
+    def _evict_to_fit(self, incoming: int) -> bool:
+        """
+        Evicts idle models in LRU order until `incoming` more bytes fit in the budget. Caller holds the lock.
+
+        Returns True if models were evicted, the caller then calls `_release_memory` once it released the lock, so
+        the garbage collection does not block the other users of the registry.
+        """
+        evicted = False
+        used = sum(entry.size for entry in self._entries.values())
+        for entry in list(self._entries.values()):
+            if used + incoming <= self.memory_budget:
+                break
+            if entry.users > 0 or not entry.ready.is_set():
+                continue
+            used -= entry.size
+            self._drop(entry)
+            evicted = True
+        if used + incoming > self.memory_budget:
+            print(f"Warning: resident models ({(used + incoming) / 1e9:.2f} GB) exceed the memory budget")
+        return evicted
+
+    def _drop(self, entry):
+        print(f"Evicting model {entry.key.name} ({entry.size / 1e9:.2f} GB)")
+        self._entries.pop(entry.key, None)
+        entry.model = None
+
+    @staticmethod
+    def _release_memory():
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -8,7 +8,27 @@ import soundfile as sf
 import io
 
 
-def generate_speech(prompt: str, description: str, model_path: str = "../../AI Models/Text2Speech/parler-tts-mini-v1.1") -> bytes:
+def load_worker(model_path: str = "../../AI Models/Text2Speech/parler-tts-mini-v1.1", device: str = None) -> tuple:
+    """
+    Loads ParlerTTS and its prompt and description tokenizers so they can be reused across requests.
+
+    Args:
+        model_path (str): Path to the locally stored ParlerTTS model.
+        device (str): The device to load the model on (GPU if available, otherwise CPU).
+
+    Returns:
+        tuple: The (model, tokenizer, description_tokenizer, device) of the worker.
+    """
+    if device is None:
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+    model = ParlerTTSForConditionalGeneration.from_pretrained(model_path).to(device)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    description_tokenizer = AutoTokenizer.from_pretrained(model.config.text_encoder._name_or_path)
+    return model, tokenizer, description_tokenizer, device
+
+
+def generate_speech(prompt: str, description: str, model_path: str = "../../AI Models/Text2Speech/parler-tts-mini-v1.1", worker: tuple = None) -> bytes:
     """
     Generates speech from text using ParlerTTS and returns the audio as bytes.
 
@@ -16,25 +36,24 @@ def generate_speech(prompt: str, description: str, model_path: str = "../../AI M
         prompt (str): The text to be converted into speech.
         description (str): The description of the speaker's style and tone.
         model_path (str): Path to the locally stored ParlerTTS model.
+        worker (tuple): A worker returned by `load_worker`. Loaded from `model_path` if None.
 
     Returns:
         bytes: The generated audio in WAV format as bytes.
     """
     try:
-        # Set device (GPU if available, otherwise CPU)
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
-
-        # Load model and tokenizers
-        model = ParlerTTSForConditionalGeneration.from_pretrained(model_path).to(device)
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        description_tokenizer = AutoTokenizer.from_pretrained(model.config.text_encoder._name_or_path)
+        # Load model and tokenizers unless a warm worker is given
+        if worker is None:
+            worker = load_worker(model_path)
+        model, tokenizer, description_tokenizer, device = worker
 
         # Tokenize inputs
         input_ids = description_tokenizer(description, return_tensors="pt").input_ids.to(device)
         prompt_input_ids = tokenizer(prompt, return_tensors="pt").input_ids.to(device)
 
         # Generate speech
-        generation = model.generate(input_ids=input_ids, prompt_input_ids=prompt_input_ids)
+        with torch.no_grad():
+            generation = model.generate(input_ids=input_ids, prompt_input_ids=prompt_input_ids)
         audio_arr = generation.cpu().numpy().squeeze()
 
         # Save audio to a bytes buffer instead of a file
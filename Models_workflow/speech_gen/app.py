@@ -1,10 +1,35 @@
 import SpeechGen
+from worker_pool import WorkerPool, PoolBusyError
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
+import io
 import json
+import os
+import torch
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  
+CORS(app, resources={r"/*": {"origins": "*"}})
+
+# Worker pool configuration
+SPEECH_WORKERS = int(os.getenv("SPEECH_WORKERS", "2"))
+SPEECH_QUEUE_SIZE = int(os.getenv("SPEECH_QUEUE_SIZE", "16"))
+SPEECH_TIMEOUT = float(os.getenv("SPEECH_TIMEOUT", "300"))
+
+
+def load_speech_worker(index):
+    """Loads a ParlerTTS worker, spreading the workers over the available GPUs."""
+    if torch.cuda.is_available():
+        device = f"cuda:{index % torch.cuda.device_count()}"
+    else:
+        device = "cpu"
+    return SpeechGen.load_worker(device=device)
+
+
+def run_speech_worker(worker, prompt, description):
+    return SpeechGen.generate_speech(prompt=prompt, description=description, worker=worker)
+
+
+speech_pool = WorkerPool(load_speech_worker, run_speech_worker, size=SPEECH_WORKERS, queue_size=SPEECH_QUEUE_SIZE)
 
 @app.route('/generate_audio', methods=['POST'])
 def generate_audio_route():
@@ -12,14 +37,18 @@ def generate_audio_route():
         # Get JSON data from the request
         data = request.get_json()
 
-        # Generate speech
-        audio_file = SpeechGen.generate_speech(prompt=data["script"],description=data["audio_prompt"])
+        # Generate speech on the next free worker
+        audio_bytes = speech_pool.submit(data["script"], data["audio_prompt"]).result(timeout=SPEECH_TIMEOUT)
 
         # Send the audio file in the response
-        return send_file(audio_file, mimetype="audio/wav", as_attachment=True, download_name="generated_audio.wav")
-    
+        return send_file(io.BytesIO(audio_bytes), mimetype="audio/wav", as_attachment=True, download_name="generated_audio.wav")
+
+    except PoolBusyError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    # Make sure no request waits on a cold load
+    speech_pool.wait_ready()
+    app.run(host='0.0.0.0', port=5001, threaded=True)
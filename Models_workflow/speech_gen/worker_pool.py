@@ -0,0 +1,92 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class PoolBusyError(Exception):
+    """Raised when the request queue of the pool is full."""
+
+
+class WorkerPool:
+    """
+    A fixed pool of pre-loaded model workers fed by a bounded request queue.
+
+    Each worker thread loads its own model once at startup with `loader(index)` and then runs the queued
+    jobs with it, so concurrent requests run in parallel on warm models.
+    """
+
+    def __init__(self, loader, run, size: int = 2, queue_size: int = 16):
+        """
+        Args:
+            loader (callable): Called as `loader(index)` in each worker thread, returns the loaded worker.
+            run (callable): Called as `run(worker, *args, **kwargs)` to process a job.
+            size (int): The number of workers.
+            queue_size (int): The maximum number of requests waiting for a free worker.
+        """
+        self._loader = loader
+        self._run = run
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._loading = size
+        self._ready = threading.Condition()
+        self._load_errors = []
+        self._threads = [
+            threading.Thread(target=self._work, args=(index,), name=f"worker-{index}", daemon=True)
+            for index in range(size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def size(self) -> int:
+        return len(self._threads)
+
+    @property
+    def pending(self) -> int:
+        return self._jobs.qsize()
+
+    def wait_ready(self):
+        """Blocks until every worker has loaded its model. Raises if a worker failed to load."""
+        with self._ready:
+            self._ready.wait_for(lambda: self._loading == 0)
+        if self._load_errors:
+            raise RuntimeError(f"Failed to load {len(self._load_errors)} worker(s): {self._load_errors[0]}")
+
+    def submit(self, *args, **kwargs) -> Future:
+        """
+        Queues a job for the next free worker.
+
+        Returns:
+            Future: Resolves to the result of `run(worker, *args, **kwargs)`.
+
+        Raises:
+            PoolBusyError: If the request queue is full.
+        """
+        future = Future()
+        try:
+            self._jobs.put_nowait((future, args, kwargs))
+        except queue.Full:
+            raise PoolBusyError(f"All {self.size} workers are busy and {self._jobs.maxsize} requests are queued") from None
+        return future
+
+    def _work(self, index):
+        worker = None
+        try:
+            worker = self._loader(index)
+            print(f"Worker {index} ready")
+        except Exception as e:
+            self._load_errors.append(e)
+        finally:
+            with self._ready:
+                self._loading -= 1
+                self._ready.notify_all()
+        if worker is None:
+            return
+
+        while True:
+            future, args, kwargs = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(worker, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
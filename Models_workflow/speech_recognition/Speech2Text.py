@@ -1,27 +1,75 @@
 import torch
 import torchaudio
 from transformers import SeamlessM4Tv2Model, AutoProcessor
+from model_loading import load_components, startup_report, from_pretrained, weight_files
 
 
-def speech_to_text(waveform:torch.Tensor, sample_rate:int, model_path: str = "../AI Models/Speech2Text/seamless-m4t-v2-large") -> str:
+def load_model(model_path: str = "../AI Models/Speech2Text/seamless-m4t-v2-large"):
     """
-    Converts speech to text using the SeamlessM4Tv2Model.
+    Loads the SeamlessM4Tv2Model and its processor so they can be kept resident and reused across requests.
 
-    :param wavefrom: wavefrom of the audio file.
-    :param sample_rate: Sampling rate of the audio file.
     :param model_path: Path or name of the pre-trained model (default: "../AI Models/Speech2Text/seamless-m4t-v2-large").
-    :return: Transcribed text from the audio.
+    :return: A (processor, model) tuple.
+    """
+    # The processor and the model are independent, the processor loads while the weights are read
+    components = load_components("seamless-m4t-v2-large", {
+        "processor": lambda: AutoProcessor.from_pretrained(model_path),
+        "model": lambda: from_pretrained(SeamlessM4Tv2Model, model_path),
+    }, prefetch=weight_files(model_path))
+    startup_report.print_model("seamless-m4t-v2-large")
+    return components["processor"], components["model"]
+
+
+def speech_to_text_batch(waveforms: list, sample_rates: list, model_path: str = "../AI Models/Speech2Text/seamless-m4t-v2-large", processor=None, model=None, tgt_lang: str = "eng") -> list:
+    """
+    Converts a batch of recordings to text with a single SeamlessM4Tv2Model forward pass.
+
+    The recordings are downmixed to mono and resampled to the rate of the feature extractor, then padded
+    to the longest one by the processor.
+
+    :param waveforms: The waveforms of the audio files, shaped (channels, samples).
+    :param sample_rates: The sampling rate of each waveform.
+    :param model_path: Path or name of the pre-trained model (default: "../AI Models/Speech2Text/seamless-m4t-v2-large").
+    :param processor: An already loaded processor (see `load_model`). Loaded from `model_path` if None.
+    :param model: An already loaded model (see `load_model`). Loaded from `model_path` if None.
+    :param tgt_lang: The language of the transcription.
+    :return: The transcribed text of each recording, in order.
     """
-    # Load model and processor
-    processor = AutoProcessor.from_pretrained(model_path)
-    model = SeamlessM4Tv2Model.from_pretrained(model_path)
+    # Load model and processor unless resident ones are given
+    if processor is None or model is None:
+        processor, model = load_model(model_path)
+
+    target_rate = processor.feature_extractor.sampling_rate
+    audios = []
+    for waveform, sample_rate in zip(waveforms, sample_rates):
+        if waveform.dim() > 1:
+            waveform = waveform.mean(dim=0)
+        if sample_rate != target_rate:
+            waveform = torchaudio.functional.resample(waveform, sample_rate, target_rate)
+        audios.append(waveform.numpy())
 
-    inputs = processor(waveform, sampling_rate=sample_rate, return_tensors="pt")
+    inputs = processor(audios=audios, sampling_rate=target_rate, padding=True, return_tensors="pt")
 
     # Perform speech-to-text
     with torch.no_grad():
-        outputs = model.generate(**inputs)
-    
-    # Decode and return text
-    transcription = processor.batch_decode(outputs, skip_special_tokens=True)[0]
-    return transcription
+        outputs = model.generate(**inputs, tgt_lang=tgt_lang, generate_speech=False)
+    sequences = outputs.sequences if hasattr(outputs, "sequences") else outputs
+    if isinstance(sequences, tuple):
+        sequences = sequences[0]
+
+    # Decode and return one text per recording
+    return processor.batch_decode(sequences, skip_special_tokens=True)
+
+
+def speech_to_text(waveform:torch.Tensor, sample_rate:int, model_path: str = "../AI Models/Speech2Text/seamless-m4t-v2-large", processor=None, model=None) -> str:
+    """
+    Converts speech to text using the SeamlessM4Tv2Model.
+
+    :param wavefrom: wavefrom of the audio file.
+    :param sample_rate: Sampling rate of the audio file.
+    :param model_path: Path or name of the pre-trained model (default: "../AI Models/Speech2Text/seamless-m4t-v2-large").
+    :param processor: An already loaded processor (see `load_model`). Loaded from `model_path` if None.
+    :param model: An already loaded model (see `load_model`). Loaded from `model_path` if None.
+    :return: Transcribed text from the audio.
+    """
+    return speech_to_text_batch([waveform], [sample_rate], model_path, processor=processor, model=model)[0]
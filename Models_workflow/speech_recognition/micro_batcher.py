@@ -0,0 +1,60 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Collects single requests into batches for a model that is faster on batches.
+
+    A batch is flushed when it reaches `max_batch_size` items or when `max_wait` seconds have passed since
+    its first item arrived, whichever comes first.
+    """
+
+    def __init__(self, process_batch, max_batch_size: int = 8, max_wait: float = 0.05):
+        """
+        Args:
+            process_batch (callable): Called with a list of items, returns the list of their results in order.
+            max_batch_size (int): The maximum number of items in a batch.
+            max_wait (float): The maximum time in seconds the first item of a batch waits for others.
+        """
+        self._process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queues an item and returns a future resolving to its result."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = [(item, future) for item, future in self._next_batch() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self._process_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,48 @@
+import os
+import time
+
+from disk_lru import DiskLRUStore
+
+
+def age(store, key, seconds):
+    path = store.path(key)
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_round_trip_and_missing_key(tmp_path):
+    store = DiskLRUStore(str(tmp_path), ".bin", max_bytes=100)
+    assert store.read("missing") is None
+    assert store.write("a", b"hello")
+    assert store.read("a") == b"hello"
+    assert store.usage() == (1, 5)
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    store = DiskLRUStore(str(tmp_path), ".bin", max_bytes=20)
+    store.write("a", b"x" * 10)
+    store.write("b", b"x" * 10)
+    age(store, "a", 30)
+    age(store, "b", 20)
+    # Reading "a" makes "b" the least recently used
+    store.read("a")
+    store.write("c", b"x" * 10)
+    assert store.read("b") is None
+    assert store.read("a") is not None and store.read("c") is not None
+
+
+def test_ttl_drops_unused_files(tmp_path):
+    store = DiskLRUStore(str(tmp_path), ".json", max_bytes=1000, ttl=60)
+    store.write("old", b"{}")
+    age(store, "old", 120)
+    store.write("new", b"{}")
+    assert store.read("old") is None
+    assert store.read("new") == b"{}"
+
+
+def test_other_files_are_left_alone(tmp_path):
+    (tmp_path / "notes.txt").write_bytes(b"x" * 100)
+    store = DiskLRUStore(str(tmp_path), ".bin", max_bytes=10)
+    store.write("a", b"x" * 5)
+    assert (tmp_path / "notes.txt").exists()
+    assert store.usage() == (1, 5)
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("accelerate")
+diffusers = pytest.importorskip("diffusers")
+
+from diffusers import AutoencoderKL
+
+from model_loading import from_pretrained, load_components, startup_report, weight_files
+
+
+def save_tiny_vae(path, seed):
+    torch.manual_seed(seed)
+    AutoencoderKL(block_out_channels=(8,), norm_num_groups=2, latent_channels=4).save_pretrained(path)
+    return str(path)
+
+
+def test_concurrent_loads_leave_module_creation_alone(tmp_path):
+    paths = [save_tiny_vae(tmp_path / f"vae{n}", n) for n in range(2)]
+    components = load_components("tiny-vaes", {
+        f"vae{n}": lambda path=path: from_pretrained(AutoencoderKL, path) for n, path in enumerate(paths)
+    }, prefetch=[file for path in paths for file in weight_files(path)])
+
+    # A patched `register_parameter` left behind would give every new module meta weights
+    assert torch.nn.Linear(1, 1).weight.device.type == "cpu"
+    for vae in components.values():
+        assert all(parameter.device.type == "cpu" for parameter in vae.parameters())
+    steps = startup_report.as_dict()["models"]["tiny-vaes"]["steps"]
+    assert {"vae0", "vae1", "prefetch"} <= set(steps)
+
+
+def test_models_are_instantiated_one_at_a_time():
+    running, overlaps = [0], []
+    lock = threading.Lock()
+
+    class SlowModel:
+        @classmethod
+        def from_pretrained(cls, *args, **kwargs):
+            with lock:
+                running[0] += 1
+                overlaps.append(running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return cls()
+
+    load_components("slow", {f"model{n}": lambda: from_pretrained(SlowModel, "path") for n in range(4)})
+    assert max(overlaps) == 1
@@ -0,0 +1,60 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+diffusers = pytest.importorskip("diffusers")
+pytest.importorskip("torchvision")
+Image = pytest.importorskip("PIL.Image")
+
+from types import SimpleNamespace
+
+from diffusers import AutoencoderKLCogVideoX
+
+from video_gen.img2vid_pipeline import CogVideoXImg2VidPipeline
+
+HEIGHT, WIDTH, NUM_FRAMES = 32, 32, 17
+
+
+def tiny_pipeline(mode):
+    """Just what `encode_start_frame_distribution` uses, around a tiny random CogVideoX VAE."""
+    torch.manual_seed(0)
+    vae = AutoencoderKLCogVideoX(
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("CogVideoXDownBlock3D",) * 4,
+        up_block_types=("CogVideoXUpBlock3D",) * 4,
+        block_out_channels=(8, 8, 8, 8),
+        latent_channels=4,
+        layers_per_block=1,
+        norm_num_groups=2,
+        temporal_compression_ratio=4,
+    ).eval()
+    return SimpleNamespace(
+        vae=vae,
+        vae_scale_factor_temporal=4,
+        start_frame_cache=None,
+        start_frame_mode=mode,
+        _broadcast_start_frame=CogVideoXImg2VidPipeline._broadcast_start_frame,
+    )
+
+
+def encode(mode):
+    torch.manual_seed(1)
+    image = Image.fromarray((torch.rand(HEIGHT, WIDTH, 3) * 255).to(torch.uint8).numpy())
+    return CogVideoXImg2VidPipeline.encode_start_frame_distribution(
+        tiny_pipeline(mode), image, HEIGHT, WIDTH, NUM_FRAMES, torch.device("cpu")
+    )
+
+
+def test_repeat_is_the_default():
+    assert CogVideoXImg2VidPipeline.start_frame_mode == "repeat"
+
+
+@pytest.mark.parametrize("mode", ["group", "once"])
+def test_broadcast_modes_match_repeat(mode):
+    reference_mean, reference_std = encode("repeat")
+    mean, std = encode(mode)
+    latent_frames = (NUM_FRAMES - 1) // 4 + 1
+    assert mean.shape == reference_mean.shape == (1, 4, latent_frames, HEIGHT // 8, WIDTH // 8)
+    scale = reference_mean.abs().max()
+    assert ((mean - reference_mean).abs().max() / scale).item() < 1e-3
+    assert ((std - reference_std).abs().max() / reference_std.abs().max()).item() < 1e-3
@@ -0,0 +1,55 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+diffusers = pytest.importorskip("diffusers")
+
+from types import SimpleNamespace
+
+from diffusers import AutoencoderKLCogVideoX, CogVideoXPipeline
+from diffusers.image_processor import VaeImageProcessor
+from diffusers.video_processor import VideoProcessor
+
+from video_gen.img2vid_pipeline import CogVideoXImg2VidPipeline
+
+LATENT_FRAMES, LATENT_HEIGHT, LATENT_WIDTH = 5, 4, 4
+
+
+def tiny_pipeline():
+    """Just what `iter_decoded_frames` and `decode_latents` use, around a tiny random CogVideoX VAE."""
+    torch.manual_seed(0)
+    vae = AutoencoderKLCogVideoX(
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("CogVideoXDownBlock3D",) * 4,
+        up_block_types=("CogVideoXUpBlock3D",) * 4,
+        block_out_channels=(8, 8, 8, 8),
+        latent_channels=4,
+        layers_per_block=1,
+        norm_num_groups=2,
+        temporal_compression_ratio=4,
+    ).eval()
+    pipe = SimpleNamespace(
+        vae=vae,
+        vae_scaling_factor_image=vae.config.scaling_factor,
+        _onload=CogVideoXImg2VidPipeline._onload,
+        maybe_free_model_hooks=lambda: None,
+    )
+    pipe._decode_chunk = lambda *args: CogVideoXImg2VidPipeline._decode_chunk(pipe, *args)
+    return pipe
+
+
+def test_streamed_frames_match_the_pil_output():
+    pipe = tiny_pipeline()
+    latents = torch.randn(1, LATENT_FRAMES, 4, LATENT_HEIGHT, LATENT_WIDTH, generator=torch.Generator().manual_seed(1))
+
+    with torch.no_grad():
+        video = CogVideoXPipeline.decode_latents(pipe, latents)
+    expected = VideoProcessor(vae_scale_factor=8).postprocess_video(video=video, output_type="np")[0]
+    expected = np.stack([np.asarray(frame) for frame in VaeImageProcessor.numpy_to_pil(expected)])
+
+    chunks = list(CogVideoXImg2VidPipeline.iter_decoded_frames(pipe, latents))
+    first = chunks[0][0].numpy()
+    assert first.dtype == np.uint8
+    assert np.array_equal(first, expected[:len(first)])
+    assert np.array_equal(np.concatenate([chunk[0].numpy() for chunk in chunks]), expected)
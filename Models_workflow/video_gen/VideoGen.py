@@ -3,12 +3,104 @@ from PIL import Image
 from transformers import T5EncoderModel, T5Tokenizer
 from diffusers import (
     CogVideoXDDIMScheduler,
+    CogVideoXDPMScheduler,
     AutoencoderKLCogVideoX,
     CogVideoXTransformer3DModel
 )
 from diffusers.utils import export_to_video
 from . import img2vid_pipeline
+from . import placement as placement_policy
+from . import quality_tiers
+from .task_control import CancellationToken, ProgressSink, GenerationCancelled
+from .streaming_export import StreamingVideoEncoder
+from model_loading import load_components, startup_report, from_pretrained, weight_files
 import io
+import os
+import time
+
+# Decode the latents chunk by chunk straight into the MP4 encoder instead of decoding the whole video at once
+STREAM_DECODE = os.getenv("VIDEO_STREAM_DECODE", "1") == "1"
+# Also decode each chunk in spatial tiles, lowers the decode memory further but can leave faint seams
+DECODE_SPATIAL_TILING = os.getenv("VIDEO_DECODE_SPATIAL_TILING", "0") == "1"
+# How the start frame is encoded (see `CogVideoXImg2VidPipeline.start_frame_mode`): "group" encodes it over one
+# temporal compression group instead of all the frames, and matches "repeat" (test_start_frame.py). Seeded videos
+# differ from "repeat" as the start frame is sampled with the pipeline generator.
+START_FRAME_MODE = os.getenv("VIDEO_START_FRAME_MODE", "group")
+
+def load_pipeline(
+    model_path: str = "../AI Models/Text-Image2Video/cogvideox-2b-img2vid",
+    dtype: torch.dtype = torch.bfloat16,
+    placement: str = None,
+) -> img2vid_pipeline.CogVideoXImg2VidPipeline:
+    """
+    Loads the CogVideoX image-to-video pipeline so it can be kept resident and reused across requests.
+
+    Parameters:
+    - model_path (str): The path of the pre-trained model to be used.
+    - dtype (torch.dtype): The data type for computation (default is torch.bfloat16).
+    - placement (str): One of `placement.PLACEMENTS`, chosen from the free GPU memory if None.
+    """
+    # 1.  Load the pre-trained CogVideoX pipeline with the specified precision (bfloat16).
+    # The weight files are read concurrently while the modules are built one at a time from them, converted to
+    # `dtype` while being read.
+    start = time.perf_counter()
+    components = load_components("cogvideox-img2vid", {
+        "tokenizer": lambda: T5Tokenizer.from_pretrained(model_path, subfolder="tokenizer"),
+        "text_encoder": lambda: from_pretrained(
+            T5EncoderModel, model_path, subfolder="text_encoder", torch_dtype=dtype
+        ),
+        "transformer": lambda: from_pretrained(
+            CogVideoXTransformer3DModel, model_path, subfolder="transformer", torch_dtype=dtype
+        ),
+        "vae": lambda: from_pretrained(AutoencoderKLCogVideoX, model_path, subfolder="vae", torch_dtype=dtype),
+        "scheduler": lambda: CogVideoXDDIMScheduler.from_pretrained(model_path, subfolder="scheduler"),
+    }, prefetch=weight_files(model_path))
+
+    pipe = img2vid_pipeline.CogVideoXImg2VidPipeline(**components)
+    if START_FRAME_MODE not in img2vid_pipeline.START_FRAME_MODES:
+        raise ValueError(f"Unknown start frame mode {START_FRAME_MODE}, expected one of {img2vid_pipeline.START_FRAME_MODES}")
+    pipe.start_frame_mode = START_FRAME_MODE
+
+    # 2. Set Scheduler, the schedulers of the quality tiers are built once here and swapped per request.
+    pipe.scheduler = CogVideoXDDIMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+    pipe.tier_schedulers = {
+        "ddim": pipe.scheduler,
+        "dpm": CogVideoXDPMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing"),
+    }
+
+    # 3. Place the components (fully on GPU, offloaded or on CPU), they already are in `dtype`.
+    with startup_report.time("cogvideox-img2vid", "placement"):
+        placement = placement_policy.choose_placement(placement_policy.component_bytes(pipe), override=placement)
+        print(f"Video pipeline placement: {placement}")
+        placement_policy.apply_placement(pipe, placement)
+
+    # 4. Cache the prompt embeddings (the empty negative prompt is encoded once here), the encoded start frames
+    # and the per-geometry timesteps and rotary embeddings, warmed for the geometry of each quality tier.
+    # The denoising loop reuses preallocated input and guidance buffers.
+    with startup_report.time("cogvideox-img2vid", "warm_caches"):
+        pipe.enable_prompt_embeds_cache()
+        pipe.enable_start_frame_cache()
+        pipe.enable_geometry_cache()
+        for tier in quality_tiers.TIERS.values():
+            use_scheduler(pipe, tier.scheduler)
+            pipe.warm_geometry_cache(tier.height, tier.width, tier.num_frames, tier.num_inference_steps)
+        use_scheduler(pipe, "ddim")
+    pipe.enable_guidance_buffers()
+
+    startup_report.record_wall("cogvideox-img2vid", time.perf_counter() - start)
+    startup_report.print_model("cogvideox-img2vid")
+    return pipe
+
+
+def use_scheduler(pipe: img2vid_pipeline.CogVideoXImg2VidPipeline, kind: str):
+    """Switches the pipeline to its "ddim" or "dpm" scheduler."""
+    schedulers = getattr(pipe, "tier_schedulers", None)
+    if schedulers is None:
+        scheduler_class = CogVideoXDPMScheduler if kind == "dpm" else CogVideoXDDIMScheduler
+        pipe.scheduler = scheduler_class.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+    else:
+        pipe.scheduler = schedulers[kind]
+
 
 @torch.no_grad()
 def generate_video(
@@ -23,6 +115,16 @@ def generate_video(
     num_videos_per_prompt: int = 1,
     dtype: torch.dtype = torch.bfloat16,
     seed: int = 42,
+    pipe: img2vid_pipeline.CogVideoXImg2VidPipeline = None,
+    cancel_token: CancellationToken = None,
+    progress: ProgressSink = None,
+    stream_decode: bool = STREAM_DECODE,
+    spatial_tiling: bool = DECODE_SPATIAL_TILING,
+    tier: str = None,
+    height: int = 480,
+    width: int = 720,
+    num_frames: int = 49,
+    scheduler: str = "ddim",
 ):
     """
     Generates a video based on the given prompt and saves it to the specified path.
@@ -39,56 +141,91 @@ def generate_video(
     - num_videos_per_prompt (int): Number of videos to generate per prompt.
     - dtype (torch.dtype): The data type for computation (default is torch.bfloat16).
     - seed (int): The seed for reproducibility.
+    - pipe (CogVideoXImg2VidPipeline): An already loaded pipeline (see `load_pipeline`). Loaded from `model_path` if None.
+    - cancel_token (CancellationToken): Stops the generation before the next denoising step once cancelled,
+      `GenerationCancelled` is then raised. Once every step ran, the video is decoded and returned.
+    - progress (ProgressSink): Receives the denoising progress after each step.
+    - stream_decode (bool): Decode the latents a few frames at a time and encode them as they come, which bounds the
+      decode memory by the chunk size instead of the video length.
+    - spatial_tiling (bool): With `stream_decode`, also decode each chunk in spatial tiles.
+    - tier (str): A quality tier of `quality_tiers.TIERS` ("draft", "standard" or "final"), its scheduler, steps,
+      guidance, resolution and frame count replace the arguments below and above.
+    - height (int), width (int): The resolution of the video.
+    - num_frames (int): The number of frames, one plus a multiple of 4.
+    - scheduler (str): "ddim" or "dpm".
     """
+    if pipe is None:
+        pipe = load_pipeline(model_path, dtype)
 
-    # 1.  Load the pre-trained CogVideoX pipeline with the specified precision (bfloat16).
-    tokenizer = T5Tokenizer.from_pretrained(
-        model_path, subfolder="tokenizer"
-    )
-    text_encoder = T5EncoderModel.from_pretrained(
-        model_path, subfolder="text_encoder"
-    )
-    transformer = CogVideoXTransformer3DModel.from_pretrained(
-        model_path, subfolder="transformer"
-    )
-    vae = AutoencoderKLCogVideoX.from_pretrained(
-        model_path, subfolder="vae"
-    )
-    scheduler = CogVideoXDDIMScheduler.from_pretrained(
-        model_path, subfolder="scheduler"
-    )
-
-    pipe = img2vid_pipeline.CogVideoXImg2VidPipeline(
-        tokenizer=tokenizer,
-        text_encoder=text_encoder,
-        transformer=transformer,
-        vae=vae,
-        scheduler=scheduler,
-    )
-
-    # 2. Set Scheduler.
-    pipe.scheduler = CogVideoXDDIMScheduler.from_config(pipe.scheduler.config, timestep_spacing="trailing")
+    use_dynamic_cfg = False  # Only meant for the DPM scheduler
+    if tier is not None:
+        tier = quality_tiers.get_tier(tier)
+        scheduler, num_inference_steps, guidance_scale = tier.scheduler, tier.num_inference_steps, tier.guidance_scale
+        height, width, num_frames = tier.height, tier.width, tier.num_frames
+        use_dynamic_cfg = tier.use_dynamic_cfg
+    use_scheduler(pipe, scheduler)
 
-    # 3. Set the precision and enable CPU offloading.
-    pipe = pipe.to(dtype=dtype)
-    pipe.enable_model_cpu_offload()
-    pipe.enable_sequential_cpu_offload()
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        if progress is not None:
+            progress.update(step + 1, pipe.num_timesteps)
+        if cancel_token is not None and cancel_token.cancelled:
+            pipe._interrupt = True
+        return callback_kwargs
 
     # 4. Generate the video frames based on the prompt.
     # `num_frames` is the Number of frames to generate.
-    # This is the default value for 6 seconds video and 8 fps and will plus 1 frame for the first frame and 49 frames.
-    video_generate = pipe(
-        image=image,
-        prompt=prompt,
-        num_videos_per_prompt=num_videos_per_prompt,  # Number of videos to generate per prompt
-        num_inference_steps=num_inference_steps,  # Number of inference steps
-        num_frames=49,  # Number of frames to generate，changed to 49 for diffusers version `0.30.3` and after.
-        use_dynamic_cfg=False,  # This id used for DPM Sechduler, for DDIM scheduler, it should be False
-        guidance_scale=guidance_scale,
-        generator=torch.Generator().manual_seed(seed),  # Set the seed for reproducibility
-    ).frames[0]
+    # The default of 49 frames is 6 seconds of video at 8 fps, plus 1 frame for the first frame.
+    try:
+        video_generate = pipe(
+            image=image,
+            prompt=prompt,
+            num_videos_per_prompt=num_videos_per_prompt,  # Number of videos to generate per prompt
+            num_inference_steps=num_inference_steps,  # Number of inference steps
+            height=height,
+            width=width,
+            num_frames=num_frames,  # Number of frames to generate，changed to 49 for diffusers version `0.30.3` and after.
+            use_dynamic_cfg=use_dynamic_cfg,  # This id used for DPM Sechduler, for DDIM scheduler, it should be False
+            guidance_scale=guidance_scale,
+            generator=torch.Generator().manual_seed(seed),  # Set the seed for reproducibility
+            callback_on_step_end=on_step_end,
+            output_type="latent" if stream_decode else "pil",
+        ).frames
+        if stream_decode:
+            # Every step ran, the video is finished even if a cancel arrived meanwhile
+            return stream_video(pipe, video_generate, fps=8, spatial_tiling=spatial_tiling)
+        video_generate = video_generate[0]
+    except GenerationCancelled:
+        # Give the memory of the cancelled generation back right away
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        raise
 
     output_stream = io.BytesIO()
     export_to_video(video_generate, output_stream, fps=8)
     output_stream.seek(0)
-    return output_stream
\ No newline at end of file
+    return output_stream
+
+
+def stream_video(
+    pipe: img2vid_pipeline.CogVideoXImg2VidPipeline,
+    latents: torch.Tensor,
+    fps: int = 8,
+    spatial_tiling: bool = False,
+) -> io.BytesIO:
+    """
+    Decodes the latents of the first video chunk by chunk and feeds each chunk to the MP4 encoder right away.
+
+    Parameters:
+    - pipe (CogVideoXImg2VidPipeline): The pipeline the latents come from.
+    - latents (torch.Tensor): The denoised latents, as returned with `output_type="latent"`.
+    - fps (int): The frame rate of the video.
+    - spatial_tiling (bool): Also decode each chunk in spatial tiles.
+    """
+    encoder = StreamingVideoEncoder(fps=fps)
+    try:
+        for frames in pipe.iter_decoded_frames(latents, spatial_tiling=spatial_tiling):
+            encoder.write(frames[0])
+    except BaseException:
+        encoder.abort()
+        raise
+    return encoder.finish()
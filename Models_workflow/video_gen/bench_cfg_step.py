@@ -0,0 +1,83 @@
+# Microbenchmark of the guidance step of the img2vid denoising loop, with and without GuidanceBuffers.
+# The transformer is left out, only the tensor work around it is timed.
+# Run from the Models_workflow folder: python -m video_gen.bench_cfg_step [--device cuda] [--steps 50]
+import argparse
+import time
+
+import torch
+
+from .cfg_buffers import GuidanceBuffers
+
+# Latent geometry of a 480x720x49 video
+LATENT_SHAPE = (1, 13, 16, 60, 90)
+GUIDANCE_SCALE = 6.0
+
+
+def concat_step(latents, start_frame, noise_pred):
+    latent_model_input = torch.cat([latents] * 2)
+    noisy_model_input = torch.cat([latent_model_input, start_frame], dim=2)
+    noise_pred = noise_pred.float()
+    noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+    return noisy_model_input, noise_pred_uncond + GUIDANCE_SCALE * (noise_pred_text - noise_pred_uncond)
+
+
+def buffered_step(buffers, latents, noise_pred):
+    return buffers.fill(latents), buffers.guide(noise_pred, GUIDANCE_SCALE)
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def measure(name, step, steps, device):
+    step()  # Warm up
+    synchronize(device)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+        before = torch.cuda.memory_stats()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    synchronize(device)
+    elapsed = (time.perf_counter() - start) / steps * 1000
+
+    line = f"{name:>8}: {elapsed:8.3f} ms/step"
+    if device.type == "cuda":
+        after = torch.cuda.memory_stats()
+        allocations = (after["allocation.all.allocated"] - before["allocation.all.allocated"]) / steps
+        allocated = (after["allocated_bytes.all.allocated"] - before["allocated_bytes.all.allocated"]) / steps / 2**20
+        line += f", {allocations:5.1f} allocations/step, {allocated:8.1f} MiB allocated/step"
+    print(line)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the img2vid guidance step")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--steps", type=int, default=50)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = torch.bfloat16
+    latents = torch.randn(LATENT_SHAPE, device=device, dtype=dtype)
+    start_frame = torch.randn((2,) + LATENT_SHAPE[1:], device=device, dtype=dtype)
+    noise_pred = torch.randn((2,) + LATENT_SHAPE[1:], device=device, dtype=dtype)
+
+    buffers = GuidanceBuffers(latents, start_frame.shape[2], do_classifier_free_guidance=True)
+    buffers.set_start_frame(start_frame)
+
+    # Both paths must give the same model input and guided prediction
+    reference_input, reference_pred = concat_step(latents, start_frame, noise_pred)
+    buffered_input, buffered_pred = buffered_step(buffers, latents, noise_pred)
+    assert torch.equal(reference_input, buffered_input), "Model inputs differ"
+    print(f"Max guided prediction difference: {(reference_pred - buffered_pred).abs().max().item():.3e}")
+
+    print(f"{args.steps} steps on {device}, latents {tuple(LATENT_SHAPE)} {dtype}")
+    concat_ms = measure("concat", lambda: concat_step(latents, start_frame, noise_pred), args.steps, device)
+    buffered_ms = measure("buffered", lambda: buffered_step(buffers, latents, noise_pred), args.steps, device)
+    print(f"Speedup: {concat_ms / buffered_ms:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import torch
+
+
+class GuidanceBuffers:
+    """
+    Preallocated working tensors for the classifier-free guidance step of the img2vid denoising loop.
+
+    The transformer input is one buffer of shape (copies * batch, frames, latent_channels + image_channels, h, w):
+    the start frame half is written once per generation, and each step only copies the latents into the other half
+    instead of concatenating new tensors. The guided noise prediction is computed in place in a float32 buffer.
+    """
+
+    def __init__(self, latents: torch.Tensor, image_channels: int, do_classifier_free_guidance: bool):
+        self.copies = 2 if do_classifier_free_guidance else 1
+        self.batch_size, num_frames, self.latent_channels, height, width = latents.shape
+        self.model_input = torch.empty(
+            (self.copies * self.batch_size, num_frames, self.latent_channels + image_channels, height, width),
+            dtype=latents.dtype,
+            device=latents.device,
+        )
+        self.noise_pred = torch.empty(latents.shape, dtype=torch.float32, device=latents.device)
+
+    def matches(self, latents: torch.Tensor, image_channels: int, do_classifier_free_guidance: bool) -> bool:
+        """Whether the buffers fit a generation, so they can be reused instead of allocated again."""
+        batch_size, num_frames, latent_channels, height, width = latents.shape
+        return (
+            self.model_input.shape
+            == ((2 if do_classifier_free_guidance else 1) * batch_size, num_frames, latent_channels + image_channels, height, width)
+            and self.model_input.dtype == latents.dtype
+            and self.model_input.device == latents.device
+        )
+
+    def set_start_frame(self, start_frame: torch.Tensor):
+        """Writes the start frame latents, already repeated for each guidance copy, once per generation."""
+        self.model_input[:, :, self.latent_channels:].copy_(start_frame)
+
+    def fill(self, latents: torch.Tensor) -> torch.Tensor:
+        """Copies the latents into every guidance copy of the model input and returns the input."""
+        for copy in range(self.copies):
+            self.model_input[copy * self.batch_size:(copy + 1) * self.batch_size, :, :self.latent_channels].copy_(latents)
+        return self.model_input
+
+    def guide(self, noise_pred: torch.Tensor, guidance_scale: float) -> torch.Tensor:
+        """
+        Computes `uncond + guidance_scale * (text - uncond)` in float32 without temporaries.
+
+        The result lives in the buffer, so it is only valid until the next step.
+        """
+        out = self.noise_pred
+        if self.copies == 1:
+            return out.copy_(noise_pred)
+        noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+        out.copy_(noise_pred_text)
+        out.sub_(noise_pred_uncond)
+        out.mul_(guidance_scale)
+        out.add_(noise_pred_uncond)
+        return out
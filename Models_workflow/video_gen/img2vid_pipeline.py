@@ -1,4 +1,7 @@
+import hashlib
+import inspect
 import math
+from collections import OrderedDict
 from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import torch
@@ -6,6 +9,10 @@ from torchvision import transforms
 from diffusers import CogVideoXDDIMScheduler, CogVideoXDPMScheduler
 from diffusers.callbacks import MultiPipelineCallbacks, PipelineCallback
 from diffusers.pipelines.cogvideo.pipeline_cogvideox import CogVideoXPipeline, CogVideoXPipelineOutput, retrieve_timesteps
+from diffusers.utils.torch_utils import randn_tensor
+
+from .cfg_buffers import GuidanceBuffers
+from .task_control import GenerationCancelled
 
 
 def resize_for_crop(image, crop_h, crop_w):
@@ -30,7 +37,341 @@ def prepare_image(image, video_size, do_resize=True, do_crop=True):
     return image_tensor.unsqueeze(0).unsqueeze(0).permute(0, 2, 1, 3, 4).contiguous()
 
 
+class TensorCache:
+    """
+    LRU cache of tensors reused across calls (prompt embeddings, encoded start frames...).
+
+    Pinned entries (e.g. the empty negative prompt) are never evicted.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = set()
+
+    def get(self, key):
+        embeds = self._entries.get(key)
+        if embeds is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return embeds
+
+    def put(self, key, embeds, pinned: bool = False):
+        self._entries[key] = embeds
+        self._entries.move_to_end(key)
+        if pinned:
+            self._pinned.add(key)
+        for old_key in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if old_key not in self._pinned:
+                del self._entries[old_key]
+
+
+# Which of `eta` and `generator` each scheduler class accepts in `step`
+_STEP_KWARGS_SUPPORT = {}
+
+
+def image_hash(image) -> str:
+    """Hashes the pixels of a PIL image (or the values of a tensor)."""
+    if isinstance(image, torch.Tensor):
+        data = image.detach().cpu().contiguous().view(torch.uint8).numpy().tobytes()
+        return hashlib.sha256(data + str(tuple(image.shape)).encode()).hexdigest()
+    return hashlib.sha256(image.tobytes() + f"{image.mode}{image.size}".encode()).hexdigest()
+
+
+START_FRAME_MODES = ("repeat", "group", "once")
+
+
 class CogVideoXImg2VidPipeline(CogVideoXPipeline):
+    prompt_embeds_cache: Optional[TensorCache] = None
+    start_frame_cache: Optional[TensorCache] = None
+    geometry_cache: Optional[TensorCache] = None
+    guidance_buffers_enabled: bool = False
+    _guidance_buffers: Optional[GuidanceBuffers] = None
+    # "repeat" encodes the image repeated over all the frames, "group" encodes it over one temporal compression
+    # group (1 + vae_scale_factor_temporal frames) and "once" encodes it a single time, the latents are then
+    # broadcast over the latent time axis. test_start_frame.py checks the broadcast against "repeat". "repeat" is
+    # the default of the class, the service picks its mode with VIDEO_START_FRAME_MODE (see VideoGen.py).
+    # RNG: "repeat" samples the start frame from the global torch RNG, as `latent_dist.sample()` always did, so
+    # seeded outputs are unchanged. "group" and "once" sample it with the pipeline `generator`, after the initial
+    # latents: seeded outputs differ from "repeat", and the draws of a scheduler taking the generator shift.
+    start_frame_mode: str = "repeat"
+
+    def enable_prompt_embeds_cache(self, max_entries: int = 64, warm_prompts: Optional[List[str]] = ("",), max_sequence_length: int = 226):
+        """
+        Caches the T5 embeddings of the prompts across calls.
+
+        `warm_prompts` are encoded right away and pinned, by default the empty negative prompt used by
+        classifier-free guidance.
+        """
+        self.prompt_embeds_cache = TensorCache(max_entries)
+        for prompt in warm_prompts or []:
+            self._get_t5_prompt_embeds(prompt, max_sequence_length=max_sequence_length, pin=True)
+
+    @torch.no_grad()
+    def _get_t5_prompt_embeds(
+        self,
+        prompt: Union[str, List[str]] = None,
+        num_videos_per_prompt: int = 1,
+        max_sequence_length: int = 226,
+        device: Optional[torch.device] = None,
+        dtype: Optional[torch.dtype] = None,
+        pin: bool = False,
+    ):
+        if self.prompt_embeds_cache is None:
+            return super()._get_t5_prompt_embeds(prompt, num_videos_per_prompt, max_sequence_length, device, dtype)
+
+        device = device or self._execution_device
+        dtype = dtype or self.text_encoder.dtype
+        prompts = [prompt] if isinstance(prompt, str) else prompt
+
+        # Encode each distinct prompt once, the cached embeddings are shared by all the videos of the prompt
+        embeds = []
+        for text in prompts:
+            key = (text, max_sequence_length, dtype)
+            prompt_embeds = self.prompt_embeds_cache.get(key)
+            if prompt_embeds is None:
+                prompt_embeds = super()._get_t5_prompt_embeds(text, 1, max_sequence_length, device, dtype)
+                self.prompt_embeds_cache.put(key, prompt_embeds, pinned=pin)
+            embeds.append(prompt_embeds.to(device))
+        prompt_embeds = torch.cat(embeds)
+
+        # duplicate text embeddings for each generation per prompt, using mps friendly method
+        _, seq_len, _ = prompt_embeds.shape
+        prompt_embeds = prompt_embeds.repeat(1, num_videos_per_prompt, 1)
+        return prompt_embeds.view(len(prompts) * num_videos_per_prompt, seq_len, -1)
+
+    def enable_geometry_cache(self, max_entries: int = 16):
+        """
+        Caches what only depends on the video geometry and the scheduler (timesteps, rotary embeddings) across calls.
+        """
+        self.geometry_cache = TensorCache(max_entries)
+
+    def warm_geometry_cache(self, height: int = 480, width: int = 720, num_frames: int = 49, num_inference_steps: int = 50):
+        """Precomputes the timesteps and rotary embeddings of a geometry on the execution device."""
+        device = self._execution_device
+        self.prepare_timesteps(num_inference_steps, device)
+        latent_frames = (num_frames - 1) // self.vae_scale_factor_temporal + 1
+        self.prepare_rotary_embeddings(height, width, latent_frames, device)
+
+    def _scheduler_key(self):
+        return (type(self.scheduler).__name__, tuple(sorted((k, str(v)) for k, v in self.scheduler.config.items())))
+
+    def prepare_timesteps(self, num_inference_steps: int, device, timesteps: Optional[List[int]] = None):
+        """
+        Sets the scheduler timesteps like `retrieve_timesteps`, reusing the ones computed for the same scheduler
+        and number of steps.
+        """
+        if timesteps is not None or self.geometry_cache is None:
+            return retrieve_timesteps(self.scheduler, num_inference_steps, device, timesteps)
+
+        key = ("timesteps", self._scheduler_key(), num_inference_steps, str(device))
+        cached = self.geometry_cache.get(key)
+        if cached is None:
+            cached = retrieve_timesteps(self.scheduler, num_inference_steps, device)
+            self.geometry_cache.put(key, cached)
+        else:
+            # Restore the state `set_timesteps` leaves on the scheduler
+            self.scheduler.timesteps = cached[0]
+            self.scheduler.num_inference_steps = cached[1]
+        return cached
+
+    def prepare_rotary_embeddings(self, height: int, width: int, num_latent_frames: int, device):
+        """Returns the rotary positional embeddings of the geometry, None if the transformer does not use them."""
+        if not self.transformer.config.use_rotary_positional_embeddings:
+            return None
+        if self.geometry_cache is None:
+            return self._prepare_rotary_positional_embeddings(height, width, num_latent_frames, device)
+
+        key = ("rotary", height, width, num_latent_frames, str(device))
+        image_rotary_emb = self.geometry_cache.get(key)
+        if image_rotary_emb is None:
+            image_rotary_emb = self._prepare_rotary_positional_embeddings(height, width, num_latent_frames, device)
+            self.geometry_cache.put(key, image_rotary_emb)
+        return image_rotary_emb
+
+    def prepare_extra_step_kwargs(self, generator, eta):
+        # Inspecting the signature of `step` once per scheduler class is enough
+        scheduler_type = type(self.scheduler)
+        if scheduler_type not in _STEP_KWARGS_SUPPORT:
+            step_params = set(inspect.signature(self.scheduler.step).parameters.keys())
+            _STEP_KWARGS_SUPPORT[scheduler_type] = ("eta" in step_params, "generator" in step_params)
+        accepts_eta, accepts_generator = _STEP_KWARGS_SUPPORT[scheduler_type]
+
+        extra_step_kwargs = {}
+        if accepts_eta:
+            extra_step_kwargs["eta"] = eta
+        if accepts_generator:
+            extra_step_kwargs["generator"] = generator
+        return extra_step_kwargs
+
+    def enable_guidance_buffers(self):
+        """
+        Runs the denoising loop on preallocated model input and guidance buffers (see `GuidanceBuffers`), kept
+        across calls with the same geometry.
+        """
+        self.guidance_buffers_enabled = True
+
+    def _prepare_guidance_buffers(self, latents, start_frame, do_classifier_free_guidance: bool) -> GuidanceBuffers:
+        image_channels = start_frame.shape[2]
+        buffers = self._guidance_buffers
+        if buffers is None or not buffers.matches(latents, image_channels, do_classifier_free_guidance):
+            buffers = self._guidance_buffers = GuidanceBuffers(latents, image_channels, do_classifier_free_guidance)
+        buffers.set_start_frame(start_frame)
+        return buffers
+
+    def enable_start_frame_cache(self, max_entries: int = 16):
+        """Caches the encoded start frame of each conditioning image across calls."""
+        self.start_frame_cache = TensorCache(max_entries)
+
+    @torch.no_grad()
+    def encode_start_frame_distribution(self, image, height: int, width: int, num_frames: int, device, mode: Optional[str] = None):
+        """
+        Encodes the conditioning image into the mean and std of its latent distribution over the latent frames.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: The mean and std, shaped (1, latent_channels, latent_frames, h, w).
+                In "group" and "once" modes they are broadcast views of the encoded frames.
+        """
+        mode = mode or self.start_frame_mode
+        latent_frames = (num_frames - 1) // self.vae_scale_factor_temporal + 1
+        if mode == "repeat":
+            encoded_frames = num_frames
+        elif mode == "group":
+            encoded_frames = min(num_frames, 1 + self.vae_scale_factor_temporal)
+        elif mode == "once":
+            encoded_frames = 1
+        else:
+            raise ValueError(f"Unknown start frame mode {mode}")
+
+        key = None
+        if self.start_frame_cache is not None:
+            key = (image_hash(image), height, width, encoded_frames, self.vae.dtype)
+            cached = self.start_frame_cache.get(key)
+            if cached is not None:
+                mean, std = (tensor.to(device) for tensor in cached)
+                return self._broadcast_start_frame(mean, latent_frames), self._broadcast_start_frame(std, latent_frames)
+
+        start_frame = prepare_image(image, (height, width))
+        start_frame = start_frame.to(dtype=self.vae.dtype, device=device)
+        start_frame = start_frame.repeat(1, 1, encoded_frames, 1, 1)
+        latent_dist = self.vae.encode(start_frame).latent_dist
+        mean, std = latent_dist.mean, latent_dist.std
+
+        if key is not None:
+            self.start_frame_cache.put(key, (mean, std))
+        return self._broadcast_start_frame(mean, latent_frames), self._broadcast_start_frame(std, latent_frames)
+
+    @staticmethod
+    def _broadcast_start_frame(latents, latent_frames: int):
+        """Broadcasts the last encoded latent frame over the remaining latent frames."""
+        if latents.shape[2] >= latent_frames:
+            return latents[:, :, :latent_frames]
+        tail = latents[:, :, -1:].expand(-1, -1, latent_frames - latents.shape[2] + 1, -1, -1)
+        return torch.cat([latents[:, :, :-1], tail], dim=2)
+
+    @torch.no_grad()
+    def check_start_frame_equivalence(self, image, height: int = 480, width: int = 720, num_frames: int = 49, mode: Optional[str] = None) -> float:
+        """
+        Compares the start frame latents of `mode` with the reference "repeat" encoding.
+
+        The distribution means are compared, so the result does not depend on sampling noise.
+
+        Returns:
+            float: The maximum absolute difference, relative to the maximum absolute value of the reference.
+        """
+        device = self._execution_device
+        reference, _ = self.encode_start_frame_distribution(image, height, width, num_frames, device, mode="repeat")
+        candidate, _ = self.encode_start_frame_distribution(image, height, width, num_frames, device, mode=mode)
+        reference, candidate = reference.float(), candidate.float()
+        return ((reference - candidate).abs().max() / reference.abs().max().clamp(min=1e-6)).item()
+
+    @staticmethod
+    def _onload(module):
+        """Moves a component offloaded with `enable_model_cpu_offload` to the GPU, as calling it would."""
+        hook = getattr(module, "_hf_hook", None)
+        if hook is not None:
+            hook.pre_forward(module)
+
+    def _decode_chunk(self, z, conv_caches: dict, spatial_tiling: bool):
+        """Decodes a few latent frames, carrying the decoder conv cache of each tile over to the next chunk."""
+        vae = self.vae
+        if not spatial_tiling:
+            if vae.post_quant_conv is not None:
+                z = vae.post_quant_conv(z)
+            decoded, conv_caches[None] = vae.decoder(z, conv_cache=conv_caches.get(None))
+            return decoded
+
+        # Same tiles and blending as `AutoencoderKLCogVideoX.tiled_decode`, which loops over time inside each tile
+        height, width = z.shape[3], z.shape[4]
+        overlap_height = int(vae.tile_latent_min_height * (1 - vae.tile_overlap_factor_height))
+        overlap_width = int(vae.tile_latent_min_width * (1 - vae.tile_overlap_factor_width))
+        blend_extent_height = int(vae.tile_sample_min_height * vae.tile_overlap_factor_height)
+        blend_extent_width = int(vae.tile_sample_min_width * vae.tile_overlap_factor_width)
+        row_limit_height = vae.tile_sample_min_height - blend_extent_height
+        row_limit_width = vae.tile_sample_min_width - blend_extent_width
+
+        rows = []
+        for i in range(0, height, overlap_height):
+            row = []
+            for j in range(0, width, overlap_width):
+                tile = z[:, :, :, i : i + vae.tile_latent_min_height, j : j + vae.tile_latent_min_width]
+                if vae.post_quant_conv is not None:
+                    tile = vae.post_quant_conv(tile)
+                tile, conv_caches[(i, j)] = vae.decoder(tile, conv_cache=conv_caches.get((i, j)))
+                row.append(tile)
+            rows.append(row)
+
+        result_rows = []
+        for i, row in enumerate(rows):
+            result_row = []
+            for j, tile in enumerate(row):
+                if i > 0:
+                    tile = vae.blend_v(rows[i - 1][j], tile, blend_extent_height)
+                if j > 0:
+                    tile = vae.blend_h(row[j - 1], tile, blend_extent_width)
+                result_row.append(tile[:, :, :, :row_limit_height, :row_limit_width])
+            result_rows.append(torch.cat(result_row, dim=4))
+        return torch.cat(result_rows, dim=3)
+
+    @torch.no_grad()
+    def iter_decoded_frames(self, latents: torch.Tensor, spatial_tiling: bool = False):
+        """
+        Decodes the latents a few latent frames at a time, like `AutoencoderKLCogVideoX._decode` does, and yields each
+        chunk of frames as soon as it is decoded, so the whole video never has to be held at once.
+
+        The decoder conv cache is carried from chunk to chunk, so the frames match `decode_latents`. With
+        `spatial_tiling`, each chunk is also decoded in overlapping tiles blended like `tiled_decode`, which bounds the
+        decoder activations further but can leave faint seams between tiles.
+
+        Yields:
+            torch.Tensor: uint8 frames of shape (batch, frames, height, width, 3), on the CPU.
+        """
+        self._onload(self.vae)
+        latents = latents.permute(0, 2, 1, 3, 4)  # [batch_size, num_channels, num_frames, height, width]
+        latents = 1 / self.vae.config.scaling_factor * latents
+
+        num_frames = latents.shape[2]
+        frame_batch_size = self.vae.num_latent_frames_batch_size
+        remaining_frames = num_frames % frame_batch_size
+        conv_caches = {}
+        for k in range(max(num_frames // frame_batch_size, 1)):
+            start_frame = frame_batch_size * k + (0 if k == 0 else remaining_frames)
+            end_frame = frame_batch_size * (k + 1) + remaining_frames
+            frames = self._decode_chunk(latents[:, :, start_frame:end_frame], conv_caches, spatial_tiling)
+            # Same conversion as `postprocess_video` (denormalized in the VAE dtype) and `numpy_to_pil`, which rounds,
+            # done before leaving the device
+            frames = (frames / 2 + 0.5).clamp(0, 1).float().mul(255).round().to(torch.uint8)
+            yield frames.permute(0, 2, 3, 4, 1).cpu()
+
+        conv_caches = None
+        self.maybe_free_model_hooks()
+
     @torch.no_grad()
     def __call__(
         self,
@@ -113,7 +454,7 @@ class CogVideoXImg2VidPipeline(CogVideoXPipeline):
             prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds], dim=0)
 
         # 4. Prepare timesteps
-        timesteps, num_inference_steps = retrieve_timesteps(self.scheduler, num_inference_steps, device, timesteps)
+        timesteps, num_inference_steps = self.prepare_timesteps(num_inference_steps, device, timesteps)
         self._num_timesteps = len(timesteps)
         
         # 5. Prepare latents.
@@ -133,12 +474,12 @@ class CogVideoXImg2VidPipeline(CogVideoXPipeline):
         ## 5.1 Prepare image
         start_frame = None
         if image is not None: 
-            start_frame = prepare_image(image, (height, width))
-            start_frame = start_frame.to(dtype=self.vae.dtype, device='cuda')
-            start_frame = start_frame.repeat(1, 1, num_frames, 1, 1)
-            
-            start_frame = self.vae.encode(start_frame).latent_dist.sample()
-            
+            mean, std = self.encode_start_frame_distribution(image, height, width, num_frames, device=device)
+            # Sample every latent frame independently, like encoding the repeated frames would. See
+            # `start_frame_mode` for the RNG each mode draws from.
+            sample_generator = None if self.start_frame_mode == "repeat" else generator
+            start_frame = mean + std * randn_tensor(mean.shape, generator=sample_generator, device=mean.device, dtype=mean.dtype)
+
             start_frame = start_frame.permute(0, 2, 1, 3, 4).contiguous()
             start_frame = start_frame * self.vae.config.scaling_factor
             start_frame = torch.cat([start_frame] * 2) if do_classifier_free_guidance else start_frame
@@ -147,11 +488,12 @@ class CogVideoXImg2VidPipeline(CogVideoXPipeline):
         extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
 
         # 7. Create rotary embeds if required
-        image_rotary_emb = (
-            self._prepare_rotary_positional_embeddings(height, width, latents.size(1), device)
-            if self.transformer.config.use_rotary_positional_embeddings
-            else None
-        )
+        image_rotary_emb = self.prepare_rotary_embeddings(height, width, latents.size(1), device)
+
+        # 7.1 Write the start frame into the working buffers once, if enabled
+        buffers = None
+        if self.guidance_buffers_enabled and start_frame is not None:
+            buffers = self._prepare_guidance_buffers(latents, start_frame, do_classifier_free_guidance)
 
         # 8. Denoising loop
         num_warmup_steps = max(len(timesteps) - num_inference_steps * self.scheduler.order, 0)
@@ -159,18 +501,23 @@ class CogVideoXImg2VidPipeline(CogVideoXPipeline):
         with self.progress_bar(total=num_inference_steps) as progress_bar:
             # for DPM-solver++
             old_pred_original_sample = None
+            # A cancel is only acted on before a step starts: once the last step ran, the latents are decoded
+            completed_steps = len(timesteps)
             for i, t in enumerate(timesteps):
                 if self.interrupt:
-                    continue
+                    completed_steps = i
+                    break
+
+                if buffers is not None:
+                    latent_model_input = noisy_model_input = buffers.fill(self.scheduler.scale_model_input(latents, t))
+                else:
+                    latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
+                    latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
+                    noisy_model_input = torch.cat([latent_model_input, start_frame], dim=2)
 
-                latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
-                latent_model_input = self.scheduler.scale_model_input(latent_model_input, t)
-                
                 # broadcast to batch dimension in a way that's compatible with ONNX/Core ML
                 timestep = t.expand(latent_model_input.shape[0])
 
-                noisy_model_input = torch.cat([latent_model_input, start_frame], dim=2)
-
                 # predict noise model_output
                 noise_pred = self.transformer(
                     hidden_states=noisy_model_input,
@@ -179,16 +526,19 @@ class CogVideoXImg2VidPipeline(CogVideoXPipeline):
                     image_rotary_emb=image_rotary_emb,
                     return_dict=False,
                 )[0]
-                noise_pred = noise_pred.float()
 
                 # perform guidance
                 if use_dynamic_cfg:
                     self._guidance_scale = 1 + guidance_scale * (
                         (1 - math.cos(math.pi * ((num_inference_steps - t.item()) / num_inference_steps) ** 5.0)) / 2
                     )
-                if do_classifier_free_guidance:
-                    noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
-                    noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
+                if buffers is not None:
+                    noise_pred = buffers.guide(noise_pred, self.guidance_scale)
+                else:
+                    noise_pred = noise_pred.float()
+                    if do_classifier_free_guidance:
+                        noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                        noise_pred = noise_pred_uncond + self.guidance_scale * (noise_pred_text - noise_pred_uncond)
 
                 # compute the previous noisy sample x_t -> x_t-1
                 if not isinstance(self.scheduler, CogVideoXDPMScheduler):
@@ -219,6 +569,14 @@ class CogVideoXImg2VidPipeline(CogVideoXPipeline):
                 if i == len(timesteps) - 1 or ((i + 1) > num_warmup_steps and (i + 1) % self.scheduler.order == 0):
                     progress_bar.update()
 
+        if completed_steps < len(timesteps):
+            # Drop the large tensors before raising, the traceback would keep them alive otherwise
+            latents = latent_model_input = noisy_model_input = noise_pred = start_frame = None
+            prompt_embeds = negative_prompt_embeds = image_rotary_emb = buffers = None
+            self._guidance_buffers = None
+            self.maybe_free_model_hooks()
+            raise GenerationCancelled(f"Generation cancelled after {completed_steps} of {len(timesteps)} steps")
+
         if not output_type == "latent":
             video = self.decode_latents(latents)
             video = self.video_processor.postprocess_video(video=video, output_type=output_type)
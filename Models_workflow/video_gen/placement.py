@@ -0,0 +1,88 @@
+import os
+
+import torch
+
+# From fastest to most memory frugal on GPU, "cpu" runs everything on the CPU
+PLACEMENTS = ("resident", "model_offload", "sequential_offload", "cpu")
+
+# Memory kept free on the GPU for the activations of a 480x720x49 generation
+ACTIVATION_HEADROOM_GB = float(os.getenv("VIDEO_ACTIVATION_HEADROOM_GB", "6"))
+
+
+def component_bytes(pipe, dtype: torch.dtype = None) -> dict:
+    """
+    Returns the size of each model component of a pipeline, as it will be once cast to `dtype`.
+    """
+    sizes = {}
+    for name, component in pipe.components.items():
+        if isinstance(component, torch.nn.Module):
+            element_size = torch.tensor([], dtype=dtype).element_size() if dtype is not None else None
+            sizes[name] = sum(
+                p.numel() * (element_size or p.element_size())
+                for p in list(component.parameters()) + list(component.buffers())
+            )
+    return sizes
+
+
+def requested_placement() -> str:
+    """Returns the placement forced by the VIDEO_PLACEMENT setting, None to choose from the free memory."""
+    placement = os.getenv("VIDEO_PLACEMENT") or None
+    if placement is not None and placement not in PLACEMENTS:
+        raise ValueError(f"VIDEO_PLACEMENT must be one of {PLACEMENTS}, got {placement}")
+    return placement
+
+
+def placement_device(placement: str = None) -> str:
+    """Returns the device the pipeline executes on for a placement."""
+    if placement == "cpu" or not torch.cuda.is_available():
+        return "cpu"
+    return "cuda"
+
+
+def choose_placement(sizes: dict, override: str = None) -> str:
+    """
+    Picks how to place the pipeline from the free GPU memory.
+
+    - resident: every component fits on the GPU at once.
+    - model_offload: the largest component fits, components are moved to the GPU one at a time.
+    - sequential_offload: not even the largest component fits, weights are streamed layer by layer.
+    - cpu: no GPU is available.
+
+    Args:
+        sizes (dict): The size in bytes of each component (see `component_bytes`).
+        override (str): A placement to use instead, e.g. from `requested_placement`.
+
+    Returns:
+        str: One of `PLACEMENTS`.
+    """
+    if override is not None:
+        if override != "cpu" and not torch.cuda.is_available():
+            print(f"Placement {override} needs a GPU, falling back to cpu")
+            return "cpu"
+        return override
+    if not torch.cuda.is_available():
+        return "cpu"
+
+    free_bytes, _ = torch.cuda.mem_get_info()
+    headroom = ACTIVATION_HEADROOM_GB * 1e9
+    if sum(sizes.values()) + headroom <= free_bytes:
+        return "resident"
+    if max(sizes.values(), default=0) + headroom <= free_bytes:
+        return "model_offload"
+    return "sequential_offload"
+
+
+def apply_placement(pipe, placement: str):
+    """Places the pipeline components and records the placement on `pipe.placement`."""
+    if placement == "resident":
+        pipe.to("cuda")
+    elif placement == "model_offload":
+        pipe.enable_model_cpu_offload()
+    elif placement == "sequential_offload":
+        pipe.enable_sequential_cpu_offload()
+    elif placement == "cpu":
+        pipe.to("cpu")
+    else:
+        raise ValueError(f"Unknown placement {placement}")
+    pipe.placement = placement
+    return pipe
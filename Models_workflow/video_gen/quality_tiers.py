@@ -0,0 +1,27 @@
+import os
+from collections import namedtuple
+
+# A named set of generation settings. `scheduler` is "ddim" or "dpm", `use_dynamic_cfg` is only meant for DPM.
+QualityTier = namedtuple(
+    "QualityTier",
+    ["name", "scheduler", "num_inference_steps", "height", "width", "num_frames", "guidance_scale", "use_dynamic_cfg"],
+)
+
+TIERS = {
+    # A few seconds on a resident GPU, good enough to accept or reject a concept
+    "draft": QualityTier("draft", "dpm", 10, 320, 480, 25, 6.0, True),
+    # DPM gets close to the final quality in half the steps
+    "standard": QualityTier("standard", "dpm", 25, 480, 720, 49, 6.0, True),
+    # The original settings
+    "final": QualityTier("final", "ddim", 50, 480, 720, 49, 6.0, False),
+}
+
+DEFAULT_TIER = os.getenv("VIDEO_DEFAULT_TIER", "final")
+
+
+def get_tier(name: str = None) -> QualityTier:
+    """Returns the tier called `name`, `DEFAULT_TIER` if None. Raises ValueError for unknown tiers."""
+    name = name or DEFAULT_TIER
+    if name not in TIERS:
+        raise ValueError(f"Unknown quality tier {name}, expected one of {list(TIERS)}")
+    return TIERS[name]
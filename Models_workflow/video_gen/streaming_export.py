@@ -0,0 +1,64 @@
+import io
+import os
+import tempfile
+
+import imageio_ffmpeg
+import numpy as np
+
+
+class StreamingVideoEncoder:
+    """
+    Encodes frames to an H.264 MP4 as they are produced.
+
+    ffmpeg runs in its own process and reads the frames from a pipe, so encoding overlaps with whatever produces
+    the next frames. MP4 needs a seekable output, so the video is written to a scratch file and read back by `finish`.
+    """
+
+    def __init__(self, fps: int = 8, codec: str = "libx264"):
+        self.fps = fps
+        self.codec = codec
+        self.frame_count = 0
+        self._scratch = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._scratch.name, "video.mp4")
+        self._writer = None
+
+    def write(self, frames):
+        """
+        Appends frames to the video.
+
+        Parameters:
+        - frames: uint8 RGB frames of shape (frames, height, width, 3), as a numpy array or a CPU tensor.
+        """
+        frames = np.asarray(frames)
+        if self._writer is None:
+            height, width = frames.shape[1:3]
+            self._writer = imageio_ffmpeg.write_frames(
+                self._path,
+                (width, height),
+                fps=self.fps,
+                codec=self.codec,
+                output_params=["-movflags", "+faststart"],
+            )
+            self._writer.send(None)  # Starts ffmpeg
+        for frame in frames:
+            self._writer.send(np.ascontiguousarray(frame))
+        self.frame_count += len(frames)
+
+    def finish(self) -> io.BytesIO:
+        """Waits for ffmpeg to flush the video and returns it."""
+        try:
+            if self._writer is None:
+                raise ValueError("No frames were written")
+            self._writer.close()
+            self._writer = None
+            with open(self._path, "rb") as f:
+                return io.BytesIO(f.read())
+        finally:
+            self._scratch.cleanup()
+
+    def abort(self):
+        """Stops ffmpeg and drops the partial video."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._scratch.cleanup()
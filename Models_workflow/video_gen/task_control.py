@@ -0,0 +1,86 @@
+import threading
+import time
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation stops early because its task was cancelled."""
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation flag checked by the generation between two denoising steps.
+
+    The token also cancels itself once `timeout` seconds have passed, so generations whose client gave up
+    waiting stop on their own.
+    """
+
+    def __init__(self, timeout: float = None):
+        self._event = threading.Event()
+        self._deadline = time.monotonic() + timeout if timeout else None
+
+    @property
+    def cancelled(self) -> bool:
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self._event.set()
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled("Generation cancelled")
+
+
+class ProgressSink:
+    """Receives the denoising progress of a generation."""
+
+    def __init__(self):
+        self.step = 0
+        self.total = None
+        self._lock = threading.Lock()
+
+    def update(self, step: int, total: int):
+        with self._lock:
+            self.step = step
+            self.total = total
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"step": self.step, "total": self.total}
+
+
+class TaskRegistry:
+    """Keeps the cancellation token and the progress sink of each running task, keyed by task id."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_id: str, timeout: float = None):
+        """
+        Registers a task.
+
+        Returns:
+            Tuple[CancellationToken, ProgressSink]: The token and the sink of the task.
+        """
+        task = (CancellationToken(timeout), ProgressSink())
+        with self._lock:
+            self._tasks[task_id] = task
+        return task
+
+    def get(self, task_id: str):
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def cancel(self, task_id: str) -> bool:
+        """Cancels a task, returns False if it is unknown or already finished."""
+        task = self.get(task_id)
+        if task is None:
+            return False
+        task[0].cancel()
+        return True
+
+    def remove(self, task_id: str):
+        with self._lock:
+            self._tasks.pop(task_id, None)
@@ -1,12 +1,16 @@
 from flask import Flask, jsonify, render_template, request
 import os
 import json
-import time
-import requests
-import subprocess
-from datetime import datetime
+import threading
 import google.generativeai as genai
 from dotenv import load_dotenv
+from scrape_orchestrator import ScrapeOrchestrator
+from analysis_store import AnalysisStore, format_analysis_text
+from analysis_pipeline import AnalysisPipeline
+from file_api import GeminiFileAPI, HttpFileAPI
+from transcoder import Transcoder
+from dedup_index import DedupIndex
+from trend_digest import TrendDigest
 
 load_dotenv()
 
@@ -16,98 +20,129 @@ app = Flask(__name__)
 API_KEY = os.getenv("GENAI_API_KEY")
 genai.configure(api_key=API_KEY)
 
-# File paths
-DAILY_ANALYSIS_TEXT = "Analysis/daily_analysis.txt"
+# File paths, the JSON file of the former store is imported into the database once
+ANALYSIS_DB_FILE = os.getenv("ANALYSIS_DB_FILE", "Analysis/analyses.db")
 ANALYSIS_JSON_FILE = "Analysis/analysis_data.json"
-FRAME_RATE = 10  # Frames per second for downscaling
-
-def process_video(input_path: str, output_path: str, target_frame_rate: int = FRAME_RATE):
-    """
-    Downscales a video to the specified frame rate using ffmpeg.
-    """
-    ffmpeg_command = [
-        "ffmpeg", "-i", input_path, "-r", str(target_frame_rate), "-c:v", "libx264",
-        "-preset", "fast", "-crf", "23", "-y", output_path
-    ]
-    print("Executing command:", ffmpeg_command)
-    subprocess.run(ffmpeg_command, check=True, stdout=subprocess.DEVNULL)
-
-def upload_file_to_gemini(file_path: str, mime_type: str = None):
-    """Uploads a file to Gemini and returns the file object."""
-    uploaded_file = genai.upload_file(file_path, mime_type=mime_type)
-    print(f"Uploaded file '{uploaded_file.display_name}' as: {uploaded_file.uri}")
-    return uploaded_file
-
-def wait_for_file_activation(uploaded_files):
-    """Waits for uploaded files to become active."""
-    print("Waiting for file activation...")
-    for file in uploaded_files:
-        while (current_file := genai.get_file(file.name)).state.name == "PROCESSING":
-            print(".", end="", flush=True)
-            time.sleep(10)
-        if current_file.state.name != "ACTIVE":
-            raise Exception(f"File {file.name} failed to process")
-    print("All files are active.")
-
-def analyze_tiktok_video(video_path: str, metadata: dict):
-    """Analyzes a TikTok video using Gemini and saves the results."""
-    downscaled_video = "downscaled_video.mp4"
-    process_video(video_path, downscaled_video)
-
-    video_file = upload_file_to_gemini(downscaled_video, mime_type="video/mp4")
-    wait_for_file_activation([video_file])
-
-    analysis_model = genai.GenerativeModel(
-        model_name="gemini-1.5-pro-latest",
-        generation_config={
-            "temperature": 0.5,
-            "top_p": 0.95,
-            "max_output_tokens": 2048,
-            "response_mime_type": "application/json",
-        },
-        system_instruction=(
-            "You are a TikTok video analyst. Analyze the video and metadata to identify viral elements. "
-            "Provide a JSON response with the following structure: "
-            "1. viral_elements: A paragraph describing the video's viral components. "
-            "2. recommendations: Suggestions for improving future videos. "
-            "3. metadata_summary: A summary of the scraped metadata. "
-            "4. topics_and_hashtags: Relevant topics and hashtags."
-        )
-    )
-
-    prompt = (
+FRAME_RATE = int(os.getenv("TRANSCODE_FPS", "10"))  # Frames per second for downscaling
+
+# TikTok scraper service and where it stores the downloaded videos
+SCRAPER_URL = os.getenv("SCRAPER_URL", "http://localhost:8000")
+SCRAPER_VIDEO_ROOT = os.getenv("SCRAPER_VIDEO_ROOT", "/home/virt/Desktop/iZYUoIz_tiktok_scraper/IzYOuIz_tiktok_scraper")
+
+# Analyses run concurrently and append to the store, readers get filtered pages of it
+analysis_store = AnalysisStore(ANALYSIS_DB_FILE)
+imported = analysis_store.import_json(ANALYSIS_JSON_FILE)
+if imported:
+    print(f"Imported {imported} analyses from {ANALYSIS_JSON_FILE}")
+
+# Recency-weighted trends of the stored analyses, updated with every new one and served at /trend-context
+trend_digest = TrendDigest(
+    half_life_hours=float(os.getenv("TREND_HALF_LIFE_HOURS", "72")),
+    token_budget=int(os.getenv("TREND_CONTEXT_TOKENS", "300")),
+)
+print(f"Trend digest built from {trend_digest.bootstrap(analysis_store)} analyses")
+
+# Scraped videos are downscaled in frame rate and resolution before upload, at most TRANSCODE_MAX_PROCESSES at once
+transcoder = Transcoder(
+    target_fps=FRAME_RATE,
+    max_dimension=int(os.getenv("TRANSCODE_MAX_DIMENSION", "720")),
+    max_processes=int(os.getenv("TRANSCODE_MAX_PROCESSES", "2")),
+)
+
+ANALYSIS_SYSTEM_INSTRUCTION = (
+    "You are a TikTok video analyst. Analyze the video and metadata to identify viral elements. "
+    "Provide a JSON response with the following structure: "
+    "1. viral_elements: A paragraph describing the video's viral components. "
+    "2. recommendations: Suggestions for improving future videos. "
+    "3. metadata_summary: A summary of the scraped metadata. "
+    "4. topics_and_hashtags: Relevant topics and hashtags."
+)
+
+analysis_model = genai.GenerativeModel(
+    model_name="gemini-1.5-pro-latest",
+    generation_config={
+        "temperature": 0.5,
+        "top_p": 0.95,
+        "max_output_tokens": 2048,
+        "response_mime_type": "application/json",
+    },
+    system_instruction=ANALYSIS_SYSTEM_INSTRUCTION,
+)
+
+def build_analysis_prompt(metadata: dict) -> str:
+    return (
         f"Analyze this TikTok video and its metadata:\n"
         f"Metadata: {json.dumps(metadata)}\n"
         f"Identify viral elements and suggest improvements."
     )
 
-    response = analysis_model.generate_content([prompt, video_file])
-    analysis_data = json.loads(response.text)
-    store_analysis_result(analysis_data)
+def handle_analysis_response(response_text: str, metadata: dict) -> int:
+    """Parses the analysis returned for a video and stores it, returns its id in the store."""
+    analysis_data = json.loads(response_text)
+    return store_analysis_result(analysis_data, metadata)
+
+# FILE_API_URL points the pipeline at a stand-in of the file API (testing/fake_file_api.py) instead of Gemini
+FILE_API_URL = os.getenv("FILE_API_URL")
+file_api = HttpFileAPI(FILE_API_URL) if FILE_API_URL else GeminiFileAPI(analysis_model)
+
+# Videos are transcoded, uploaded, activated and analyzed in overlapping stages
+analysis_pipeline = AnalysisPipeline(
+    file_api,
+    transcoder.transcode,
+    build_analysis_prompt,
+    handle_analysis_response,
+    transcode_workers=int(os.getenv("TRANSCODE_MAX_PROCESSES", "2")),
+    upload_workers=int(os.getenv("ANALYSIS_UPLOAD_WORKERS", "2")),
+    analysis_workers=int(os.getenv("ANALYSIS_WORKERS", "2")),
+    max_in_flight=int(os.getenv("ANALYSIS_MAX_IN_FLIGHT", "8")),
+    poll_initial=float(os.getenv("ANALYSIS_POLL_INITIAL", "1")),
+    poll_max=float(os.getenv("ANALYSIS_POLL_MAX", "15")),
+)
+
+# Analyzed videos are indexed by content and frame hashes, so copies scraped for other hashtags reuse their analysis
+dedup_index = DedupIndex(
+    ANALYSIS_DB_FILE,
+    frames=int(os.getenv("DEDUP_FRAMES", "8")),
+    max_distance=float(os.getenv("DEDUP_MAX_DISTANCE", "4")),
+)
+# Content hashes of the videos being analyzed, copies of the same file wait for the first analysis
+analyses_in_progress = {}
+analyses_in_progress_lock = threading.Lock()
 
-def store_analysis_result(analysis_data: dict):
-    """Saves the analysis result to text and JSON files."""
-    current_date = datetime.now().strftime("%Y-%m-%d")
-
-    with open(DAILY_ANALYSIS_TEXT, "a") as text_file:
-        text_file.write(f"\n\n=== Analysis on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ===\n")
-        text_file.write(f"Viral Elements: {analysis_data['viral_elements']}\n")
-        text_file.write(f"Recommendations: {analysis_data['recommendations']}\n")
-        text_file.write(f"Metadata Summary: {analysis_data['metadata_summary']}\n")
-
-    if os.path.exists(ANALYSIS_JSON_FILE):
-        with open(ANALYSIS_JSON_FILE, "r") as json_file:
-            historical_data = json.load(json_file)
-    else:
-        historical_data = {}
-
-    historical_data.setdefault(current_date, []).append({
-        "timestamp": datetime.now().isoformat(),
-        "analysis": analysis_data
-    })
+def analyze_tiktok_video(video_path: str, metadata: dict):
+    """Analyzes a TikTok video using Gemini and saves the results, or reuses the analysis of the same video."""
+    fingerprint = dedup_index.fingerprint(video_path)
+    while True:
+        with analyses_in_progress_lock:
+            in_progress = analyses_in_progress.get(fingerprint.sha256)
+            if in_progress is None:
+                analyses_in_progress[fingerprint.sha256] = threading.Event()
+                break
+        in_progress.wait()
 
-    with open(ANALYSIS_JSON_FILE, "w") as json_file:
-        json.dump(historical_data, json_file, indent=2)
+    try:
+        match = dedup_index.lookup(fingerprint)
+        previous = analysis_store.get(match["analysis_id"]) if match else None
+        if previous is not None:
+            print(f"Reusing analysis {previous['id']} for {video_path} ({match['match']} match, distance {match['distance']})")
+            if match["match"] == "near":
+                dedup_index.add(fingerprint, previous["id"])
+            # Only the new topic and hashtag are recorded, the analysis and the trend digest stay as they are
+            analysis_store.attach(previous["id"], metadata)
+            return previous["id"]
+
+        analysis_id = analysis_pipeline.submit(video_path, metadata).result()
+        dedup_index.add(fingerprint, analysis_id)
+        return analysis_id
+    finally:
+        with analyses_in_progress_lock:
+            analyses_in_progress.pop(fingerprint.sha256).set()
+
+def store_analysis_result(analysis_data: dict, metadata: dict = None) -> int:
+    """Appends the analysis result to the analysis store and the trend digest, returns its id in the store."""
+    analysis_id = analysis_store.add(analysis_data, metadata)
+    trend_digest.add(analysis_data, metadata)
+    return analysis_id
 
 topics = [
     'Hot Videos', 'Apparel & Accessories', 'Baby, Kids & Maternity', 'Beauty & Personal Care', 'Business Services',
@@ -116,96 +151,86 @@ topics = [
     'Tech & Electronics', 'Travel', 'Vehicle & Transportation'
 ]
 
-def initiate_topic_scraping(topic_index):
-    """Starts scraping TikTok videos for a given topic index."""
-    request_url = "http://localhost:8000/scrape-and-download/"
-    request_payload = {
-        "search_type": "topic",
-        "search_query": str(topic_index),
-        "max_videos": 1
-    }
-    headers = {"Content-Type": "application/json"}
-
-    try:
-        response = requests.post(request_url, headers=headers, json=request_payload)
-        response_data = response.json()
-        if "id" in response_data:
-            monitor_scraping_status(response_data["id"], topic_index)
-        else:
-            print("Error: No scrape ID returned.")
-    except requests.RequestException as err:
-        print(f"Scraping request failed: {err}")
-
-def initiate_hashtag_scraping(topic_index, hashtag):
-    """Starts scraping TikTok videos for a given hashtag."""
-    print(f"Initiating scraping for hashtag: {hashtag}")
-    request_url = "http://localhost:8000/scrape-and-download/"
-    request_payload = {
-        "search_type": "hashtag",
-        "search_query": hashtag,
-        "max_videos": 1
-    }
-    headers = {"Content-Type": "application/json"}
-
-    try:
-        response = requests.post(request_url, headers=headers, json=request_payload)
-        response_data = response.json()
-        if "id" in response_data:
-            return monitor_video_scraping(response_data["id"], topic_index, hashtag)
-        else:
-            print("Error: No scrape ID returned.")
-    except requests.RequestException as err:
-        print(f"Hashtag scraping request failed: {err}")
-
-def monitor_video_scraping(scrape_id, topic_index, hashtag):
-    """Monitors the status of a hashtag-based video scraping job."""
-    status_url = f"http://localhost:8000/get-status/?id={scrape_id}"
-
-    while True:
-        time.sleep(5)
-        try:
-            response = requests.get(status_url)
-            status_data = response.json()
-            if status_data.get("status") == "completed":
-                print("Scraping completed for hashtag:", hashtag)
-                for video_info in status_data.get("videos", []):
-                    video_path = f"/home/virt/Desktop/iZYUoIz_tiktok_scraper/IzYOuIz_tiktok_scraper{video_info['video']}"
-                    metadata = {k: v for k, v in video_info.items() if k not in ["video", "userid", "videotiktok"]}
-                    metadata.update({"tag": hashtag, "topic": topics[topic_index]})
-                    analyze_tiktok_video(video_path, metadata)
-                return status_data
-        except requests.RequestException as err:
-            print(f"Error checking video scraping status: {err}")
-
-def monitor_scraping_status(scrape_id, topic_index):
-    """Monitors the status of a topic-based scraping job."""
-    status_url = f"http://localhost:8000/get-status/?id={scrape_id}"
-
-    while True:
-        time.sleep(5)
-        try:
-            response = requests.get(status_url)
-            status_data = response.json()
-            if status_data.get("status") == "completed":
-                for hashtag in status_data.get("hashtags", []):
-                    initiate_hashtag_scraping(topic_index, hashtag)
-                break
-        except requests.RequestException as err:
-            print(f"Error checking scraping status: {err}")
+def scraped_video_path(video_info: dict) -> str:
+    """Returns the local path of a video downloaded by the scraper."""
+    return f"{SCRAPER_VIDEO_ROOT}{video_info['video']}"
+
+# Topics, their hashtags and the videos they lead to are scraped and analyzed in the background
+scrape_orchestrator = ScrapeOrchestrator(
+    SCRAPER_URL,
+    analyze_tiktok_video,
+    scraped_video_path,
+    max_topics=int(os.getenv("SCRAPE_MAX_TOPICS", "2")),
+    max_hashtags=int(os.getenv("SCRAPE_MAX_HASHTAGS", "4")),
+    # Enough analyses waiting on the pipeline to keep all of its stages busy
+    max_analyses=int(os.getenv("SCRAPE_MAX_ANALYSES", "8")),
+    poll_initial=float(os.getenv("SCRAPE_POLL_INITIAL", "2")),
+    poll_max=float(os.getenv("SCRAPE_POLL_MAX", "30")),
+)
 
 @app.route("/start-scraping/<int:topic_index>", methods=["GET"])
 def start_scraping(topic_index):
-    initiate_topic_scraping(topic_index)
-    return jsonify({"message": f"Started scraping for topic index {topic_index}"})
+    if not 0 <= topic_index < len(topics):
+        return jsonify({"error": f"Unknown topic index {topic_index}"}), 404
+    run = scrape_orchestrator.start(topic_index, topics[topic_index])
+    return jsonify({
+        "message": f"Started scraping for topic index {topic_index}",
+        "run_id": run.id,
+        "status_url": f"/scrape-status/{run.id}",
+    }), 202
+
+@app.route("/scrape-status/<run_id>", methods=["GET"])
+def scrape_status(run_id):
+    run = scrape_orchestrator.get(run_id)
+    if run is None:
+        return jsonify({"error": "Unknown run"}), 404
+    return jsonify(run.to_dict())
+
+@app.route("/scrape-status", methods=["GET"])
+def scrape_runs():
+    return jsonify({"runs": [run.to_dict() for run in scrape_orchestrator.runs()]})
+
+@app.route("/analysis-pipeline", methods=["GET"])
+def analysis_pipeline_stats():
+    return jsonify({**analysis_pipeline.stats(), "transcoding": transcoder.stats(), "dedup": dedup_index.stats()})
+
+@app.route("/trend-context", methods=["GET"])
+def trend_context():
+    """Returns the trend context of the topic query parameter, of all topics if it is missing or unknown."""
+    topic = request.args.get("topic")
+    context = trend_digest.context(topic)
+    if context is None:
+        return jsonify({"error": "No analysis yet.", "topics": []}), 404
+    return jsonify({"topic": topic if topic in trend_digest.topics() else None, **context, "topics": trend_digest.topics()})
 
 @app.route("/get-analysis", methods=["GET"])
 def get_analysis():
+    """
+    Returns a page of analyses, newest first.
+
+    Query parameters: date_from and date_to (YYYY-MM-DD, inclusive), topic, hashtag, limit (at most 500)
+    and cursor (the next_cursor of the previous page).
+    """
     try:
-        with open(DAILY_ANALYSIS_TEXT, "r") as file:
-            content = file.read()
-        return jsonify({"analysis": content})
-    except FileNotFoundError:
-        return jsonify({"error": "Analysis file not found."}), 404
+        limit = min(int(request.args.get("limit", 50)), 500)
+        cursor = int(request.args["cursor"]) if request.args.get("cursor") else None
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+
+    page = analysis_store.query(
+        date_from=request.args.get("date_from"),
+        date_to=request.args.get("date_to"),
+        topic=request.args.get("topic"),
+        hashtag=request.args.get("hashtag"),
+        limit=limit,
+        before_id=cursor,
+    )
+    if not page["items"] and cursor is None:
+        return jsonify({"error": "No analysis found.", **page}), 404
+    # "analysis" keeps the text rendering of the former daily file, for the page only
+    return jsonify({"analysis": format_analysis_text(page["items"]), **page})
 
 @app.route("/", methods=["GET"])
 def home():
@@ -0,0 +1,184 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Normalized states of an uploaded file, as returned by the `get_states` of the file APIs
+PROCESSING, ACTIVE, FAILED = "PROCESSING", "ACTIVE", "FAILED"
+
+
+class _Job:
+    def __init__(self, video_path: str, metadata: dict):
+        self.video_path = video_path
+        self.metadata = metadata
+        self.future = Future()
+        self.uploaded_file = None
+        self.timings = {}
+        self._stage_start = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.timings[stage] = round(now - self._stage_start, 3)
+        self._stage_start = now
+
+
+class AnalysisPipeline:
+    """
+    Analyzes videos in overlapping stages: transcode, upload, wait for activation, analyze.
+
+    Each stage has its own workers, so the transcoding of a video and the upload of the next ones run while earlier
+    videos wait for activation or are analyzed. Activation is checked by a single poller for all the pending files
+    at once, with an adaptive backoff: the delay goes back to `poll_initial` whenever a file is added or changes
+    state, and grows up to `poll_max` otherwise. A new upload never postpones a poll that is already due.
+    """
+
+    def __init__(self, file_api, transcode, build_prompt, on_result, transcode_workers: int = 2, upload_workers: int = 2,
+                 analysis_workers: int = 2, max_in_flight: int = 8, poll_initial: float = 1, poll_max: float = 15,
+                 poll_factor: float = 1.5, activation_timeout: float = 600):
+        """
+        Args:
+            file_api: A `file_api.GeminiFileAPI` or `file_api.HttpFileAPI`.
+            transcode (callable): Called as `transcode(input_path, output_path)` to prepare a video for upload, returns
+                the path to upload, `output_path` if None.
+            build_prompt (callable): Returns the analysis prompt from the video metadata.
+            on_result (callable): Called as `on_result(response_text, metadata)` once a video is analyzed, its return
+                value is the result of the video's future.
+            transcode_workers (int), upload_workers (int), analysis_workers (int): The workers of each stage.
+            max_in_flight (int): The maximum number of videos in the pipeline, `submit` blocks past it.
+            poll_initial (float), poll_max (float), poll_factor (float): The activation polling backoff, in seconds.
+            activation_timeout (float): How long a file may stay in processing, in seconds.
+        """
+        self.file_api = file_api
+        self.transcode = transcode
+        self.build_prompt = build_prompt
+        self.on_result = on_result
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.poll_factor = poll_factor
+        self.activation_timeout = activation_timeout
+        self.completed = 0
+        self.failed = 0
+        self.recent_timings = []
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._transcoders = ThreadPoolExecutor(max_workers=transcode_workers, thread_name_prefix="transcode")
+        self._uploaders = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix="upload")
+        self._analyzers = ThreadPoolExecutor(max_workers=analysis_workers, thread_name_prefix="analyze")
+        self._pending = {}  # file name -> (job, upload time)
+        self._condition = threading.Condition()
+        self._poller = threading.Thread(target=self._poll_activation, name="activation-poller", daemon=True)
+        self._poller.start()
+
+    def submit(self, video_path: str, metadata: dict) -> Future:
+        """Queues a video and returns a future resolving to the `on_result` of its analysis."""
+        self._slots.acquire()
+        job = _Job(video_path, metadata)
+        job.future.add_done_callback(lambda _: self._slots.release())
+        self._transcoders.submit(self._guard, job, self._transcode)
+        return job.future
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "completed": self.completed,
+                "failed": self.failed,
+                "waiting_activation": len(self._pending),
+                "recent_timings": list(self.recent_timings),
+            }
+
+    def _guard(self, job: _Job, stage, *args):
+        try:
+            stage(job, *args)
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job, error=e)
+
+    def _finish(self, job: _Job, result=None, error: Exception = None):
+        if job.uploaded_file is not None:
+            try:
+                self.file_api.delete(job.uploaded_file)
+            except Exception as e:
+                print(f"Failed to delete uploaded file {job.uploaded_file.name}: {e}")
+        with self._condition:
+            if error is None:
+                self.completed += 1
+                self.recent_timings = (self.recent_timings + [job.timings])[-20:]
+            else:
+                self.failed += 1
+        if error is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(error)
+
+    def _transcode(self, job: _Job):
+        scratch_dir = tempfile.mkdtemp(prefix="analysis-")
+        output_path = os.path.join(scratch_dir, "video.mp4")
+        try:
+            upload_path = self.transcode(job.video_path, output_path) or output_path
+        except Exception:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+            raise
+        job.lap("transcode")
+        self._uploaders.submit(self._guard, job, self._upload, scratch_dir, upload_path)
+
+    def _upload(self, job: _Job, scratch_dir: str, path: str):
+        try:
+            job.uploaded_file = self.file_api.upload(path, mime_type="video/mp4")
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        job.lap("upload")
+        with self._condition:
+            self._pending[job.uploaded_file.name] = (job, time.monotonic())
+            self._condition.notify()
+
+    def _poll_activation(self):
+        delay = self.poll_initial
+        while True:
+            with self._condition:
+                if not self._pending:
+                    self._condition.wait_for(lambda: self._pending)
+                    delay = self.poll_initial
+                # A new upload resets the backoff, bringing the next poll closer but never pushing it back
+                deadline = time.monotonic() + delay
+                while (remaining := deadline - time.monotonic()) > 0:
+                    if self._condition.wait(remaining):
+                        delay = self.poll_initial
+                        deadline = min(deadline, time.monotonic() + delay)
+                pending = dict(self._pending)
+
+            try:
+                states = self.file_api.get_states(list(pending))
+            except Exception as e:
+                print(f"Error checking file activation: {e}")
+                delay = min(delay * self.poll_factor, self.poll_max)
+                continue
+
+            changed = False
+            now = time.monotonic()
+            for name, (job, uploaded_at) in pending.items():
+                state = states.get(name)
+                if state == ACTIVE:
+                    self._take_pending(name)
+                    job.lap("activation")
+                    self._analyzers.submit(self._guard, job, self._analyze)
+                    changed = True
+                elif state == FAILED:
+                    self._take_pending(name)
+                    self._finish(job, error=RuntimeError(f"File {name} failed to process"))
+                    changed = True
+                elif now - uploaded_at > self.activation_timeout:
+                    self._take_pending(name)
+                    self._finish(job, error=TimeoutError(f"File {name} was not activated in time"))
+                    changed = True
+            delay = self.poll_initial if changed else min(delay * self.poll_factor, self.poll_max)
+
+    def _take_pending(self, name: str):
+        with self._condition:
+            self._pending.pop(name, None)
+
+    def _analyze(self, job: _Job):
+        text = self.file_api.generate(self.build_prompt(job.metadata), job.uploaded_file)
+        job.lap("analysis")
+        self._finish(job, result=self.on_result(text, job.metadata))
@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    date TEXT NOT NULL,
+    topic TEXT,
+    hashtag TEXT,
+    analysis TEXT NOT NULL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_by_date ON analyses (date, id);
+CREATE INDEX IF NOT EXISTS analyses_by_topic ON analyses (topic, date, id);
+CREATE INDEX IF NOT EXISTS analyses_by_hashtag ON analyses (hashtag, date, id);
+CREATE TABLE IF NOT EXISTS analysis_tags (
+    analysis_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    topic TEXT,
+    hashtag TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS analysis_tags_by_analysis ON analysis_tags (analysis_id);
+CREATE INDEX IF NOT EXISTS analysis_tags_by_topic ON analysis_tags (topic, analysis_id);
+CREATE INDEX IF NOT EXISTS analysis_tags_by_hashtag ON analysis_tags (hashtag, analysis_id);
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    imported_at TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+"""
+
+
+def normalize_hashtag(hashtag: str) -> str:
+    """Stores and matches hashtags without their leading # and case-insensitively."""
+    return hashtag.strip().lstrip("#").casefold() if hashtag else None
+
+
+class AnalysisStore:
+    """
+    Append-only store of the video analyses in an SQLite database.
+
+    The database runs in WAL mode, so readers never block the writers of concurrent analyses, and every analysis is
+    indexed by date, topic and hashtag so filtered pages are read without scanning the history.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # SQLite connections cannot be shared between threads, each thread gets its own
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, analysis: dict, metadata: dict = None, created_at: datetime = None) -> int:
+        """
+        Appends an analysis.
+
+        Args:
+            analysis (dict): The analysis returned by Gemini.
+            metadata (dict): The scraped metadata of the video, its "topic" and "tag" are indexed.
+            created_at (datetime): When the analysis was made, now if None.
+
+        Returns:
+            int: The id of the analysis.
+        """
+        created_at = created_at or datetime.now()
+        metadata = metadata or {}
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO analyses (created_at, date, topic, hashtag, analysis, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    created_at.isoformat(),
+                    created_at.strftime("%Y-%m-%d"),
+                    metadata.get("topic"),
+                    normalize_hashtag(metadata.get("tag")),
+                    json.dumps(analysis),
+                    json.dumps(metadata) if metadata else None,
+                ),
+            )
+        return cursor.lastrowid
+
+    def attach(self, analysis_id: int, metadata: dict, created_at: datetime = None):
+        """
+        Attaches the topic and hashtag of another video to an analysis, when the same video was scraped again.
+
+        The analysis is then found by the filters on either topic and hashtag, and lists them under "tags".
+        """
+        created_at = created_at or datetime.now()
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO analysis_tags (analysis_id, created_at, topic, hashtag, metadata) VALUES (?, ?, ?, ?, ?)",
+                (analysis_id, created_at.isoformat(), metadata.get("topic"), normalize_hashtag(metadata.get("tag")),
+                 json.dumps(metadata)),
+            )
+
+    def get(self, analysis_id: int) -> dict:
+        """Returns an analysis by id, None if there is none."""
+        row = self._connection().execute("SELECT * FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        return self._rows_to_dicts([row])[0] if row else None
+
+    def query(self, date_from: str = None, date_to: str = None, topic: str = None, hashtag: str = None,
+              limit: int = 50, before_id: int = None) -> dict:
+        """
+        Returns a page of analyses, newest first.
+
+        Args:
+            date_from (str), date_to (str): Inclusive YYYY-MM-DD bounds.
+            topic (str): Only the analyses of this topic, directly or through an attached video.
+            hashtag (str): Only the analyses of videos scraped for this hashtag, directly or through an attached video.
+            limit (int): The page size, at least 1.
+            before_id (int): The `next_cursor` of the previous page.
+
+        Returns:
+            dict: The "items" of the page, the "total" number of matching analyses and the "next_cursor",
+            None on the last page.
+        """
+        if limit < 1:
+            raise ValueError(f"limit must be at least 1, got {limit}")
+        conditions, params = [], []
+        for clause, value in (
+            ("date >= ?", date_from),
+            ("date <= ?", date_to),
+            ("(topic = ? OR id IN (SELECT analysis_id FROM analysis_tags WHERE topic = ?))", topic),
+            ("(hashtag = ? OR id IN (SELECT analysis_id FROM analysis_tags WHERE hashtag = ?))", normalize_hashtag(hashtag)),
+        ):
+            if value:
+                conditions.append(clause)
+                params += [value] * clause.count("?")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self._connection()
+        total = conn.execute(f"SELECT COUNT(*) FROM analyses {where}", params).fetchone()[0]
+
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = conn.execute(
+            f"SELECT * FROM analyses {where} ORDER BY id DESC LIMIT ?", params + [limit + 1]
+        ).fetchall()
+
+        items = self._rows_to_dicts(rows[:limit])
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return {"items": items, "total": total, "next_cursor": next_cursor}
+
+    def import_json(self, json_path: str) -> int:
+        """
+        Imports the analyses of the former `{date: [{"timestamp", "analysis"}]}` JSON file, once per file.
+
+        Returns:
+            int: The number of imported analyses, 0 if the file is missing or was already imported.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        path = os.path.abspath(json_path)
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM imports WHERE path = ?", (path,)).fetchone():
+            return 0
+        with open(json_path, "r") as json_file:
+            historical_data = json.load(json_file)
+
+        rows = []
+        for date, entries in sorted(historical_data.items()):
+            for entry in entries:
+                rows.append((entry.get("timestamp") or date, date, None, None, json.dumps(entry["analysis"]), None))
+        rows.sort(key=lambda row: row[0])
+        with conn:
+            conn.executemany(
+                "INSERT INTO analyses (created_at, date, topic, hashtag, analysis, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute("INSERT INTO imports (path, imported_at, count) VALUES (?, ?, ?)",
+                         (path, datetime.now().isoformat(), len(rows)))
+        return len(rows)
+
+    def _rows_to_dicts(self, rows) -> list:
+        tags = {}
+        if rows:
+            ids = [row["id"] for row in rows]
+            for tag in self._connection().execute(
+                f"SELECT * FROM analysis_tags WHERE analysis_id IN ({','.join('?' * len(ids))}) ORDER BY rowid", ids
+            ):
+                tags.setdefault(tag["analysis_id"], []).append(
+                    {"created_at": tag["created_at"], "topic": tag["topic"], "hashtag": tag["hashtag"]}
+                )
+        return [{**self._row_to_dict(row), "tags": tags.get(row["id"], [])} for row in rows]
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        return {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "date": row["date"],
+            "topic": row["topic"],
+            "hashtag": row["hashtag"],
+            "analysis": json.loads(row["analysis"]),
+            "metadata": json.loads(row["metadata"]) if row["metadata"] else None,
+        }
+
+
+def format_analysis_text(items) -> str:
+    """Renders analyses like the former daily_analysis.txt, oldest first."""
+    lines = []
+    for item in reversed(items):
+        analysis = item["analysis"]
+        lines.append(f"\n\n=== Analysis on {item['created_at'][:19].replace('T', ' ')} ===\n")
+        lines.append(f"Viral Elements: {analysis.get('viral_elements')}\n")
+        lines.append(f"Recommendations: {analysis.get('recommendations')}\n")
+        lines.append(f"Metadata Summary: {analysis.get('metadata_summary')}\n")
+    return "".join(lines)
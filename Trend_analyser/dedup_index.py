@@ -0,0 +1,231 @@
+import hashlib
+import os
+import sqlite3
+import subprocess
+import threading
+from datetime import datetime
+
+from transcoder import probe
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sha256 TEXT NOT NULL UNIQUE,
+    frame_hashes TEXT,
+    analysis_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS video_hash_bands (
+    band_key INTEGER NOT NULL,
+    video_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS video_hash_bands_by_key ON video_hash_bands (band_key);
+CREATE TABLE IF NOT EXISTS dedup_settings (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+MIN_HASH_BANDS = 4  # Bands are at most 16 bits wide, wider ones would rarely match
+
+
+def hash_bands(max_distance: float) -> int:
+    """
+    The number of bands each 64-bit frame hash is split in for near duplicates up to `max_distance` to be found.
+
+    When the mean distance per frame is at most `max_distance`, some frame differs by at most floor(max_distance)
+    bits, and with one more band than that, at least one of its bands is left intact by the differing bits.
+    """
+    return max(MIN_HASH_BANDS, int(max_distance) + 1)
+
+
+def band_keys(frame_hashes: list, bands: int) -> list:
+    """
+    Splits every frame hash in `bands` contiguous bands, keyed by the band layout, frame position and band index.
+
+    Degenerate bands, all zeros or all ones, are left out: uniform areas (black frames, letterboxing) give them in
+    unrelated videos, so they would make every such video a candidate.
+    """
+    keys = set()
+    bounds = [round(index * 64 / bands) for index in range(bands + 1)]
+    for frame, frame_hash in enumerate(frame_hashes):
+        for band in range(bands):
+            width = bounds[band + 1] - bounds[band]
+            value = (frame_hash >> bounds[band]) & ((1 << width) - 1)
+            if value in (0, (1 << width) - 1):
+                continue
+            keys.add((((bands << 8 | frame) << 6 | band) << 16) | value)
+    return sorted(keys)
+
+
+class Fingerprint:
+    """The content hash of a video file and the dHash of frames sampled evenly over its duration."""
+
+    def __init__(self, sha256: str, frame_hashes: list = None):
+        self.sha256 = sha256
+        self.frame_hashes = frame_hashes or []
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_dhashes(path: str, frames: int = 8) -> list:
+    """
+    Computes the 64-bit difference hash of `frames` frames sampled evenly over the video.
+
+    Each frame is shrunk to 9x8 grayscale pixels by ffmpeg and every bit tells whether a pixel is brighter than its
+    right neighbour, which survives re-encoding, rescaling and small overlays.
+    """
+    duration = probe(path)["duration"] or frames
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path,
+         "-vf", f"fps={frames / duration:.6f},scale=9:8:flags=area,format=gray",
+         "-frames:v", str(frames), "-f", "rawvideo", "-"],
+        check=True, capture_output=True,
+    )
+    pixels = result.stdout
+    hashes = []
+    for offset in range(0, len(pixels) - 71, 72):
+        frame = pixels[offset:offset + 72]
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                value = (value << 1) | (frame[row * 9 + col] > frame[row * 9 + col + 1])
+        hashes.append(value)
+    return hashes
+
+
+def hamming_distance(a: list, b: list) -> float:
+    """The mean number of differing bits per frame, over the frames both signatures have."""
+    count = min(len(a), len(b))
+    if count == 0:
+        return float("inf")
+    return sum(bin(x ^ y).count("1") for x, y in zip(a, b)) / count
+
+
+class DedupIndex:
+    """
+    Persistent index of the analyzed videos, so a video scraped again under another hashtag or topic reuses its
+    analysis instead of going through transcoding, upload and the model again.
+
+    Videos are matched by the sha256 of their file first, then by the mean Hamming distance between the dHashes of
+    their sampled frames, for re-encoded or rescaled copies. Only the videos sharing a band of a frame hash (see
+    `hash_bands`) are compared, read from an index. Recall: a near duplicate is found whenever one of its frames
+    within floor(max_distance) bits of the indexed video's has an intact band that is not degenerate (see
+    `band_keys`), so videos made mostly of uniform frames are only matched by content hash.
+    """
+
+    def __init__(self, path: str, frames: int = 8, max_distance: float = 4):
+        """
+        Args:
+            path (str): The SQLite database, can be the database of the analysis store.
+            frames (int): The number of frames sampled per video.
+            max_distance (float): The largest mean number of differing bits per frame of near duplicates. Every
+                extra bit adds a band, narrower bands match more unrelated videos.
+        """
+        self.path = path
+        self.frames = frames
+        self.max_distance = max_distance
+        self.bands = hash_bands(max_distance)
+        self.counts = {"exact": 0, "near": 0, "miss": 0}
+        self._counts_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+        self._reindex_bands()
+
+    def _reindex_bands(self):
+        """Rebuilds the band index when the number of bands changed with `max_distance`."""
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM dedup_settings WHERE name = 'hash_bands'").fetchone()
+        if row is not None and int(row["value"]) == self.bands:
+            return
+        with conn:
+            conn.execute("DELETE FROM video_hash_bands")
+            for video in conn.execute("SELECT id, frame_hashes FROM videos").fetchall():
+                conn.executemany("INSERT INTO video_hash_bands (band_key, video_id) VALUES (?, ?)",
+                                 [(key, video["id"]) for key in band_keys(_decode_hashes(video["frame_hashes"]), self.bands)])
+            conn.execute("INSERT OR REPLACE INTO dedup_settings (name, value) VALUES ('hash_bands', ?)", (str(self.bands),))
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def fingerprint(self, video_path: str) -> Fingerprint:
+        """Hashes a video, with only its content hash when its frames cannot be read."""
+        sha256 = file_sha256(video_path)
+        try:
+            frame_hashes = frame_dhashes(video_path, self.frames)
+        except (subprocess.CalledProcessError, ValueError, OSError) as e:
+            print(f"Could not hash the frames of {video_path}: {e}")
+            frame_hashes = []
+        return Fingerprint(sha256, frame_hashes)
+
+    def lookup(self, fingerprint: Fingerprint) -> dict:
+        """
+        Finds the analyzed video matching a fingerprint.
+
+        Returns:
+            dict: The "analysis_id" of the match, its "match" kind ("exact" or "near") and "distance", None if the
+            video is new.
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT analysis_id FROM videos WHERE sha256 = ?", (fingerprint.sha256,)).fetchone()
+        if row is not None:
+            return self._count({"analysis_id": row["analysis_id"], "match": "exact", "distance": 0})
+
+        best = None
+        keys = band_keys(fingerprint.frame_hashes, self.bands)
+        if keys:
+            placeholders = ",".join("?" * len(keys))
+            candidates = conn.execute(
+                f"SELECT id, frame_hashes, analysis_id FROM videos WHERE id IN "
+                f"(SELECT DISTINCT video_id FROM video_hash_bands WHERE band_key IN ({placeholders}))",
+                keys,
+            ).fetchall()
+            for candidate in candidates:
+                distance = hamming_distance(fingerprint.frame_hashes, _decode_hashes(candidate["frame_hashes"]))
+                if distance <= self.max_distance and (best is None or distance < best["distance"]):
+                    best = {"analysis_id": candidate["analysis_id"], "match": "near", "distance": round(distance, 2)}
+        return self._count(best)
+
+    def add(self, fingerprint: Fingerprint, analysis_id: int):
+        """Records the analysis of a video, keeping the first one when the same file was analyzed twice."""
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO videos (sha256, frame_hashes, analysis_id, created_at) VALUES (?, ?, ?, ?)",
+                (fingerprint.sha256, _encode_hashes(fingerprint.frame_hashes), analysis_id, datetime.now().isoformat()),
+            )
+            if cursor.rowcount:
+                conn.executemany("INSERT INTO video_hash_bands (band_key, video_id) VALUES (?, ?)",
+                                 [(key, cursor.lastrowid) for key in band_keys(fingerprint.frame_hashes, self.bands)])
+
+    def _count(self, match: dict) -> dict:
+        with self._counts_lock:
+            self.counts[match["match"] if match else "miss"] += 1
+        return match
+
+    def stats(self) -> dict:
+        videos = self._connection().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+        with self._counts_lock:
+            return {"videos": videos, "lookups": dict(self.counts)}
+
+
+def _encode_hashes(frame_hashes: list) -> str:
+    return ",".join(f"{value:016x}" for value in frame_hashes)
+
+
+def _decode_hashes(text: str) -> list:
+    return [int(value, 16) for value in text.split(",")] if text else []
@@ -0,0 +1,86 @@
+import requests
+import google.generativeai as genai
+
+from analysis_pipeline import PROCESSING, ACTIVE, FAILED
+
+
+class GeminiFileAPI:
+    """Uploads videos to the Gemini File API and analyzes them with a Gemini model."""
+
+    def __init__(self, analysis_model):
+        """
+        Args:
+            analysis_model (genai.GenerativeModel): The model the videos are analyzed with.
+        """
+        self.analysis_model = analysis_model
+
+    def upload(self, file_path: str, mime_type: str = None):
+        """Uploads a file and returns its handle, whose `name` identifies it in `get_states`."""
+        uploaded_file = genai.upload_file(file_path, mime_type=mime_type)
+        print(f"Uploaded file '{uploaded_file.display_name}' as: {uploaded_file.uri}")
+        return uploaded_file
+
+    def get_states(self, names) -> dict:
+        """Returns the state of each of the given files, listing the files once instead of one call per file."""
+        names = set(names)
+        if len(names) == 1:
+            name = next(iter(names))
+            return {name: _normalize_state(genai.get_file(name).state.name)}
+        states = {}
+        for file in genai.list_files():
+            if file.name in names:
+                states[file.name] = _normalize_state(file.state.name)
+                if len(states) == len(names):
+                    break
+        return states
+
+    def generate(self, prompt: str, uploaded_file) -> str:
+        """Runs the analysis model on the prompt and the uploaded file, returns the response text."""
+        return self.analysis_model.generate_content([prompt, uploaded_file]).text
+
+    def delete(self, uploaded_file):
+        genai.delete_file(uploaded_file.name)
+
+
+class HttpFileAPI:
+    """
+    The same interface over a plain HTTP service, e.g. `testing/fake_file_api.py`, so the pipeline can be run and
+    measured without the Gemini API.
+
+    Endpoints: POST /files (multipart "file") -> {"name"}, GET /files?names=a,b -> {"files": [{"name", "state"}]},
+    POST /generate {"prompt", "file"} -> {"text"}, DELETE /files/<name>.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self._http = requests.Session()
+
+    def upload(self, file_path: str, mime_type: str = None):
+        with open(file_path, "rb") as f:
+            response = self._http.post(f"{self.base_url}/files", files={"file": (file_path, f, mime_type)}, timeout=300)
+        response.raise_for_status()
+        return HttpFile(response.json()["name"])
+
+    def get_states(self, names) -> dict:
+        response = self._http.get(f"{self.base_url}/files", params={"names": ",".join(names)}, timeout=30)
+        response.raise_for_status()
+        return {file["name"]: _normalize_state(file["state"]) for file in response.json()["files"]}
+
+    def generate(self, prompt: str, uploaded_file) -> str:
+        response = self._http.post(f"{self.base_url}/generate", json={"prompt": prompt, "file": uploaded_file.name}, timeout=600)
+        response.raise_for_status()
+        return response.json()["text"]
+
+    def delete(self, uploaded_file):
+        self._http.delete(f"{self.base_url}/files/{uploaded_file.name}", timeout=30)
+
+
+class HttpFile:
+    def __init__(self, name: str):
+        self.name = name
+
+
+def _normalize_state(state: str) -> str:
+    if state in (PROCESSING, "STATE_UNSPECIFIED"):
+        return PROCESSING
+    return ACTIVE if state == ACTIVE else FAILED
@@ -0,0 +1,216 @@
+import asyncio
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+class ScrapeRun:
+    """Progress of the scraping and analysis started for one topic, as reported by /scrape-status."""
+
+    def __init__(self, topic_index: int, topic: str):
+        self.id = uuid.uuid4().hex
+        self.topic_index = topic_index
+        self.topic = topic
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.hashtags = {}  # hashtag -> "scraping", "analyzing", "completed" or "failed"
+        self.videos_found = 0
+        self.videos_analyzed = 0
+        self.videos_failed = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def set_hashtag(self, hashtag: str, status: str):
+        with self._lock:
+            self.hashtags[hashtag] = status
+
+    def add_error(self, message: str):
+        print(f"[{self.id}] {message}")
+        with self._lock:
+            self.errors.append(message)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "topic_index": self.topic_index,
+                "topic": self.topic,
+                "status": self.status,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "hashtags": dict(self.hashtags),
+                "videos_found": self.videos_found,
+                "videos_analyzed": self.videos_analyzed,
+                "videos_failed": self.videos_failed,
+                "errors": list(self.errors),
+            }
+
+
+class ScrapeOrchestrator:
+    """
+    Runs topic scrapes, the hashtag scrapes they lead to and the video analyses on an asyncio loop in a background
+    thread, so the web requests that start them return right away.
+
+    Hashtags of a topic and videos of a hashtag are handled concurrently, bounded by one semaphore per kind of work.
+    Scrape jobs are polled with an adaptive backoff: the delay grows while a job reports no change and goes back to
+    `poll_initial` when it does.
+    """
+
+    def __init__(self, scraper_url: str, analyze_video, video_path, max_topics: int = 2, max_hashtags: int = 4,
+                 max_analyses: int = 2, poll_initial: float = 2, poll_max: float = 30, poll_factor: float = 1.5,
+                 scrape_timeout: float = 3600):
+        """
+        Args:
+            scraper_url (str): The base url of the TikTok scraper, e.g. "http://localhost:8000".
+            analyze_video (callable): Called as `analyze_video(video_path, metadata)` in a worker thread.
+            video_path (callable): Returns the local path of a video from its scraper entry.
+            max_topics (int): The maximum number of topic scrapes running at once.
+            max_hashtags (int): The maximum number of hashtag scrapes running at once.
+            max_analyses (int): The maximum number of video analyses running at once.
+            poll_initial (float): The first delay between two status polls, in seconds.
+            poll_max (float): The longest delay between two status polls, in seconds.
+            poll_factor (float): How much the delay grows after a poll without change.
+            scrape_timeout (float): How long a scrape job may take, in seconds.
+        """
+        self.scraper_url = scraper_url.rstrip("/")
+        self.analyze_video = analyze_video
+        self.video_path = video_path
+        self.max_topics = max_topics
+        self.max_hashtags = max_hashtags
+        self.max_analyses = max_analyses
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.poll_factor = poll_factor
+        self.scrape_timeout = scrape_timeout
+        self._runs = {}
+        self._runs_lock = threading.Lock()
+        self._http = requests.Session()
+        # Blocking HTTP calls and analyses run here, the loop thread only waits on them
+        self._executor = ThreadPoolExecutor(max_workers=max_hashtags + max_analyses + 2, thread_name_prefix="scrape")
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="scrape-orchestrator", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        # Semaphores belong to the loop they are used on, so they are created in its thread
+        self._topic_slots = asyncio.Semaphore(self.max_topics)
+        self._hashtag_slots = asyncio.Semaphore(self.max_hashtags)
+        self._analysis_slots = asyncio.Semaphore(self.max_analyses)
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self, topic_index: int, topic: str) -> ScrapeRun:
+        """Schedules the scraping and analysis of a topic and returns its run right away."""
+        run = ScrapeRun(topic_index, topic)
+        with self._runs_lock:
+            self._runs[run.id] = run
+        asyncio.run_coroutine_threadsafe(self._run_topic(run), self._loop)
+        return run
+
+    def get(self, run_id: str) -> ScrapeRun:
+        with self._runs_lock:
+            return self._runs.get(run_id)
+
+    def runs(self) -> list:
+        with self._runs_lock:
+            return list(self._runs.values())
+
+    async def _call(self, fn, *args):
+        return await self._loop.run_in_executor(self._executor, fn, *args)
+
+    def _post_scrape(self, search_type: str, query: str) -> str:
+        response = self._http.post(f"{self.scraper_url}/scrape-and-download/", json={
+            "search_type": search_type,
+            "search_query": query,
+            "max_videos": 1,
+        }, timeout=30)
+        response_data = response.json()
+        if "id" not in response_data:
+            raise RuntimeError(f"No scrape ID returned for {search_type} {query}")
+        return response_data["id"]
+
+    def _get_status(self, scrape_id: str) -> dict:
+        return self._http.get(f"{self.scraper_url}/get-status/", params={"id": scrape_id}, timeout=30).json()
+
+    async def _scrape(self, run: ScrapeRun, search_type: str, query: str) -> dict:
+        """Starts a scrape job and polls it with an adaptive backoff until it completes."""
+        scrape_id = await self._call(self._post_scrape, search_type, query)
+        deadline = time.monotonic() + self.scrape_timeout
+        delay = self.poll_initial
+        last_status = None
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            try:
+                status_data = await self._call(self._get_status, scrape_id)
+            except (requests.RequestException, ValueError) as err:
+                run.add_error(f"Error checking the status of {search_type} {query}: {err}")
+                delay = min(delay * self.poll_factor, self.poll_max)
+                continue
+            if status_data.get("status") == "completed":
+                return status_data
+            if status_data.get("status") == "failed":
+                raise RuntimeError(f"Scraping {search_type} {query} failed")
+            # Anything new (status, progress...) means the job is moving, look again soon
+            delay = self.poll_initial if status_data != last_status else min(delay * self.poll_factor, self.poll_max)
+            last_status = status_data
+        raise TimeoutError(f"Scraping {search_type} {query} timed out")
+
+    async def _run_topic(self, run: ScrapeRun):
+        try:
+            async with self._topic_slots:
+                run.update(status="running")
+                status_data = await self._scrape(run, "topic", str(run.topic_index))
+                hashtags = status_data.get("hashtags", [])
+                for hashtag in hashtags:
+                    run.set_hashtag(hashtag, "queued")
+            # Hashtags wait for their own slots, the topic slot is free for the next topic meanwhile
+            await asyncio.gather(*(self._run_hashtag(run, hashtag) for hashtag in hashtags))
+            run.update(status="completed", finished_at=time.time())
+        except Exception as err:
+            traceback.print_exc()
+            run.add_error(f"Topic {run.topic} failed: {err}")
+            run.update(status="failed", finished_at=time.time())
+
+    async def _run_hashtag(self, run: ScrapeRun, hashtag: str):
+        try:
+            async with self._hashtag_slots:
+                run.set_hashtag(hashtag, "scraping")
+                status_data = await self._scrape(run, "hashtag", hashtag)
+            videos = status_data.get("videos", [])
+            run.count("videos_found", len(videos))
+            run.set_hashtag(hashtag, "analyzing")
+            results = await asyncio.gather(*(self._analyze(run, hashtag, video_info) for video_info in videos))
+            run.set_hashtag(hashtag, "completed" if all(results) else "failed")
+        except Exception as err:
+            run.add_error(f"Hashtag {hashtag} failed: {err}")
+            run.set_hashtag(hashtag, "failed")
+
+    async def _analyze(self, run: ScrapeRun, hashtag: str, video_info: dict) -> bool:
+        metadata = {k: v for k, v in video_info.items() if k not in ["video", "userid", "videotiktok"]}
+        metadata.update({"tag": hashtag, "topic": run.topic})
+        async with self._analysis_slots:
+            try:
+                await self._call(self.analyze_video, self.video_path(video_info), metadata)
+            except Exception as err:
+                run.add_error(f"Analysis of {video_info.get('video')} ({hashtag}) failed: {err}")
+                run.count("videos_failed")
+                return False
+        run.count("videos_analyzed")
+        return True
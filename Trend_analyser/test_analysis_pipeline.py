@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+
+from analysis_pipeline import ACTIVE, FAILED, PROCESSING, AnalysisPipeline
+
+
+class FakeFile:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeFileAPI:
+    """Files turn ACTIVE `activation` seconds after their upload, names starting with "bad" turn FAILED."""
+
+    def __init__(self, activation: float):
+        self.activation = activation
+        self.uploaded = {}
+        self.polls = []
+        self.deleted = []
+        self._lock = threading.Lock()
+
+    def upload(self, path, mime_type=None):
+        with self._lock:
+            name = f"{path}-{len(self.uploaded)}"
+            self.uploaded[name] = time.monotonic()
+        return FakeFile(name)
+
+    def get_states(self, names):
+        self.polls.append((time.monotonic(), list(names)))
+        now = time.monotonic()
+        return {name: FAILED if name.startswith("bad") else
+                ACTIVE if now - self.uploaded[name] >= self.activation else PROCESSING for name in names}
+
+    def generate(self, prompt, uploaded_file):
+        return json.dumps({"file": uploaded_file.name, "prompt": prompt})
+
+    def delete(self, uploaded_file):
+        self.deleted.append(uploaded_file.name)
+
+
+def pipeline(file_api, **kwargs):
+    return AnalysisPipeline(file_api, lambda input_path, output_path: input_path, lambda metadata: metadata["prompt"],
+                            lambda text, metadata: json.loads(text), **kwargs)
+
+
+def test_videos_are_analyzed_and_their_files_deleted():
+    file_api = FakeFileAPI(activation=0.1)
+    analyses = pipeline(file_api, poll_initial=0.02, poll_max=0.1)
+    futures = [analyses.submit(f"video{n}", {"prompt": f"p{n}"}) for n in range(5)]
+    results = [future.result(timeout=5) for future in futures]
+    assert [result["prompt"] for result in results] == [f"p{n}" for n in range(5)]
+    assert sorted(file_api.deleted) == sorted(file_api.uploaded)
+    assert analyses.stats()["completed"] == 5
+    # Pending files are checked together, not once per file
+    assert len(file_api.polls) < 5 * 0.1 / 0.02
+
+
+def test_failed_activation_fails_the_future():
+    analyses = pipeline(FakeFileAPI(activation=0), poll_initial=0.01)
+    future = analyses.submit("bad-video", {"prompt": "p"})
+    try:
+        future.result(timeout=5)
+    except RuntimeError as e:
+        assert "failed to process" in str(e)
+    else:
+        raise AssertionError("the activation failure was not reported")
+
+
+def test_continuous_uploads_do_not_starve_the_poller():
+    file_api = FakeFileAPI(activation=0.05)
+    analyses = pipeline(file_api, poll_initial=0.2, poll_max=0.2, max_in_flight=100)
+    first = analyses.submit("video0", {"prompt": "p"})
+    # Uploads keep arriving faster than poll_initial for longer than it
+    end = time.monotonic() + 0.6
+    while time.monotonic() < end:
+        analyses.submit("video", {"prompt": "p"})
+        time.sleep(0.02)
+    assert first.result(timeout=0.1)["prompt"] == "p"
+    assert len(file_api.polls) >= 2
+
+
+def test_backoff_grows_while_nothing_changes():
+    file_api = FakeFileAPI(activation=0.6)
+    analyses = pipeline(file_api, poll_initial=0.02, poll_factor=2, poll_max=0.16)
+    analyses.submit("video", {"prompt": "p"}).result(timeout=5)
+    times = [poll_time for poll_time, _ in file_api.polls]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert gaps[-1] > 2 * gaps[0]
+    assert max(gaps) < 0.16 + 0.1
@@ -0,0 +1,87 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from analysis_store import AnalysisStore, format_analysis_text, normalize_hashtag
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AnalysisStore(str(tmp_path / "analyses.db"))
+
+
+def analysis(n):
+    return {"viral_elements": f"hook {n}", "recommendations": f"tip {n}", "metadata_summary": f"video {n}"}
+
+
+def test_normalize_hashtag():
+    assert normalize_hashtag(" #TechTok ") == "techtok"
+    assert normalize_hashtag(None) is None
+
+
+def test_pages_follow_the_cursor_newest_first(store):
+    ids = [store.add(analysis(n), {"topic": "Games", "tag": "#Speedrun"}) for n in range(5)]
+    first = store.query(limit=2)
+    assert [item["id"] for item in first["items"]] == ids[:-3:-1]
+    assert first["total"] == 5
+    second = store.query(limit=2, before_id=first["next_cursor"])
+    last = store.query(limit=2, before_id=second["next_cursor"])
+    assert [item["id"] for item in second["items"] + last["items"]] == ids[2::-1]
+    assert last["next_cursor"] is None
+
+
+def test_limit_below_one_is_rejected(store):
+    store.add(analysis(0))
+    with pytest.raises(ValueError):
+        store.query(limit=0)
+    with pytest.raises(ValueError):
+        store.query(limit=-3)
+
+
+def test_filters(store):
+    today = datetime(2025, 3, 2)
+    store.add(analysis(0), {"topic": "Games", "tag": "#Speedrun"}, today - timedelta(days=1))
+    store.add(analysis(1), {"topic": "Games", "tag": "retro"}, today)
+    store.add(analysis(2), {"topic": "Travel", "tag": "#speedrun"}, today)
+    assert store.query(topic="Games")["total"] == 2
+    assert store.query(hashtag="#SPEEDRUN")["total"] == 2
+    assert store.query(date_from="2025-03-02")["total"] == 2
+    assert store.query(date_to="2025-03-01", topic="Games")["items"][0]["analysis"] == analysis(0)
+
+
+def test_get(store):
+    analysis_id = store.add(analysis(7), {"topic": "Pets"})
+    assert store.get(analysis_id)["metadata"] == {"topic": "Pets"}
+    assert store.get(analysis_id + 1) is None
+
+
+def test_concurrent_writers(store):
+    threads = [threading.Thread(target=lambda n=n: [store.add(analysis(n)) for _ in range(20)]) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.query()["total"] == 80
+
+
+def test_json_import_runs_once(store, tmp_path):
+    path = tmp_path / "analysis_data.json"
+    path.write_text(json.dumps({"2025-01-01": [{"timestamp": "2025-01-01T10:00:00", "analysis": analysis(0)}]}))
+    assert store.import_json(str(path)) == 1
+    assert store.import_json(str(path)) == 0
+    assert store.import_json(str(tmp_path / "missing.json")) == 0
+    assert "=== Analysis on 2025-01-01 10:00:00 ===" in format_analysis_text(store.query()["items"])
+
+
+def test_attached_videos_are_found_by_their_tags(store):
+    analysis_id = store.add(analysis(0), {"topic": "Games", "tag": "#Speedrun"})
+    store.attach(analysis_id, {"topic": "Travel", "tag": "#RoadTrip"})
+    assert store.query(topic="Travel")["items"][0]["id"] == analysis_id
+    assert store.query(hashtag="roadtrip", topic="Travel")["total"] == 1
+    assert store.query(hashtag="roadtrip", topic="Games")["total"] == 1
+    assert store.query(topic="Pets")["total"] == 0
+    assert [tag["hashtag"] for tag in store.get(analysis_id)["tags"]] == ["roadtrip"]
+    # Attaching does not add an analysis
+    assert store.query()["total"] == 1
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from dedup_index import DedupIndex, Fingerprint, band_keys, hash_bands
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def signature(seed, frames=8):
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(frames)]
+
+
+def test_hash_bands_follow_max_distance():
+    assert hash_bands(0) == 4
+    assert hash_bands(4) == 5
+    assert hash_bands(6.5) == 7
+
+
+def test_a_band_survives_up_to_one_bit_less_than_the_bands():
+    rng = random.Random(0)
+    for bands in (4, 5, 7):
+        for _ in range(200):
+            frame_hash = rng.getrandbits(64)
+            changed = flip(frame_hash, rng.sample(range(64), bands - 1))
+            assert set(band_keys([frame_hash], bands)) & set(band_keys([changed], bands))
+
+
+def test_degenerate_bands_are_skipped():
+    assert band_keys([0, (1 << 64) - 1], 4) == []
+    # Only the non-uniform band of the frame is kept
+    assert len(band_keys([0x1234], 4)) == 1
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DedupIndex(str(tmp_path / "analyses.db"), max_distance=4)
+
+
+def test_exact_near_and_miss(index):
+    hashes = signature(1)
+    index.add(Fingerprint("a", hashes), 10)
+    assert index.lookup(Fingerprint("a"))["match"] == "exact"
+
+    near = index.lookup(Fingerprint("b", [flip(value, [3, 17, 40]) for value in hashes]))
+    assert near == {"analysis_id": 10, "match": "near", "distance": 3}
+    assert index.lookup(Fingerprint("c", signature(2))) is None
+    assert index.stats()["lookups"] == {"exact": 1, "near": 1, "miss": 1}
+
+
+def test_bands_are_rebuilt_when_max_distance_changes(tmp_path):
+    path = str(tmp_path / "analyses.db")
+    hashes = signature(3)
+    DedupIndex(path, max_distance=4).add(Fingerprint("a", hashes), 10)
+    wider = DedupIndex(path, max_distance=8)
+    assert wider.bands == 9
+    # Differs by 8 bits in every frame, which only the 9 bands are guaranteed to find
+    changed = [flip(value, range(0, 64, 8)) for value in hashes]
+    assert wider.lookup(Fingerprint("b", changed))["analysis_id"] == 10
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from analysis_store import AnalysisStore
+from trend_digest import TrendDigest
+
+
+def analysis(hashtags, recommendation):
+    return {"topics_and_hashtags": " ".join(f"#{hashtag}" for hashtag in hashtags), "recommendations": recommendation}
+
+
+def test_context_only_changes_with_the_trends():
+    digest = TrendDigest()
+    digest.add(analysis(["speedrun"], "Open with the fastest clip."), {"topic": "Games"})
+    first = digest.context("Games")
+    digest.add(analysis(["speedrun"], "Open with the fastest clip."), {"topic": "Games"})
+    second = digest.context("Games")
+    assert second["analyses"] == first["analyses"] + 1
+    assert second["context"] == first["context"]
+
+
+def test_budget_smaller_than_the_title():
+    digest = TrendDigest(token_budget=1)
+    digest.add(analysis(["speedrun"], "Open with the fastest clip."), {"topic": "Games"})
+    assert digest.context("Games")["context"] == ""
+
+
+def test_recent_trends_rank_first():
+    digest = TrendDigest(half_life_hours=1)
+    now = datetime.now()
+    for _ in range(3):
+        digest.add(analysis(["oldtrend"], "Use the old sound everyone used."), created_at=now - timedelta(days=2))
+    digest.add(analysis(["newtrend"], "Use the new sound from this week."), created_at=now)
+    context = digest.context()["context"]
+    assert context.index("#newtrend") < context.index("#oldtrend")
+    assert context.index("new sound") < context.index("old sound")
+
+
+def test_unknown_topic_falls_back_to_all_topics():
+    digest = TrendDigest()
+    assert digest.context() is None
+    digest.add(analysis(["pets"], "Show the pet reacting first."), {"topic": "Pets", "tag": "#Cats"})
+    assert "in Pets" in digest.context("Pets")["context"]
+    assert "#cats" in digest.context("Pets")["context"]
+    assert digest.context("Travel") == digest.context()
+    assert "Trending topics: Pets." in digest.context()["context"]
+    assert digest.topics() == ["Pets"]
+
+
+def test_bootstrap_reads_the_whole_store(tmp_path):
+    store = AnalysisStore(str(tmp_path / "analyses.db"))
+    for n in range(7):
+        store.add(analysis([f"tag{n}"], "Keep the video under twenty seconds."), {"topic": "Games"})
+    digest = TrendDigest()
+    assert digest.bootstrap(store, page_size=3) == 7
+    assert digest.context("Games")["analyses"] == 7
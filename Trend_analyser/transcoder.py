@@ -0,0 +1,157 @@
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+
+# Containers that are uploaded as they are when their video stream needs no change
+UPLOADABLE_EXTENSIONS = (".mp4", ".m4v")
+
+
+def probe(path: str) -> dict:
+    """
+    Reads the first video stream of a file with ffprobe.
+
+    Returns:
+        dict: The "codec", "width", "height" and "fps" of the stream, the "format_name" and "duration" (in seconds,
+        0 when unknown) of the container.
+    """
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0",
+         "-show_entries", "stream=codec_name,width,height,avg_frame_rate,r_frame_rate:format=format_name,duration",
+         "-of", "json", path],
+        check=True, capture_output=True, text=True,
+    )
+    info = json.loads(result.stdout)
+    if not info.get("streams"):
+        raise ValueError(f"No video stream in {path}")
+    stream = info["streams"][0]
+    return {
+        "codec": stream.get("codec_name"),
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate")),
+        "format_name": info.get("format", {}).get("format_name", ""),
+        "duration": float(info.get("format", {}).get("duration") or 0),
+    }
+
+
+def _parse_rate(rate: str) -> float:
+    """Parses an ffprobe frame rate such as "30000/1001", 0 when unknown."""
+    if not rate or rate == "0/0":
+        return 0
+    num, _, den = rate.partition("/")
+    return float(num) / float(den or 1)
+
+
+def scaled_size(width: int, height: int, max_dimension: int) -> tuple:
+    """The size fitting in `max_dimension` on the longest side, keeping the aspect ratio, even for libx264."""
+    factor = min(1.0, max_dimension / max(width, height))
+    return max(2, int(width * factor) // 2 * 2), max(2, int(height * factor) // 2 * 2)
+
+
+class Transcoder:
+    """
+    Prepares scraped videos for analysis: at most `target_fps` and `max_dimension` pixels on the longest side.
+
+    Each video is probed first. Videos already within the target are uploaded as they are, or stream-copied into an
+    mp4 when their container is not one, and the others are downscaled in frame rate and resolution in a single
+    ffmpeg pass. At most `max_processes` ffmpeg processes run at once, each with its share of the CPU cores.
+    """
+
+    def __init__(self, target_fps: float = 10, max_dimension: int = 720, max_processes: int = 2, crf: int = 23,
+                 preset: str = "fast"):
+        """
+        Args:
+            target_fps (float): The highest frame rate sent for analysis.
+            max_dimension (int): The longest side sent for analysis, in pixels.
+            max_processes (int): The maximum number of ffmpeg processes running at once.
+            crf (int), preset (str): The libx264 settings of re-encoded videos.
+        """
+        self.target_fps = target_fps
+        self.max_dimension = max_dimension
+        self.crf = crf
+        self.preset = preset
+        self.threads_per_process = max(1, (os.cpu_count() or 1) // max_processes)
+        self._slots = threading.BoundedSemaphore(max_processes)
+        self._lock = threading.Lock()
+        self._totals = {}  # action -> {"jobs", "seconds", "input_bytes", "output_bytes"}
+        self._recent = deque(maxlen=50)
+
+    def plan(self, info: dict, input_path: str) -> str:
+        """Returns "skip", "copy" or "encode" for a probed video."""
+        within_target = info["fps"] <= self.target_fps + 0.5 and max(info["width"], info["height"]) <= self.max_dimension
+        if not within_target or info["codec"] != "h264":
+            return "encode"
+        return "skip" if input_path.lower().endswith(UPLOADABLE_EXTENSIONS) else "copy"
+
+    def transcode(self, input_path: str, output_path: str = None) -> str:
+        """
+        Prepares a video for analysis.
+
+        Args:
+            input_path (str): The scraped video.
+            output_path (str): Where to write the prepared video, a unique temporary file if None.
+
+        Returns:
+            str: The path of the video to upload, `input_path` itself when it is uploaded as it is.
+        """
+        start = time.perf_counter()
+        info = probe(input_path)
+        action = self.plan(info, input_path)
+        probe_seconds = time.perf_counter() - start
+
+        if action == "skip":
+            result_path = input_path
+        else:
+            if output_path is None:
+                fd, output_path = tempfile.mkstemp(prefix="transcode-", suffix=".mp4")
+                os.close(fd)
+            with self._slots:
+                subprocess.run(self._command(action, info, input_path, output_path), check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            result_path = output_path
+
+        self._record({
+            "input": os.path.basename(input_path),
+            "action": action,
+            "source": f"{info['width']}x{info['height']}@{info['fps']:.2f}",
+            "probe_seconds": round(probe_seconds, 3),
+            "seconds": round(time.perf_counter() - start, 3),
+            "input_bytes": os.path.getsize(input_path),
+            "output_bytes": os.path.getsize(result_path),
+        })
+        return result_path
+
+    def _command(self, action: str, info: dict, input_path: str, output_path: str) -> list:
+        command = ["ffmpeg", "-v", "error", "-i", input_path]
+        if action == "copy":
+            command += ["-c", "copy"]
+        else:
+            width, height = scaled_size(info["width"], info["height"], self.max_dimension)
+            fps = min(self.target_fps, info["fps"]) if info["fps"] else self.target_fps
+            command += [
+                "-vf", f"fps={fps:g},scale={width}:{height}",
+                "-c:v", "libx264", "-preset", self.preset, "-crf", str(self.crf), "-pix_fmt", "yuv420p",
+                "-threads", str(self.threads_per_process),
+                "-c:a", "aac", "-b:a", "64k",
+            ]
+        return command + ["-movflags", "+faststart", "-y", output_path]
+
+    def _record(self, job: dict):
+        print(f"Transcoded {job['input']} ({job['action']}, {job['source']}) in {job['seconds']}s: "
+              f"{job['input_bytes'] / 1e6:.1f} MB -> {job['output_bytes'] / 1e6:.1f} MB")
+        with self._lock:
+            self._recent.append(job)
+            totals = self._totals.setdefault(job["action"], {"jobs": 0, "seconds": 0.0, "input_bytes": 0, "output_bytes": 0})
+            totals["jobs"] += 1
+            totals["seconds"] = round(totals["seconds"] + job["seconds"], 3)
+            totals["input_bytes"] += job["input_bytes"]
+            totals["output_bytes"] += job["output_bytes"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"totals": {action: dict(totals) for action, totals in self._totals.items()},
+                    "recent": list(self._recent)}
@@ -0,0 +1,177 @@
+import math
+import re
+import threading
+import time
+from datetime import datetime
+
+from analysis_store import normalize_hashtag
+
+ALL_TOPICS = "all"
+CHARS_PER_TOKEN = 4  # Rough size of a token in English text, enough to keep the context within budget
+
+_HASHTAG_PATTERN = re.compile(r"#(\w+)")
+
+
+class _TopicDigest:
+    def __init__(self):
+        self.hashtags = {}  # hashtag -> weight
+        self.topics = {}  # topic -> weight
+        self.recommendations = {}  # normalized text -> [weight, text]
+        self.analyses = 0
+
+
+class TrendDigest:
+    """
+    Recency-weighted aggregate of the analyses, kept per topic and over all topics.
+
+    Weights use forward decay: an analysis made at time t adds exp((t - origin) / tau) instead of decaying every
+    stored weight as time passes, so an update only touches the entries of one analysis and the ranking is the same
+    as with weights decayed to the present. The context of a topic is rebuilt when one of its analyses is added and
+    served as it is, without reading the history again.
+    """
+
+    def __init__(self, half_life_hours: float = 72, token_budget: int = 300, max_entries: int = 500):
+        """
+        Args:
+            half_life_hours (float): After how long an analysis counts half as much as a new one.
+            token_budget (int): The approximate size of a trend context, in tokens.
+            max_entries (int): The number of hashtags, topics and recommendations kept per topic.
+        """
+        self.tau = half_life_hours * 3600 / math.log(2)
+        self.token_budget = token_budget
+        self.max_entries = max_entries
+        self._origin = time.time()
+        self._digests = {}  # topic -> _TopicDigest
+        self._contexts = {}  # topic -> {"context", "analyses", "updated_at"}
+        self._lock = threading.Lock()
+
+    def add(self, analysis: dict, metadata: dict = None, created_at: datetime = None, rebuild: bool = True):
+        """Adds an analysis to its topic and to the digest of all topics, and rebuilds their contexts."""
+        metadata = metadata or {}
+        timestamp = (created_at or datetime.now()).timestamp()
+        topic = metadata.get("topic")
+        hashtags = set(_hashtags(analysis.get("topics_and_hashtags")))
+        if metadata.get("tag"):
+            hashtags.add(normalize_hashtag(metadata["tag"]))
+        recommendations = _sentences(analysis.get("recommendations"))
+
+        with self._lock:
+            exponent = (timestamp - self._origin) / self.tau
+            if exponent > 500:
+                self._rebase(timestamp)
+                exponent = 0
+            weight = math.exp(exponent)
+            for key in filter(None, (ALL_TOPICS, topic)):
+                digest = self._digests.setdefault(key, _TopicDigest())
+                digest.analyses += 1
+                for hashtag in hashtags:
+                    digest.hashtags[hashtag] = digest.hashtags.get(hashtag, 0) + weight
+                if topic:
+                    digest.topics[topic] = digest.topics.get(topic, 0) + weight
+                for sentence in recommendations:
+                    entry = digest.recommendations.setdefault(sentence.casefold(), [0, sentence])
+                    entry[0] += weight
+                self._prune(digest)
+                if rebuild:
+                    self._rebuild(key, digest)
+
+    def context(self, topic: str = None) -> dict:
+        """Returns the precomputed context of a topic, of all topics if None or unknown, None if it is empty."""
+        with self._lock:
+            return self._contexts.get(topic) or self._contexts.get(ALL_TOPICS)
+
+    def topics(self) -> list:
+        with self._lock:
+            return sorted(key for key in self._contexts if key != ALL_TOPICS)
+
+    def bootstrap(self, analysis_store, page_size: int = 500) -> int:
+        """Adds the analyses of the store, returns how many were added."""
+        count, cursor = 0, None
+        while True:
+            page = analysis_store.query(limit=page_size, before_id=cursor)
+            for item in page["items"]:
+                self.add(item["analysis"], item["metadata"], datetime.fromisoformat(item["created_at"]), rebuild=False)
+                count += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        with self._lock:
+            for key, digest in self._digests.items():
+                self._rebuild(key, digest)
+        return count
+
+    def _rebuild(self, key: str, digest: _TopicDigest):
+        self._contexts[key] = {
+            "context": self._render(key, digest),
+            "analyses": digest.analyses,
+            "updated_at": datetime.now().isoformat(),
+        }
+
+    def _rebase(self, timestamp: float):
+        """Moves the origin to `timestamp` before the weights overflow, scaling them down accordingly."""
+        factor = math.exp(-(timestamp - self._origin) / self.tau)
+        for digest in self._digests.values():
+            for weights in (digest.hashtags, digest.topics):
+                for key in weights:
+                    weights[key] *= factor
+            for entry in digest.recommendations.values():
+                entry[0] *= factor
+        self._origin = timestamp
+
+    def _prune(self, digest: _TopicDigest):
+        for weights in (digest.hashtags, digest.topics):
+            if len(weights) > 2 * self.max_entries:
+                for key in sorted(weights, key=weights.get)[:len(weights) - self.max_entries]:
+                    del weights[key]
+        if len(digest.recommendations) > 2 * self.max_entries:
+            ranked = sorted(digest.recommendations, key=lambda key: digest.recommendations[key][0])
+            for key in ranked[:len(ranked) - self.max_entries]:
+                del digest.recommendations[key]
+
+    def _render(self, key: str, digest: _TopicDigest) -> str:
+        """Writes the strongest trends of a digest, strongest first, stopping at the token budget."""
+        budget = self.token_budget * CHARS_PER_TOKEN
+        title = "Current TikTok trends" + ("" if key == ALL_TOPICS else f" in {key}")
+        # No analysis count here: the spec cache is keyed on the context, which must only change with the trends
+        lines = [f"{title}."]
+        hashtags = sorted(digest.hashtags, key=digest.hashtags.get, reverse=True)[:10]
+        if hashtags:
+            lines.append("Trending hashtags: " + ", ".join(f"#{hashtag}" for hashtag in hashtags) + ".")
+        if key == ALL_TOPICS and digest.topics:
+            topics = sorted(digest.topics, key=digest.topics.get, reverse=True)[:5]
+            lines.append("Trending topics: " + ", ".join(topics) + ".")
+        recommendations = sorted(digest.recommendations.values(), key=lambda entry: entry[0], reverse=True)
+        if recommendations:
+            lines.append("What works in viral videos now:")
+            lines += [f"- {text}" for _, text in recommendations[:20]]
+
+        context, size = [], 0
+        for line in lines:
+            if size + len(line) + 1 > budget:
+                break
+            context.append(line)
+            size += len(line) + 1
+        if context and context[-1].endswith(":"):
+            context.pop()
+        return "\n".join(context)
+
+
+def _hashtags(value) -> list:
+    """Reads the hashtags of the free-form "topics_and_hashtags" field of an analysis."""
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [hashtag for item in value for hashtag in _hashtags(item)]
+    if isinstance(value, str):
+        return [normalize_hashtag(hashtag) for hashtag in _HASHTAG_PATTERN.findall(value)]
+    return []
+
+
+def _sentences(value) -> list:
+    """Splits the recommendations of an analysis, a paragraph or a list, in sentences."""
+    if isinstance(value, list):
+        return [sentence for item in value for sentence in _sentences(item)]
+    if not isinstance(value, str):
+        return []
+    sentences = (sentence.strip(" -*\n") for sentence in re.split(r"(?<=[.!?])\s+|\n+", value))
+    return [sentence for sentence in sentences if len(sentence) > 15]
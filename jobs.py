@@ -0,0 +1,160 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """
+    A submitted content creation job, its progress events and its final artifact.
+
+    Events are dicts with at least a "message" and a "status" ("info", "success" or "danger"), plus
+    optional fields like "stage", "step" and "total" for per-step progress. The last event has "done" set.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.preview = None  # A quick draft of the result, available before the job finishes
+        self.artifacts = {}  # Intermediate results a follow-up job can reuse
+        self.error = None
+        self.events = []
+        self.cancel_requested = threading.Event()
+        self._cancel_callbacks = []
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def on_cancel(self, callback):
+        """Registers `callback()` to run when the job is cancelled, right away if it already is."""
+        with self._condition:
+            if not self.cancel_requested.is_set():
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self) -> bool:
+        """Requests the job to stop. Returns False if it is already finished."""
+        with self._condition:
+            if self.finished or self.cancel_requested.is_set():
+                return False
+            self.cancel_requested.set()
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        self.emit("Cancellation requested", status="danger")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+        return True
+
+    def emit(self, message: str, status: str = "info", **extra):
+        """Records a progress event and wakes up the event streams."""
+        event = {"job_id": self.id, "time": time.time(), "message": message, "status": status, **extra}
+        with self._condition:
+            self.events.append(event)
+            self._condition.notify_all()
+
+    def _finish(self, status: str, message: str, result=None, error: str = None):
+        # The last event is recorded together with the status so streams never miss it
+        with self._condition:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.events.append({
+                "job_id": self.id, "time": self.finished_at, "message": message,
+                "status": "success" if status == "completed" else "danger", "done": True,
+            })
+            self._condition.notify_all()
+
+    def iter_events(self, keepalive: float = 15):
+        """
+        Yields the events of the job as they happen, until the job is finished.
+
+        Yields None when nothing happened for `keepalive` seconds, so the caller can keep the connection open.
+        """
+        index = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self.events) > index or self.finished, keepalive)
+                new_events = self.events[index:]
+                finished = self.finished
+            index += len(new_events)
+            yield from new_events
+            if finished and not new_events:
+                return
+            if not new_events:
+                yield None
+
+    def to_dict(self) -> dict:
+        progress = next((event for event in reversed(self.events) if "step" in event), None)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "has_preview": self.preview is not None,
+            "last_event": self.events[-1] if self.events else None,
+            "progress": progress and {"stage": progress.get("stage"), "step": progress["step"], "total": progress["total"]},
+        }
+
+
+class JobManager:
+    """Runs submitted jobs on a worker pool and keeps finished jobs around for `ttl` seconds."""
+
+    def __init__(self, max_workers: int = 4, ttl: float = 3600):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Job:
+        """
+        Queues `fn(job, *args, **kwargs)` and returns its job right away.
+
+        `fn` reports progress with `job.emit(...)`, stops its work from `job.on_cancel(...)` callbacks and
+        returns the final artifact as bytes.
+        """
+        self._expire()
+        job = Job()
+        with self._lock:
+            self._jobs[job.id] = job
+        job.emit("Job queued")
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested.is_set():
+            job._finish("cancelled", "Job cancelled")
+            return
+        job.status = "running"
+        job.emit("Job started")
+        try:
+            result = fn(job, *args, **kwargs)
+        except Exception as e:
+            if job.cancel_requested.is_set():
+                job._finish("cancelled", "Job cancelled")
+                return
+            traceback.print_exc()
+            job._finish("failed", f"Job failed: {e}", error=str(e))
+        else:
+            job._finish("completed", "Processing complete!", result=result)
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.finished and now - job.finished_at > self.ttl:
+                    del self._jobs[job_id]
@@ -1,9 +1,13 @@
-from flask import Flask, request, jsonify, Response
-import requests
-from moviepy import VideoFileClip, AudioFileClip
-import io
+from flask import Flask, request, jsonify, Response, url_for
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import random
 import threading
-from Gemenai_workflow.Gemanai_workflow import process_user_input
+from Gemenai_workflow.Gemanai_workflow import generate_content_specs
+from orchestrator import Stage, StageBoard, run_stages, make_http_session
+from muxing import mux_audio_video
+from jobs import JobManager
 
 app = Flask(__name__)
 
@@ -12,6 +16,19 @@ AUDIO_SERVER = "http://localhost:5001/generate_audio"
 VIDEO_SERVER = "http://localhost:5002/generate_video"
 IMAGE_SERVER = "http://localhost:5002/generate_image"
 SPEECH_SERVER = "http://localhost:5002/recognize_speech"
+VIDEO_PROGRESS_SERVER = "http://localhost:5002/progress"
+VIDEO_CANCEL_SERVER = "http://localhost:5002/cancel"
+MODEL_SERVER_TIMEOUT = 1800  # Seconds, video generation takes minutes
+VIDEO_PROGRESS_INTERVAL = 2  # Seconds between two polls of the denoising progress
+# Seed of the video generations when the client sends none, a fixed one lets the model server cache the videos
+DEFAULT_SEED = int(os.getenv("DEFAULT_SEED", "42"))
+
+# Stages of all in-flight requests share this executor and the keep-alive connections to the model servers
+stage_executor = ThreadPoolExecutor(max_workers=int(os.getenv("STAGE_WORKERS", "16")), thread_name_prefix="stage")
+http = make_http_session()
+
+# Submitted jobs run on their own worker pool, web threads only submit and report
+job_manager = JobManager(max_workers=int(os.getenv("JOB_WORKERS", "4")), ttl=float(os.getenv("JOB_TTL", "3600")))
 
 def mix_audio_video(video_bytes, audio_bytes):
     """
@@ -24,80 +41,346 @@ def mix_audio_video(video_bytes, audio_bytes):
     Returns:
         bytes: The mixed video file as bytes.
     """
-    # Save to temporary files
-    with open("temp_video.mp4", "wb") as f:
-        f.write(video_bytes)
-    with open("temp_audio.wav", "wb") as f:
-        f.write(audio_bytes)
-    
-    # Mix using moviepy
-    video = VideoFileClip("temp_video.mp4")
-    audio = AudioFileClip("temp_audio.wav")
-    final_video = video.set_audio(audio)
-    
-    # Export to bytes
-    output = io.BytesIO()
-    final_video.write_videofile(output, codec="libx264", audio_codec="aac")
-    return output.getvalue()
+    return mux_audio_video(video_bytes, audio_bytes)
+
+def create_specs(user_input, board):
+    """
+    Generates the content specs, publishing each field to the board as soon as it is known.
+
+    Returns:
+        dict: The content specifications.
+    """
+    try:
+        return generate_content_specs(user_input, on_field=board.publish)
+    except Exception as e:
+        # Stages waiting on a single field must not wait forever
+        board.fail("image_prompt", e)
+        raise
+
+def content_stages(board, user_input, audio_bytes=None, job=None, preview=False, upgrade=True, seed=None):
+    """
+    Builds the dependency graph of the content creation workflow.
+
+    The image starts as soon as the image prompt is known, and audio only depends on the LLM output,
+    so it runs while the image and then the video are generated.
+
+    Args:
+        board (StageBoard): The board the stages publish to.
+        user_input (str): The user's product description.
+        audio_bytes (bytes): A voice recording of the description, transcribed when `user_input` is empty.
+        job (Job): The job to report the denoising progress to.
+        preview (bool): Render a draft video first and publish it as the job preview.
+        upgrade (bool): With `preview`, render the final video right after the draft. Otherwise the draft is
+            the video of the job, and it can be upgraded later (see `/jobs/<job_id>/upgrade`).
+        seed (int): The seed of the video generations, the draft and the final video share it.
+
+    Returns:
+        list[Stage]: The stages of the workflow, the final video is published under "final".
+    """
+    if preview:
+        video_stages = [
+            Stage("preview", lambda specs, image: generate_preview(specs, image, job, seed), ("specs", "image")),
+            Stage("video",
+                  (lambda specs, image, draft: generate_video(specs, image, job, tier="final", seed=seed))
+                  if upgrade else (lambda specs, image, draft: draft),
+                  ("specs", "image", "preview")),
+        ]
+    else:
+        video_stages = [Stage("video", lambda specs, image: generate_video(specs, image, job, seed=seed), ("specs", "image"))]
+    return [
+        Stage("user_input", lambda: user_input or recognize_speech(audio_bytes), ()),
+        Stage("specs", lambda text: create_specs(text, board), ("user_input",)),
+        Stage("image", generate_image, ("image_prompt",)),
+        *video_stages,
+        Stage("audio", generate_audio, ("specs",)),
+        Stage("final", lambda video, audio: mix_audio_video(video_bytes=video, audio_bytes=audio), ("video", "audio")),
+    ]
+
+def run_content_job(job, user_input, audio_bytes, preview=False, upgrade=True, seed=None):
+    """
+    Runs the content creation workflow of a job and reports the progress of each stage.
+
+    Returns:
+        bytes: The final video.
+    """
+    def on_stage(stage, event, error):
+        if event == "failed":
+            job.emit(f"Stage {stage} failed: {error}", status="danger", stage=stage)
+        else:
+            job.emit(f"Stage {stage} {event}", stage=stage)
+
+    # Run the stages, each job gets its own board of results
+    board = StageBoard()
+    job.on_cancel(lambda: board.fail("final", RuntimeError("Job cancelled")))
+    run_stages(content_stages(board, user_input, audio_bytes, job, preview, upgrade, seed),
+               stage_executor, board=board, listener=on_stage)
+    final = board.get("final")
+    if preview and not upgrade:
+        # Everything the final render of the draft needs
+        job.artifacts = {"specs": board.get("specs"), "image": board.get("image"), "audio": board.get("audio"), "seed": seed}
+    return final
+
+def run_upgrade_job(job, artifacts):
+    """
+    Renders the final video of an accepted draft, reusing the specs, image, audio and seed of its job.
+
+    Returns:
+        bytes: The final video.
+    """
+    job.emit("Rendering the final video of the draft", stage="video")
+    video = generate_video(artifacts["specs"], artifacts["image"], job, tier="final", seed=artifacts["seed"])
+    job.emit("Mixing audio and video", stage="final")
+    return mix_audio_video(video_bytes=video, audio_bytes=artifacts["audio"])
+
+def is_enabled(value, default=False):
+    """Reads a boolean option sent as JSON or as a form field."""
+    if value is None or value == "":
+        return default
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+def job_links(job):
+    links = {
+        "status_url": url_for("job_status", job_id=job.id, _external=True),
+        "events_url": url_for("job_events", job_id=job.id, _external=True),
+    }
+    if job.preview is not None:
+        links["preview_url"] = url_for("job_preview", job_id=job.id, _external=True)
+    if job.status == "completed":
+        links["url"] = url_for("job_result", job_id=job.id, _external=True)
+    if job.artifacts:
+        links["upgrade_url"] = url_for("job_upgrade", job_id=job.id, _external=True)
+    return links
 
 @app.route('/generate_content', methods=['POST'])
 def handle_content_creation():
     """
-    Handles the content creation workflow.
+    Submits a content creation job and returns its id right away.
+
+    Options, sent as JSON or as form fields along with the audio:
+    - preview: render a draft video first, served at the preview url of the job within seconds.
+    - upgrade (default true): with preview, render the final video right after the draft. When false the job
+      finishes with the draft, and posting to its upgrade url renders the final video with the same seed.
+    - seed: the seed of the video generations, `DEFAULT_SEED` if not given, a random one if "random".
     """
     user_input = ""
-    print("those are request : {request}")
+    audio_bytes = None
     # Handle audio/text input
     if 'audio' in request.files:
-        audio_file = request.files['audio']
-        # Convert speech to text
-        response = requests.post(SPEECH_SERVER, files={'audio': audio_file})
-        user_input = response.json().get('user_text', '')
+        audio_bytes = request.files['audio'].read()
+        options = request.form
     else:
-        user_input = request.json.get('text')
+        options = request.get_json(silent=True) or {}
+        user_input = options.get('text')
         if not user_input:
             return jsonify({"error": "Either 'audio' or 'text' must be provided"}), 400
     print(user_input)
-    # Process user input
-    content_specs = process_user_input(user_input)
-    print(f"those are the content from llm {content_specs['image_prompt']}")
 
-    # Generate image
-    image_response = requests.post(IMAGE_SERVER, json={
-        "prompt": content_specs['image_prompt']
-    })
-    print(f"this is image response : {image_response}")
+    preview = is_enabled(options.get('preview'))
+    upgrade = is_enabled(options.get('upgrade'), default=True)
+    seed = options.get('seed')
+    if seed in (None, ""):
+        seed = DEFAULT_SEED
+    elif str(seed).lower() == "random":
+        seed = random.randrange(2**31)
+    else:
+        seed = int(seed)
+
+    job = job_manager.submit(run_content_job, user_input, audio_bytes, preview=preview, upgrade=upgrade, seed=seed)
+    return jsonify({"job_id": job.id, "status": job.status, "seed": seed, **job_links(job)}), 202
 
-    # Generate video
-    generate_video(content_specs, image_response.content)
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({**job.to_dict(), **job_links(job)})
 
-    # Then generate audio
-    generate_audio(content_specs)
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job.cancel():
+        return jsonify({"error": f"Job is {job.status}"}), 409
+    return jsonify({**job.to_dict(), **job_links(job)})
 
-    # Mix audio and video
-    mixed_video = mix_audio_video(video_bytes=video_result, audio_bytes=audio_result)
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Streams the progress events of a job as server-sent events, until the job is finished.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    result_url = url_for("job_result", job_id=job.id, _external=True)
+    preview_url = url_for("job_preview", job_id=job.id, _external=True)
 
-    # Return final video
-    return Response(mixed_video, mimetype='video/mp4')
+    def stream():
+        for event in job.iter_events():
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            if event.get("done") and job.status == "completed":
+                event = {**event, "url": result_url}
+            if event.get("preview"):
+                event = {**event, "preview_url": preview_url}
+            yield f"data: {json.dumps(event)}\n\n"
 
-def generate_video(specs, image_bytes):
+    return Response(stream(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+@app.route('/progress', methods=['GET'])
+def progress_updates():
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return jsonify({"error": "Missing job_id"}), 400
+    return job_events(job_id)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status != "completed":
+        return jsonify({"error": f"Job is {job.status}", "job_status": job.status}), 409
+    return Response(job.result, mimetype='video/mp4',
+                    headers={"Content-Disposition": "attachment; filename=final_video.mp4"})
+
+@app.route('/jobs/<job_id>/preview', methods=['GET'])
+def job_preview(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.preview is None:
+        return jsonify({"error": "No preview yet", "job_status": job.status}), 409
+    return Response(job.preview, mimetype='video/mp4',
+                    headers={"Content-Disposition": "inline; filename=preview.mp4"})
+
+@app.route('/jobs/<job_id>/upgrade', methods=['POST'])
+def job_upgrade(job_id):
+    """
+    Submits a job rendering the final video of a finished draft-only job.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job.artifacts:
+        return jsonify({"error": "Job has no draft to upgrade", "job_status": job.status}), 409
+    upgrade_job = job_manager.submit(run_upgrade_job, job.artifacts)
+    return jsonify({"job_id": upgrade_job.id, "status": upgrade_job.status, **job_links(upgrade_job)}), 202
+
+def recognize_speech(audio_bytes):
+    """
+    Converts a voice recording to text using the speech server.
+
+    Args:
+        audio_bytes (bytes): The recording as bytes.
+
+    Returns:
+        str: The transcribed text.
+    """
+    response = http.post(SPEECH_SERVER, files={'audio': ('recording.wav', audio_bytes)}, timeout=MODEL_SERVER_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get('user_text', '')
+
+def generate_image(image_prompt):
+    """
+    Generates an image using the image server.
+
+    Args:
+        image_prompt (str): The image prompt from the content specifications.
+
+    Returns:
+        bytes: The generated image as bytes.
+    """
+    print(f"those are the content from llm {image_prompt}")
+    response = http.post(IMAGE_SERVER, json={
+        "prompt": image_prompt
+    }, timeout=MODEL_SERVER_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+def watch_video_progress(task_id, job, stop, stage="video"):
+    """
+    Relays the denoising progress of a video task to the job until `stop` is set.
+    """
+    last_step = None
+    while not stop.wait(VIDEO_PROGRESS_INTERVAL):
+        try:
+            response = http.get(f"{VIDEO_PROGRESS_SERVER}/{task_id}", timeout=10)
+        except Exception as e:
+            print(f"Error checking video progress: {e}")
+            continue
+        if response.status_code != 200:
+            continue
+        progress = response.json()
+        if progress["total"] and progress["step"] != last_step:
+            last_step = progress["step"]
+            job.emit(f"Denoising step {progress['step']}/{progress['total']}",
+                     stage=stage, step=progress["step"], total=progress["total"])
+
+def cancel_video(task_id):
+    """
+    Asks the video server to stop a generation at its next denoising step.
+    """
+    try:
+        http.post(f"{VIDEO_CANCEL_SERVER}/{task_id}", timeout=10)
+    except Exception as e:
+        print(f"Error cancelling video task {task_id}: {e}")
+
+def generate_video(specs, image_bytes, job=None, tier=None, seed=None, stage="video"):
     """
     Generates a video using the video server.
 
     Args:
         specs (dict): Content specifications.
         image_bytes (bytes): The image file as bytes.
+        job (Job): The job to report the denoising progress to, cancelling it cancels the generation.
+        tier (str): The quality tier ("draft", "standard" or "final"), the server default if None.
+        seed (int): The seed of the generation.
+        stage (str): The stage the progress events are reported under.
 
     Returns:
         bytes: The generated video as bytes.
     """
-    global video_result
     files = {'image': ('image.jpg', image_bytes, 'image/jpeg')}
-    response = requests.post(VIDEO_SERVER, 
-        files=files,
-        data={'prompt': specs['video_prompt']}
-    )
-    video_result = response.content
+    # The server stops the generation by itself once we stopped waiting for it
+    data = {'prompt': specs['video_prompt'], 'timeout': MODEL_SERVER_TIMEOUT}
+    if tier is not None:
+        data['tier'] = tier
+    if seed is not None:
+        data['seed'] = seed
+
+    stop = threading.Event()
+    if job is not None:
+        data['task_id'] = job.id
+        job.on_cancel(lambda: cancel_video(job.id))
+        threading.Thread(target=watch_video_progress, args=(job.id, job, stop, stage), daemon=True).start()
+    try:
+        response = http.post(VIDEO_SERVER,
+            files=files,
+            data=data,
+            timeout=MODEL_SERVER_TIMEOUT,
+        )
+    finally:
+        stop.set()
+    if response.status_code == 409:
+        # Cancelled on the video server, by the job or by its timeout
+        raise RuntimeError(f"Video generation cancelled: {response.json().get('error')}")
+    response.raise_for_status()
+    return response.content
+
+def generate_preview(specs, image_bytes, job=None, seed=None):
+    """
+    Generates a draft video and publishes it as the preview of the job.
+
+    Returns:
+        bytes: The draft video as bytes.
+    """
+    video = generate_video(specs, image_bytes, job, tier="draft", seed=seed, stage="preview")
+    if job is not None:
+        job.preview = video
+        job.emit("Draft preview ready", status="success", stage="preview", preview=True)
+    return video
 
 def generate_audio(specs):
     """
@@ -109,12 +392,12 @@ def generate_audio(specs):
     Returns:
         bytes: The generated audio as bytes.
     """
-    global audio_result
-    response = requests.post(AUDIO_SERVER, json={
+    response = http.post(AUDIO_SERVER, json={
         "script": specs['script'],
         "audio_prompt": specs['audio_prompt']
-    })
-    audio_result = response.content
+    }, timeout=MODEL_SERVER_TIMEOUT)
+    response.raise_for_status()
+    return response.content
 
 if __name__ == '__main__':
-    app.run(port=5000, threaded=True)
\ No newline at end of file
+    app.run(port=5000, threaded=True)
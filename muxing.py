@@ -0,0 +1,81 @@
+import os
+import re
+import subprocess
+import tempfile
+
+try:
+    # Bundled with moviepy, so the same binary is used on every server
+    from imageio_ffmpeg import get_ffmpeg_exe
+except ImportError:
+    def get_ffmpeg_exe():
+        return "ffmpeg"
+
+
+def probe_video(video_path: str) -> dict:
+    """
+    Reads the video codec and duration of a video file from the ffmpeg stream summary.
+
+    Args:
+        video_path (str): The path of the video file.
+
+    Returns:
+        dict: The "codec" (e.g. "h264", None if unknown) and "duration" in seconds (None if unknown).
+    """
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-hide_banner", "-i", video_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    summary = result.stderr.decode(errors="replace")
+
+    codec = re.search(r"Stream #\d+:\d+.*?: Video: (\w+)", summary)
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", summary)
+    return {
+        "codec": codec.group(1) if codec else None,
+        "duration": (
+            int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3))
+            if duration else None
+        ),
+    }
+
+
+def mux_audio_video(video_bytes: bytes, audio_bytes: bytes) -> bytes:
+    """
+    Muxes an audio track into a video, keeping the duration of the video.
+
+    The audio is piped to ffmpeg and the video goes through a per-call scratch directory (MP4 input needs
+    to be seekable), so concurrent calls never share files. H.264 video is stream-copied and only the audio
+    is encoded, other codecs are re-encoded to H.264.
+
+    Args:
+        video_bytes (bytes): The video file as bytes.
+        audio_bytes (bytes): The audio file as bytes (any format ffmpeg can read, WAV from the speech server).
+
+    Returns:
+        bytes: The muxed MP4 file as bytes.
+    """
+    with tempfile.TemporaryDirectory(prefix="mux_") as scratch_dir:
+        video_path = os.path.join(scratch_dir, "video.mp4")
+        output_path = os.path.join(scratch_dir, "output.mp4")
+        with open(video_path, "wb") as f:
+            f.write(video_bytes)
+
+        video_info = probe_video(video_path)
+        if video_info["codec"] == "h264":
+            video_codec = ["-c:v", "copy"]
+        else:
+            video_codec = ["-c:v", "libx264", "-preset", "fast", "-crf", "23", "-pix_fmt", "yuv420p"]
+        duration = ["-t", f"{video_info['duration']:.3f}"] if video_info["duration"] else []
+
+        ffmpeg_command = [
+            get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error",
+            "-i", video_path, "-i", "pipe:0",
+            "-map", "0:v:0", "-map", "1:a:0",
+            *video_codec, "-c:a", "aac", *duration,
+            "-movflags", "+faststart", "-y", output_path,
+        ]
+        result = subprocess.run(ffmpeg_command, input=audio_bytes, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to mux audio and video: {result.stderr.decode(errors='replace')}")
+
+        with open(output_path, "rb") as f:
+            return f.read()
@@ -0,0 +1,124 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# A unit of work: `fn` is called with the results of `deps` (in order) once they are all available,
+# and its return value is published under `name`.
+Stage = namedtuple("Stage", ["name", "fn", "deps"])
+
+
+class StageBoard:
+    """
+    Holds the results of one request's stages, keyed by name.
+
+    Every key resolves exactly once, either with a value or with an exception. Stages can also publish
+    intermediate results under their own keys before they finish, so downstream stages can start early.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def future(self, key: str) -> Future:
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = Future()
+            return self._futures[key]
+
+    def publish(self, key: str, value):
+        """Resolves `key` with `value`. Publishing an already resolved key is ignored."""
+        future = self.future(key)
+        if not future.done():
+            try:
+                future.set_result(value)
+            except Exception:
+                pass
+
+    def fail(self, key: str, error: BaseException):
+        """Resolves `key` with an exception, which is re-raised to whoever depends on it."""
+        future = self.future(key)
+        if not future.done():
+            try:
+                future.set_exception(error)
+            except Exception:
+                pass
+
+    def get(self, key: str, timeout: float = None):
+        """Blocks until `key` is resolved and returns its value (or raises its exception)."""
+        return self.future(key).result(timeout=timeout)
+
+
+def run_stages(stages, executor: ThreadPoolExecutor, board: StageBoard = None, listener=None) -> StageBoard:
+    """
+    Runs a dependency graph of stages, starting every stage as soon as its dependencies are resolved.
+
+    Independent stages run concurrently on `executor`. No thread is held while a stage waits on its
+    dependencies, so a shared executor can serve many requests at once.
+
+    Args:
+        stages (list[Stage]): The stages of the request.
+        executor (ThreadPoolExecutor): The executor the stages run on.
+        board (StageBoard): The board to publish to, a new one is created if None.
+        listener (callable): Called as `listener(stage_name, event, error)` when a stage is "started",
+            "completed" or "failed".
+
+    Returns:
+        StageBoard: The board the results are published to.
+    """
+    board = board or StageBoard()
+
+    def notify(stage, event, error=None):
+        if listener is not None:
+            try:
+                listener(stage.name, event, error)
+            except Exception as e:
+                print(f"Stage listener failed: {e}")
+
+    def run(stage):
+        try:
+            inputs = [board.get(dep) for dep in stage.deps]
+            notify(stage, "started")
+            board.publish(stage.name, stage.fn(*inputs))
+        except BaseException as e:
+            board.fail(stage.name, e)
+            notify(stage, "failed", e)
+        else:
+            notify(stage, "completed")
+
+    def schedule(stage):
+        pending = [board.future(dep) for dep in stage.deps]
+        if not pending:
+            executor.submit(run, stage)
+            return
+
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def on_done(future):
+            if future.exception() is not None:
+                board.fail(stage.name, future.exception())
+                return
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                executor.submit(run, stage)
+
+        for future in pending:
+            future.add_done_callback(on_done)
+
+    for stage in stages:
+        schedule(stage)
+    return board
+
+
+def make_http_session(pool_size: int = 32) -> requests.Session:
+    """Returns a session keeping alive up to `pool_size` connections per model server."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
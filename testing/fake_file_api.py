@@ -0,0 +1,68 @@
+# File: fake_file_api.py (stand-in for the Gemini File API and video analysis on port 5006)
+# Run it and start Trend_analyser/TrendAnalyser.py with FILE_API_URL=http://localhost:5006 to test the analysis
+# pipeline without the real API.
+from flask import Flask, request, jsonify
+import json
+import threading
+import time
+import uuid
+
+app = Flask(__name__)
+
+ACTIVATION_DELAY = 8  # Seconds an uploaded file stays in processing
+ANALYSIS_DELAY = 3  # Seconds an analysis takes
+
+ANALYSIS = {
+    "viral_elements": "A strong hook in the first second, fast cuts synced to a trending sound and a clear payoff.",
+    "recommendations": "Open on the result, keep the video under 20 seconds and end with a question to drive comments.",
+    "metadata_summary": "A short product demo with high engagement relative to the account size.",
+    "topics_and_hashtags": ["#TechTok", "#gadgets", "#unboxing"]
+}
+
+files = {}  # name -> upload time
+files_lock = threading.Lock()
+
+
+def state_of(name: str) -> str:
+    with files_lock:
+        uploaded_at = files.get(name)
+    if uploaded_at is None:
+        return "FAILED"
+    return "ACTIVE" if time.time() - uploaded_at >= ACTIVATION_DELAY else "PROCESSING"
+
+
+@app.route('/files', methods=['POST'])
+def upload():
+    request.files["file"].read()
+    name = f"files/{uuid.uuid4().hex[:12]}"
+    with files_lock:
+        files[name] = time.time()
+    print(f"Uploaded {name}")
+    return jsonify({"name": name})
+
+
+@app.route('/files', methods=['GET'])
+def list_files():
+    names = [name for name in request.args.get("names", "").split(",") if name]
+    print(f"States of {len(names)} files")
+    return jsonify({"files": [{"name": name, "state": state_of(name)} for name in names]})
+
+
+@app.route('/files/<path:name>', methods=['DELETE'])
+def delete(name):
+    with files_lock:
+        files.pop(name, None)
+    return jsonify({"deleted": name})
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    name = request.get_json()["file"]
+    if state_of(name) != "ACTIVE":
+        return jsonify({"error": f"File {name} is not active"}), 400
+    time.sleep(ANALYSIS_DELAY)
+    return jsonify({"text": json.dumps(ANALYSIS)})
+
+
+if __name__ == '__main__':
+    app.run(port=5006, threaded=True)
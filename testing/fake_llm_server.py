@@ -0,0 +1,78 @@
+# File: fake_llm_server.py (stand-in for the Gemini REST API on port 5005)
+# Run it and start main.py with GENAI_API_ENDPOINT=http://localhost:5005 to test without the real API.
+from flask import Flask, request, jsonify, Response
+import json
+import time
+
+app = Flask(__name__)
+
+CHUNK_SIZE = 40  # Characters per streamed chunk
+CHUNK_DELAY = 0.05  # Seconds between two streamed chunks
+
+PRODUCT_INFO = {
+    "product_name": "ThunderBuds Pro Wireless Earbuds",
+    "key_features": "Enjoy 40-hour battery life, crystal-clear sound quality, and advanced noise cancellation.",
+    "target_audience": "Young professionals and fitness enthusiasts",
+    "call_to_action": "Upgrade your sound today!"
+}
+
+CONTENT_SPECS = {
+    "image_prompt": "Sleek black wireless earbuds on a marble table, soft studio lighting, shallow depth of field.",
+    "video_prompt": "Slow orbit around the earbuds charging case as it opens, warm light, product in sharp focus.",
+    "audio_prompt": "An upbeat, confident young voice with a friendly and energetic tone.",
+    "script": "Forty hours of pure sound. No wires, no noise, just you and your music. ThunderBuds Pro.",
+    "caption": "40 hours of pure sound 🎧 #ThunderBuds #NoiseCancelling #TechTok"
+}
+
+
+def answer_for(system_instruction: str) -> dict:
+    """Picks the canned answer matching the system prompt of the request."""
+    if "Extract product details" in system_instruction:
+        return PRODUCT_INFO
+    if "product_info" in system_instruction:
+        return {**CONTENT_SPECS, "product_info": PRODUCT_INFO}
+    return CONTENT_SPECS
+
+
+def candidate(text: str, finished: bool) -> dict:
+    response = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+    if finished:
+        response["candidates"][0]["finishReason"] = "STOP"
+    return response
+
+
+@app.route('/v1beta/models/<path:model_action>', methods=['POST'])
+def models_route(model_action):
+    model, _, action = model_action.partition(":")
+    body = request.get_json()
+    system_parts = (body.get("systemInstruction") or body.get("system_instruction") or {}).get("parts", [])
+    text = json.dumps(answer_for(" ".join(part.get("text", "") for part in system_parts)))
+    print(f"{action} on {model}")
+
+    if action == "generateContent":
+        return jsonify(candidate(text, finished=True))
+    if action != "streamGenerateContent":
+        return jsonify({"error": {"code": 404, "message": f"Unknown action {action}"}}), 404
+
+    chunks = [text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+    # The REST transport reads the stream as a JSON array, or as SSE with alt=sse
+    sse = request.args.get("alt") == "sse"
+
+    def generate():
+        if not sse:
+            yield "["
+        for index, chunk in enumerate(chunks):
+            time.sleep(CHUNK_DELAY)
+            data = json.dumps(candidate(chunk, finished=index == len(chunks) - 1))
+            if sse:
+                yield f"data: {data}\r\n\r\n"
+            else:
+                yield ("," if index else "") + data
+        if not sse:
+            yield "]"
+
+    return Response(generate(), mimetype='text/event-stream' if sse else 'application/json')
+
+
+if __name__ == '__main__':
+    app.run(port=5005, threaded=True)
@@ -1,6 +1,7 @@
 # File: test_server.py (Flask server on port 5003)
 from flask import Flask, request, jsonify, render_template_string, Response
 import requests
+import json
 
 app = Flask(__name__)
 BASE_SERVER = "http://localhost:5000"
@@ -130,17 +131,22 @@ HTML_TEMPLATE = """
         }
 
         function handleResponse(response) {
-            if (response.url) {
-                addProgressStep('✅ Processing complete!', 'success');
-                const link = document.createElement('a');
-                link.href = response.url;
-                link.download = 'final_video.mp4';
-                link.className = 'btn btn-success mt-2';
-                link.textContent = 'Download Video';
-                document.getElementById('progress-steps').appendChild(link);
+            if (response.error) return showError(response.error);
+            if (response.job_id) {
+                showProgress(`Job ${response.job_id} submitted`);
+                listenProgress(response.job_id);
             }
         }
 
+        function showDownload(url) {
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = 'final_video.mp4';
+            link.className = 'btn btn-success mt-2';
+            link.textContent = 'Download Video';
+            document.getElementById('progress-steps').appendChild(link);
+        }
+
         function showProgress(message) {
             document.getElementById('progress-container').style.display = 'block';
             addProgressStep(message);
@@ -157,12 +163,18 @@ HTML_TEMPLATE = """
             addProgressStep(`❌ ${message}`, 'danger');
         }
 
-        // Listen for server-sent events
-        const eventSource = new EventSource('/progress');
-        eventSource.onmessage = (event) => {
-            const data = JSON.parse(event.data);
-            addProgressStep(data.message, data.status);
-        };
+        // Listen for the server-sent events of a job
+        function listenProgress(jobId) {
+            const eventSource = new EventSource(`/progress?job_id=${jobId}`);
+            eventSource.onmessage = (event) => {
+                const data = JSON.parse(event.data);
+                addProgressStep(data.message, data.status);
+                if (data.done) {
+                    eventSource.close();
+                    if (data.url) showDownload(data.url);
+                }
+            };
+        }
     </script>
 </body>
 </html>
@@ -174,27 +186,43 @@ def index():
 
 @app.route('/generate_content', methods=['POST'])
 def proxy_content():
-    # Forward request to base server
-    files = {'audio': request.files.get('audio')} if 'audio' in request.files else None
-    data = request.form if files else request.json
-    print(data)
-    response = requests.post(
-        f"{BASE_SERVER}/generate_content",
-        files=files,
-        json=data
-    )
+    # Forward request to base server, it answers right away with the job id
+    if 'audio' in request.files:
+        audio = request.files['audio']
+        response = requests.post(
+            f"{BASE_SERVER}/generate_content",
+            files={'audio': (audio.filename, audio.stream, audio.mimetype)}
+        )
+    else:
+        response = requests.post(f"{BASE_SERVER}/generate_content", json=request.json)
     print(f"this is response : {response}")
-    
+
     return jsonify(response.json()), response.status_code
 
 @app.route('/progress')
 def progress_updates():
-    # This would need proper server-sent events implementation
-    # Simplified for demonstration
+    # Relay the server-sent events of the job, pointing the download link to this server
+    job_id = request.args.get('job_id', '')
+    upstream = requests.get(f"{BASE_SERVER}/progress", params={'job_id': job_id}, stream=True)
+
     def generate():
-        yield "data: {}\n\n"
-        
+        with upstream:
+            for line in upstream.iter_lines(decode_unicode=True):
+                if line.startswith("data: "):
+                    event = json.loads(line[len("data: "):])
+                    if event.get("url"):
+                        event["url"] = f"/jobs/{job_id}/result"
+                    line = f"data: {json.dumps(event)}"
+                yield line + "\n"
+
     return Response(generate(), mimetype='text/event-stream')
 
+@app.route('/jobs/<job_id>/result')
+def proxy_result(job_id):
+    upstream = requests.get(f"{BASE_SERVER}/jobs/{job_id}/result", stream=True)
+    return Response(upstream.iter_content(chunk_size=1 << 16), status=upstream.status_code,
+                    mimetype=upstream.headers.get('Content-Type'),
+                    headers={"Content-Disposition": "attachment; filename=final_video.mp4"})
+
 if __name__ == '__main__':
-    app.run(port=5003, debug=True)
\ No newline at end of file
+    app.run(port=5003, debug=True)
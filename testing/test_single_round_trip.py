@@ -0,0 +1,67 @@
+# Runs the single round trip of Gemenai_workflow against fake_llm_server.py, from the repository root:
+# python -m pytest testing/test_single_round_trip.py
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+genai = pytest.importorskip("google.generativeai")
+pytest.importorskip("dotenv")
+
+from werkzeug.serving import make_server
+
+import fake_llm_server
+from Gemenai_workflow import Gemanai_workflow as workflow
+from Gemenai_workflow.spec_cache import SpecCache
+
+
+@pytest.fixture
+def llm_server(monkeypatch):
+    served = []
+    candidate = fake_llm_server.candidate
+
+    def counted_candidate(text, finished):
+        # Records the streamed chunks as they are sent
+        served.append(finished)
+        return candidate(text, finished)
+
+    monkeypatch.setattr(fake_llm_server, "candidate", counted_candidate)
+    server = make_server("127.0.0.1", 0, fake_llm_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    genai.configure(api_key="local", transport="rest", client_options={"api_endpoint": f"http://127.0.0.1:{server.port}"})
+    yield served
+    server.shutdown()
+
+
+@pytest.fixture
+def empty_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(workflow, "spec_cache", SpecCache(cache_dir=str(tmp_path), ttl=60))
+
+
+def test_image_prompt_arrives_before_the_stream_ends(llm_server, empty_cache):
+    published = []
+
+    def on_field(name, value):
+        published.append((name, value, list(llm_server), time.monotonic()))
+
+    specs = workflow.process_user_input_single("Wireless earbuds", "Trends", on_field=on_field)
+    finished_at = time.monotonic()
+
+    name, value, served, published_at = published[0]
+    assert name == "image_prompt" and value == fake_llm_server.CONTENT_SPECS["image_prompt"]
+    # Published while chunks were still to come, not once the whole answer was received
+    assert served and not served[-1]
+    assert finished_at - published_at > fake_llm_server.CHUNK_DELAY
+    assert sorted(name for name, *_ in published) == sorted(workflow.CONTENT_FIELDS)
+    assert {field: specs[field] for field in workflow.CONTENT_FIELDS} == fake_llm_server.CONTENT_SPECS
+
+
+def test_rejected_answer_keeps_the_published_fields(llm_server, empty_cache, monkeypatch):
+    fallback = {**fake_llm_server.CONTENT_SPECS, "image_prompt": "Another image"}
+    monkeypatch.setattr(workflow, "validate_content_specs", lambda specs: ["rejected"])
+    monkeypatch.setattr(workflow, "process_user_input", lambda user_input, trends: fallback)
+    published = {}
+    specs = workflow.process_user_input_single("Wireless earbuds", "Trends", on_field=published.__setitem__)
+    # The image may already be generated from the streamed prompt, the specs keep it
+    assert specs["image_prompt"] == published["image_prompt"] == fake_llm_server.CONTENT_SPECS["image_prompt"]